@@ -4,16 +4,29 @@ import streamlit as st
 import base64
 import os
 import re
+import time
 import warnings
 from html import escape
 
 # ====== BACKEND LLM ======
 try:
-    from openai_backend import responder_pergunta
+    from openai_backend import (
+        responder_pergunta, responder_pergunta_stream, iniciar_aquecimento, estado_aquecimento,
+        WARMUP_WAIT_TIMEOUT,
+    )
+    iniciar_aquecimento()  # modelos e índice carregam em segundo plano enquanto a página sobe
 except ImportError:
     def responder_pergunta(pergunta):
         return "Erro: O módulo 'openai_backend' ou a função 'responder_pergunta' não foi encontrado."
 
+    def responder_pergunta_stream(pergunta):
+        yield responder_pergunta(pergunta)
+
+    def estado_aquecimento():
+        return {"estado": "pronto", "etapa": None, "segundos": 0.0, "erro": None}
+
+    WARMUP_WAIT_TIMEOUT = 0
+
 warnings.filterwarnings("ignore", message=".*torch.classes.*")
 
 # ====== SUPABASE (tolerante a falhas) ======
@@ -1258,27 +1271,54 @@ with st.sidebar:
 
             st.markdown('</div>', unsafe_allow_html=True)
 
+    # Prontidão do backend (aquecimento em segundo plano iniciado no boot)
+    _aq = estado_aquecimento()
+    if _aq["estado"] == "aquecendo":
+        st.caption(f"⏳ Preparando a base de conhecimento… ({_aq['etapa'] or 'iniciando'}, {_aq['segundos']:.0f}s)")
+    elif _aq["estado"] == "falhou":
+        st.caption("⚠️ Pré-carregamento falhou; a primeira pergunta pode demorar mais.")
+
 # ====== RENDER MENSAGENS ======
-msgs_html = []
-for pergunta, resposta in st.session_state.historico:
-    p_html = linkify(pergunta)
-    msgs_html.append(f'<div class="message-row user"><div class="bubble user">{p_html}</div></div>')
-    if resposta:
-        r_html = linkify(resposta)
-        msgs_html.append(f'<div class="message-row assistant"><div class="bubble assistant">{r_html}</div></div>')
+def texto_aquecimento() -> str | None:
+    aq = estado_aquecimento()
+    if aq["estado"] != "aquecendo":
+        return None
+    etapa = aq["etapa"] or "iniciando"
+    return f"Preparando a base de conhecimento ({etapa}, {aq['segundos']:.0f}s)… sua pergunta será respondida em seguida."
+
+def montar_chat_html(resposta_parcial: str | None = None, aviso: str | None = None) -> str:
+    msgs_html = []
+    for pergunta, resposta in st.session_state.historico:
+        p_html = linkify(pergunta)
+        msgs_html.append(f'<div class="message-row user"><div class="bubble user">{p_html}</div></div>')
+        if resposta:
+            r_html = linkify(resposta)
+            msgs_html.append(f'<div class="message-row assistant"><div class="bubble assistant">{r_html}</div></div>')
+
+    if st.session_state.awaiting_answer and st.session_state.answering_started:
+        if resposta_parcial:
+            r_html = linkify(resposta_parcial)
+            msgs_html.append(f'<div class="message-row assistant"><div class="bubble assistant">{r_html}</div></div>')
+        elif aviso:
+            msgs_html.append(
+                '<div class="message-row assistant"><div class="bubble assistant">'
+                f'<span class="spinner"></span> {escape(aviso)}</div></div>'
+            )
+        else:
+            msgs_html.append('<div class="message-row assistant"><div class="bubble assistant"><span class="spinner"></span></div></div>')
 
-if st.session_state.awaiting_answer and st.session_state.answering_started:
-    msgs_html.append('<div class="message-row assistant"><div class="bubble assistant"><span class="spinner"></span></div></div>')
+    if not msgs_html:
+        msgs_html.append('<div style="color:#9ca3af; text-align:center; margin-top:20px;">.</div>')
 
-if not msgs_html:
-    msgs_html.append('<div style="color:#9ca3af; text-align:center; margin-top:20px;">.</div>')
+    msgs_html.append('<div id="chatEnd" style="height:1px;"></div>')
+    return f'<div class="content"><div id="chatCard" class="chat-card">{"".join(msgs_html)}</div></div>'
 
-msgs_html.append('<div id="chatEnd" style="height:1px;"></div>')
 
-st.markdown(
-    f'<div class="content"><div id="chatCard" class="chat-card">{"".join(msgs_html)}</div></div>',
-    unsafe_allow_html=True
-)
+STREAM_RENDER_INTERVAL = 0.05   # s entre remontagens do chat durante o streaming
+STREAM_RENDER_MIN_CHARS = 200   # ...ou antes disso, se já chegaram tantos caracteres novos
+
+chat_area = st.empty()
+chat_area.markdown(montar_chat_html(), unsafe_allow_html=True)
 
 # ====== JS (autoscroll simples) ======
 st.markdown("""
@@ -1358,7 +1398,28 @@ if st.session_state.awaiting_answer and not st.session_state.answering_started:
     do_rerun()
 
 if st.session_state.awaiting_answer and st.session_state.answering_started:
-    resposta = responder_pergunta(st.session_state.pending_question)
+    # Enquanto o aquecimento compartilhado roda, mostra a etapa em vez de iniciar outra carga
+    aviso = texto_aquecimento()
+    limite_espera = time.time() + WARMUP_WAIT_TIMEOUT  # mesmo teto da espera no backend
+    while aviso and time.time() < limite_espera:
+        chat_area.markdown(montar_chat_html(aviso=aviso), unsafe_allow_html=True)
+        time.sleep(0.5)
+        aviso = texto_aquecimento()
+
+    # Streaming: os trechos recebidos do backend aparecem na bolha do assistente. O chat inteiro
+    # é remontado no máximo a cada STREAM_RENDER_INTERVAL s (ou STREAM_RENDER_MIN_CHARS novos),
+    # não a cada delta; ao final, uma renderização completa com a resposta inteira.
+    partes = []
+    ultimo_render, chars_pendentes = 0.0, 0
+    for trecho in responder_pergunta_stream(st.session_state.pending_question):
+        partes.append(trecho)
+        chars_pendentes += len(trecho)
+        agora = time.perf_counter()
+        if agora - ultimo_render >= STREAM_RENDER_INTERVAL or chars_pendentes >= STREAM_RENDER_MIN_CHARS:
+            chat_area.markdown(montar_chat_html("".join(partes)), unsafe_allow_html=True)
+            ultimo_render, chars_pendentes = agora, 0
+    resposta = "".join(partes)
+    chat_area.markdown(montar_chat_html(resposta), unsafe_allow_html=True)
     idx = st.session_state.pending_index
     if idx is not None and 0 <= idx < len(st.session_state.historico):
         pergunta_fix = st.session_state.historico[idx][0]
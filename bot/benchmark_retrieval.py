@@ -0,0 +1,358 @@
+# benchmark_retrieval.py — Benchmark offline da recuperação (sem Drive e sem LLM)
+#
+# Uso:
+#   python benchmark_retrieval.py --perguntas ../data/benchmark_perguntas.jsonl --corpus ../data
+#   python benchmark_retrieval.py ... --set TOP_N_ANN=30 --set CE_WEIGHT=0.3 --json resultado.json
+#   python benchmark_retrieval.py ... --ann      (recall x latência de flat / HNSW / IVF-PQ)
+#   python benchmark_retrieval.py ... --cache-ce (latência com o cache de escores do CE, à parte)
+#
+# Formato das perguntas (JSON ou JSONL), uma por registro:
+#   {"pergunta": "Como solicitar toner?", "documentos": ["PO.07 - Compras"]}
+# Um documento esperado conta como encontrado quando o nome normalizado do documento
+# recuperado é igual a ele ou o contém (ex.: "PO.08" casa com "PO.08 - Controle de Pessoal").
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+import openai_backend as ob
+
+ETAPAS = ["families", "mode", "encode", "search", "bm25", "lexical", "dedup", "rerank"]
+
+
+def carregar_perguntas(path: str) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        loaded = ob._load_jsonish(f.read())
+    if isinstance(loaded, dict):
+        loaded = loaded.get("perguntas") or [loaded]
+
+    casos = []
+    for item in loaded:
+        if not isinstance(item, dict):
+            continue
+        pergunta = (item.get("pergunta") or item.get("question") or "").strip()
+        docs = item.get("documentos") or item.get("documento") or item.get("docs") or []
+        if isinstance(docs, str):
+            docs = [docs]
+        if pergunta and docs:
+            casos.append({"pergunta": pergunta, "documentos": [str(d) for d in docs]})
+    return casos
+
+
+def _desativar_llm():
+    def _bloqueado(*_args, **_kwargs):
+        raise RuntimeError("Chamadas ao LLM estão desativadas no benchmark.")
+    ob.session.post = _bloqueado
+
+
+# Lidos só na importação do backend (ou controlados pelo próprio benchmark): --set não teria efeito.
+_SEM_OVERRIDE = {
+    "TELEMETRY_RING_SIZE": "usado só na importação do backend",
+    "TELEMETRY_BUCKETS": "usado só na importação do backend",
+    "TELEMETRY_JSONL_PATH": "usado só na importação do backend",
+    "USE_CE_SCORE_CACHE": "o benchmark mede sem o cache; use --cache-ce",
+}
+
+
+def _aplicar_overrides(pares: list[str]):
+    for par in pares or []:
+        nome, _, valor = par.partition("=")
+        nome = nome.strip()
+        if not nome.isupper() or not hasattr(ob, nome):
+            raise SystemExit(f"Parâmetro desconhecido em --set: {nome}")
+        if nome in _SEM_OVERRIDE:
+            raise SystemExit(f"--set {nome} não tem efeito: {_SEM_OVERRIDE[nome]}")
+        try:
+            setattr(ob, nome, json.loads(valor))
+        except ValueError:
+            setattr(ob, nome, valor)
+
+
+def _docs_ranqueados(blocos: list[dict]) -> list[str]:
+    vistos = []
+    for b in blocos:
+        nome = ob._norm_key(ob._base_document_name(b.get("pagina", "?")))
+        if nome not in vistos:
+            vistos.append(nome)
+    return vistos
+
+
+def _casa(esperado: str, recuperado: str) -> bool:
+    return esperado == recuperado or esperado in recuperado
+
+
+def _metricas_caso(esperados: list[str], ranking: list[str], ks: list[int]) -> dict:
+    esperados = [ob._norm_key(ob.sanitize_doc_name(d)) for d in esperados]
+    recall = {}
+    for k in ks:
+        top = ranking[:k]
+        achados = sum(1 for e in esperados if any(_casa(e, r) for r in top))
+        recall[k] = achados / len(esperados)
+
+    rr = 0.0
+    for pos, r in enumerate(ranking, start=1):
+        if any(_casa(e, r) for e in esperados):
+            rr = 1.0 / pos
+            break
+    return {"recall": recall, "rr": rr}
+
+
+def _limpar_cache_ce():
+    with ob._CE_SCORE_CACHE_LOCK:
+        ob._CE_SCORE_CACHE.clear()
+        ob._CE_SCORE_CACHE_STATE.update({"version": None, "hits": 0, "misses": 0})
+
+
+def executar_benchmark(casos: list[dict], ks: list[int], repeticoes: int = 1, aquecimento: int = 1,
+                       cache_ce: bool = False) -> dict:
+    """Recall/MRR e latência por etapa. Por padrão sem o cache de escores do CE: com ele, o
+    aquecimento e as repetições 2..N não chamariam ce.predict e o rerank sairia quase de graça."""
+    cache_anterior = ob.USE_CE_SCORE_CACHE
+    ob.USE_CE_SCORE_CACHE = cache_ce
+    _limpar_cache_ce()
+    try:
+        resultado = _executar_benchmark(casos, ks, repeticoes, aquecimento)
+    finally:
+        ob.USE_CE_SCORE_CACHE = cache_anterior
+    resultado["resumo"]["cache_ce"] = cache_ce
+    if cache_ce:
+        resultado["resumo"]["cache_ce_stats"] = ob.ce_score_cache_stats()
+    return resultado
+
+
+def _executar_benchmark(casos: list[dict], ks: list[int], repeticoes: int, aquecimento: int) -> dict:
+    if casos and aquecimento > 0:
+        for caso in casos[:aquecimento]:
+            ob._prepare_context_for_query(caso["pergunta"], ob._parse_tipo_contratacao(caso["pergunta"]))
+
+    tempos: dict[str, list[float]] = {etapa: [] for etapa in ETAPAS + ["total"]}
+    por_caso = []
+
+    for caso in casos:
+        pergunta = caso["pergunta"]
+        tipo = ob._parse_tipo_contratacao(pergunta)
+        for rep in range(repeticoes):
+            with ob.capturar_tempos() as spans:
+                t0 = time.perf_counter()
+                families = ob._resolve_requested_families(pergunta, max_matches=2)
+                query_mode = ob._detect_query_mode(pergunta, families=families)
+                _mode, _fams, _reranked, blocos = ob._prepare_context_for_query(
+                    pergunta, tipo, families=families, query_mode=query_mode
+                )
+                total = time.perf_counter() - t0
+
+            for etapa in ETAPAS:
+                tempos[etapa].append(spans.get(etapa, 0.0))
+            tempos["total"].append(total)
+
+            if rep == 0:
+                ranking = _docs_ranqueados(blocos)
+                m = _metricas_caso(caso["documentos"], ranking, ks)
+                por_caso.append({
+                    "pergunta": pergunta,
+                    "modo": query_mode,
+                    "esperados": caso["documentos"],
+                    "recuperados": ranking,
+                    "recall": m["recall"],
+                    "rr": m["rr"],
+                })
+
+    n = max(1, len(por_caso))
+    resumo = {
+        "n_perguntas": len(por_caso),
+        "recall": {k: sum(c["recall"][k] for c in por_caso) / n for k in ks},
+        "mrr": sum(c["rr"] for c in por_caso) / n,
+        "latencia_ms": {
+            etapa: {
+                p: float(np.percentile(np.asarray(valores) * 1000.0, p)) if valores else 0.0
+                for p in (50, 95, 99)
+            }
+            for etapa, valores in tempos.items()
+        },
+    }
+    return {"resumo": resumo, "casos": por_caso}
+
+
+def _tabela_latencia(resumo: dict) -> list[str]:
+    if resumo.get("cache_ce"):
+        ce = resumo.get("cache_ce_stats") or {}
+        titulo = (f"Latência COM cache de escores do CE ({ce.get('hits', 0)} hits / "
+                  f"{ce.get('misses', 0)} misses de pares; não comparável ao rerank sem cache)")
+    else:
+        titulo = "Latência sem cache de escores do CE (todo rerank chama ce.predict)"
+    linhas = [titulo, f"{'etapa':<10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}"]
+    for etapa, pct in resumo["latencia_ms"].items():
+        linhas.append(f"{etapa:<10} {pct[50]:>10.2f} {pct[95]:>10.2f} {pct[99]:>10.2f}")
+    return linhas
+
+
+def formatar_relatorio(resultado: dict, ks: list[int]) -> str:
+    resumo = resultado["resumo"]
+    linhas = ["=== Benchmark de recuperação ==="]
+    linhas.append(
+        f"TOP_N_ANN: {ob.TOP_N_ANN} | TOP_K: {ob.TOP_K} | GROUP_WINDOW: {ob.GROUP_WINDOW} | "
+        f"CE_WEIGHT: {ob.CE_WEIGHT} | EMB_WEIGHT: {ob.EMB_WEIGHT} | USE_CE: {ob.USE_CE} | USE_BM25: {ob.USE_BM25}"
+    )
+    linhas.append(f"Perguntas: {resumo['n_perguntas']}")
+    linhas.append("")
+    for k in ks:
+        linhas.append(f"recall@{k}: {resumo['recall'][k]:.3f}")
+    linhas.append(f"MRR: {resumo['mrr']:.3f}")
+    linhas.append("")
+    linhas.extend(_tabela_latencia(resumo))
+
+    falhas = [c for c in resultado["casos"] if c["rr"] == 0.0]
+    if falhas:
+        linhas.append("")
+        linhas.append(f"Perguntas sem documento esperado no ranking: {len(falhas)}")
+        for c in falhas:
+            linhas.append(f"- {c['pergunta']} | esperado={c['esperados']} | recuperado={c['recuperados'][:3]}")
+    return "\n".join(linhas)
+
+
+ANN_VARIANTES = [
+    ("flat", {}),
+    ("hnsw", {"ef_search": 16}),
+    ("hnsw", {"ef_search": 32}),
+    ("hnsw", {"ef_search": 64}),
+    ("hnsw", {"ef_search": 128}),
+    ("ivfpq", {"nprobe": 1}),
+    ("ivfpq", {"nprobe": 4}),
+    ("ivfpq", {"nprobe": 16}),
+    ("ivfpq", {"nprobe": 64}),
+]
+
+
+def relatorio_ann(emb, consultas, k: int = 10) -> list[dict]:
+    """Recall@k de cada tipo de índice contra a busca exata, com latência por consulta."""
+    import faiss
+
+    emb = np.ascontiguousarray(emb, dtype=np.float32)
+    consultas = np.ascontiguousarray(consultas, dtype=np.float32)
+    n, dim = emb.shape
+    k = min(k, n)
+    exato = np.argsort(-(consultas @ emb.T), axis=1)[:, :k]
+
+    linhas = []
+    construidos = {}
+    medidos = set()
+    for tipo, ajuste in ANN_VARIANTES:
+        if tipo not in construidos:
+            params = ob._ann_params(n, dim, tipo, min_blocks=0)
+            t0 = time.perf_counter()
+            index, params = ob.build_ann_index(emb, params)
+            construidos[tipo] = (index, params, time.perf_counter() - t0,
+                                 int(faiss.serialize_index(index).nbytes))
+        index, params, t_build, nbytes = construidos[tipo]
+        params = dict(params, **{c: v for c, v in ajuste.items() if c in params})
+        if "nprobe" in params:
+            # em corpus pequeno nlist encolhe: nprobe acima dele repetiria a mesma varredura
+            params["nprobe"] = min(int(params["nprobe"]), int(params["nlist"]))
+        chave = (tipo, tuple(sorted(params.items())))
+        if chave in medidos:
+            continue
+        medidos.add(chave)
+        ob._apply_ann_search_params(index, params)
+
+        tempos = []
+        achados = 0
+        for r in range(consultas.shape[0]):
+            t0 = time.perf_counter()
+            _D, I = index.search(consultas[r:r + 1], k)
+            tempos.append(time.perf_counter() - t0)
+            achados += len(set(I[0].tolist()) & set(exato[r].tolist()))
+
+        ms = np.asarray(tempos) * 1000.0
+        linhas.append({
+            "tipo": tipo,
+            "params": {c: v for c, v in params.items() if c != "type"},
+            "recall": achados / float(consultas.shape[0] * k),
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)),
+            "build_s": t_build,
+            "mb": nbytes / 1e6,
+        })
+    return linhas
+
+
+def formatar_relatorio_ann(linhas: list[dict], n: int, k: int) -> str:
+    out = [f"=== Índices ANN ({n} vetores, recall@{k} contra busca exata) ==="]
+    out.append(f"{'tipo':<7} {'parâmetros':<42} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8} {'build s':>8} {'MB':>8}")
+    for l in linhas:
+        params = ", ".join(f"{c}={v}" for c, v in l["params"].items())
+        out.append(
+            f"{l['tipo']:<7} {params:<42} {l['recall']:>7.3f} {l['p50_ms']:>8.3f} {l['p95_ms']:>8.3f} "
+            f"{l['build_s']:>8.2f} {l['mb']:>8.2f}"
+        )
+    return "\n".join(out)
+
+
+def _consultas_ann(casos: list[dict], emb, amostra: int):
+    # Perguntas reais do arquivo + blocos do próprio corpus com ruído, para ter volume.
+    reais = []
+    if casos:
+        perguntas = [c["pergunta"] for c in casos]
+        reais = list(ob._encode_queries(perguntas, [ob._parse_tipo_contratacao(p) for p in perguntas]))
+    rng = np.random.RandomState(0)
+    idx = rng.choice(emb.shape[0], min(amostra, emb.shape[0]), replace=False)
+    ruido = np.asarray(emb[idx], dtype=np.float32) + rng.normal(0, 0.05, (len(idx), emb.shape[1])).astype(np.float32)
+    ruido /= np.linalg.norm(ruido, axis=1, keepdims=True)
+    return np.vstack(reais + [ruido]) if reais else ruido
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline da recuperação do QD Bot.")
+    parser.add_argument("--perguntas", required=True, help="JSON/JSONL com perguntas e documentos esperados")
+    parser.add_argument("--corpus", nargs="+", required=True,
+                        help="Arquivos ou pastas locais (.json, .jsonl, .docx, .csv, .txt)")
+    parser.add_argument("--k", default="1,3,5", help="Valores de k para recall@k (ex.: 1,3,5)")
+    parser.add_argument("--repeticoes", type=int, default=3, help="Execuções por pergunta para latência")
+    parser.add_argument("--set", action="append", dest="overrides", default=[],
+                        help="Sobrescreve um parâmetro do backend, ex.: --set TOP_N_ANN=30")
+    parser.add_argument("--json", dest="saida_json", help="Salva o resultado completo em JSON")
+    parser.add_argument("--cache-ce", action="store_true",
+                        help="Mede também, em execução separada, a latência com o cache de escores do CE ligado")
+    parser.add_argument("--ann", action="store_true",
+                        help="Compara recall x latência dos índices flat, HNSW e IVF-PQ sobre o corpus")
+    parser.add_argument("--ann-amostra", type=int, default=200,
+                        help="Consultas sintéticas (blocos com ruído) usadas no relatório ANN")
+    args = parser.parse_args()
+
+    ks = sorted({int(k) for k in args.k.split(",") if k.strip()})
+    _aplicar_overrides(args.overrides)
+    _desativar_llm()
+
+    blocos = ob.carregar_blocos_locais(args.corpus)
+    if not blocos:
+        raise SystemExit("Nenhum bloco encontrado no corpus local.")
+    t0 = time.perf_counter()
+    ob.usar_corpus_local(blocos)
+    print(f"Corpus local: {len(blocos)} blocos indexados em {time.perf_counter() - t0:.2f}s")
+
+    casos = carregar_perguntas(args.perguntas)
+    resultado = executar_benchmark(casos, ks, repeticoes=max(1, args.repeticoes))
+    print(formatar_relatorio(resultado, ks))
+
+    if args.cache_ce:
+        com_cache = executar_benchmark(casos, ks, repeticoes=max(1, args.repeticoes), cache_ce=True)
+        print()
+        print("\n".join(_tabela_latencia(com_cache["resumo"])))
+        resultado["latencia_com_cache_ce"] = com_cache["resumo"]
+
+    if args.ann:
+        emb = ob._emb_rows(ob.get_vector_index())
+        k = max(ks + [10])
+        linhas = relatorio_ann(emb, _consultas_ann(casos, emb, args.ann_amostra), k=k)
+        print()
+        print(formatar_relatorio_ann(linhas, emb.shape[0], k))
+        resultado["ann"] = linhas
+
+    if args.saida_json:
+        with open(args.saida_json, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
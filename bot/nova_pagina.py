@@ -1,5 +1,7 @@
 import streamlit as st
-from openai_backend import auditar_base_conhecimento
+from openai_backend import (
+    auditar_base_conhecimento, metricas_prometheus, relatorio_inicializacao, resumo_latencias,
+)
 
 st.set_page_config(page_title="Auditoria da Base", layout="wide")
 
@@ -22,4 +24,21 @@ st.text_area(
     "Resultado",
     value=st.session_state.audit_result,
     height=600
-)
\ No newline at end of file
+)
+
+st.subheader("Latência por etapa")
+
+if st.button("Atualizar latências"):
+    st.session_state.latency_result = resumo_latencias()
+
+st.text_area(
+    "Resumo",
+    value=st.session_state.get("latency_result", ""),
+    height=320
+)
+
+with st.expander("Métricas (formato Prometheus)"):
+    st.code(metricas_prometheus(), language="text")
+
+st.subheader("Inicialização (partida a frio)")
+st.code(relatorio_inicializacao(), language="text")
@@ -0,0 +1,313 @@
+# onnx_inference.py — Backend opcional de inferência com ONNX Runtime (pesos int8)
+#
+# Na primeira vez, exporta o SentenceTransformer / CrossEncoder para ONNX, aplica quantização
+# dinâmica int8 e compara os resultados com o PyTorch (paridade). Grafo, tokenizer e o
+# resultado da paridade ficam em disco; nas próximas execuções o modelo é servido só com
+# onnxruntime + tokenizer, sem importar o PyTorch.
+#
+# Uso (pré-exportar no build da imagem):
+#   python onnx_inference.py --sbert sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2 \
+#       --ce cross-encoder/mmarco-mMiniLMv2-L12-H384-v1 --cache /tmp/qdbot_onnx
+
+import argparse
+import inspect
+import json
+import os
+import re
+import shutil
+import time
+
+import numpy as np
+
+META_NAME = "meta.json"
+
+PROBE_TEXTS = [
+    "Como solicitar a compra de toner para a impressora da obra?",
+    "Procedimento de admissão de colaboradores e entrega do ASO.",
+    "Medição mensal de serviços e aprovação do boletim pela fiscalização.",
+    "Aditivo contratual de prazo e valor junto ao cliente público.",
+    "Política de reembolso de despesas de viagem.",
+    "Controle de ponto e horas extras da equipe de campo.",
+]
+
+PROBE_PAIRS = [
+    ("como fazer aditivo de contrato", "Procedimento para aditivo contratual de prazo e valor."),
+    ("como fazer aditivo de contrato", "Compra de toner e material de expediente."),
+    ("admissão na obra", "Admissão de colaboradores: ASO, documentos e integração."),
+    ("admissão na obra", "Boletim de medição aprovado pela fiscalização."),
+    ("reembolso de viagem", "Política de reembolso de despesas de viagem e hospedagem."),
+    ("reembolso de viagem", "Controle de ponto e banco de horas."),
+    ("medição da obra", "Medição mensal de serviços executados e aprovação do boletim."),
+    ("medição da obra", "Recrutamento e seleção de pessoal administrativo."),
+]
+
+
+def _model_dir(cache_dir: str, kind: str, model_name: str, quantize: bool = True) -> str:
+    # int8 e float32 ficam em pastas separadas: trocar `quantize` nunca reaproveita o grafo errado.
+    suffix = "int8" if quantize else "fp32"
+    return os.path.join(cache_dir, f"{kind}-" + re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name) + f"-{suffix}")
+
+
+def _read_meta(model_dir: str):
+    try:
+        with open(os.path.join(model_dir, META_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _session(path: str, threads: int = 0):
+    import onnxruntime as ort
+
+    opts = ort.SessionOptions()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads:
+        opts.intra_op_num_threads = threads
+    return ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+
+
+class OnnxSentenceEncoder:
+    """Substituto de `SentenceTransformer.encode` servido pelo ONNX Runtime."""
+
+    def __init__(self, model_dir: str, meta: dict, onnx_file: str = None, threads: int = 0):
+        from transformers import AutoTokenizer
+
+        self.meta = meta
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.session = _session(os.path.join(model_dir, onnx_file or meta["onnx_file"]), threads)
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.max_length = int(meta["max_length"])
+        self.pooling = meta.get("pooling", "mean")
+        self.dim = int(meta["dim"])
+
+    def _embed_batch(self, texts: list[str]) -> np.ndarray:
+        enc = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np")
+        feeds = {k: v.astype(np.int64) for k, v in enc.items() if k in self.input_names}
+        hidden = self.session.run(None, feeds)[0]
+        if self.pooling == "cls":
+            return hidden[:, 0].astype(np.float32)
+        mask = enc["attention_mask"][..., None].astype(np.float32)
+        return ((hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)).astype(np.float32)
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = False, show_progress_bar: bool = False, **_kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+
+        # Lotes com textos de tamanho parecido desperdiçam menos padding (como o SentenceTransformer).
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        parts = [
+            self._embed_batch([texts[i] for i in order[start:start + batch_size]])
+            for start in range(0, len(texts), batch_size)
+        ]
+        emb = np.concatenate(parts)[np.argsort(order, kind="stable")]
+        if normalize_embeddings:
+            emb /= np.clip(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12, None)
+        return emb[0] if single else emb
+
+
+class OnnxCrossEncoder:
+    """Substituto de `CrossEncoder.predict` servido pelo ONNX Runtime."""
+
+    def __init__(self, model_dir: str, meta: dict, onnx_file: str = None, threads: int = 0):
+        from transformers import AutoTokenizer
+
+        self.meta = meta
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.session = _session(os.path.join(model_dir, onnx_file or meta["onnx_file"]), threads)
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.max_length = int(meta["max_length"])
+        self.activation = meta.get("activation", "sigmoid")
+
+    def predict(self, sentences, batch_size: int = 32, show_progress_bar: bool = False, **_kwargs):
+        single = len(sentences) == 2 and isinstance(sentences[0], str)
+        pairs = [sentences] if single else list(sentences)
+        if not pairs:
+            return np.zeros(0, dtype=np.float32)
+
+        scores = []
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            enc = self.tokenizer(
+                [a for a, _b in batch], [b for _a, b in batch],
+                padding=True, truncation="longest_first", max_length=self.max_length, return_tensors="np",
+            )
+            feeds = {k: v.astype(np.int64) for k, v in enc.items() if k in self.input_names}
+            logits = self.session.run(None, feeds)[0]
+            scores.append(logits[:, 0] if logits.shape[1] == 1 else logits)
+        out = np.concatenate(scores).astype(np.float32)
+        if self.activation == "sigmoid":
+            out = 1.0 / (1.0 + np.exp(-out))
+        return out[0] if single else out
+
+
+def _load_torch_model(kind: str, model_name: str):
+    if kind == "sbert":
+        from sentence_transformers import SentenceTransformer
+
+        model = SentenceTransformer(model_name, device="cpu")
+        pooling = "mean"
+        if len(model) > 1 and hasattr(model[1], "get_pooling_mode_str"):
+            pooling = model[1].get_pooling_mode_str()
+        info = {
+            "max_length": int(model.max_seq_length or 256),
+            "pooling": pooling,
+            "dim": int(model.get_sentence_embedding_dimension()),
+        }
+        return model, model[0].auto_model, model.tokenizer, info
+
+    from sentence_transformers import CrossEncoder
+
+    model = CrossEncoder(model_name, max_length=512, device="cpu")
+    act = (getattr(model, "activation_fn", None) or getattr(model, "activation_fct", None)
+           or getattr(model, "default_activation_function", None))
+    info = {
+        "max_length": int(model.max_length or 512),
+        "activation": "sigmoid" if type(act).__name__ == "Sigmoid" else "identity",
+    }
+    return model, model.model, model.tokenizer, info
+
+
+def _export_onnx(hf_model, tokenizer, kind: str, path: str):
+    import torch
+
+    if kind == "sbert":
+        sample = tokenizer(["exemplo de texto"], return_tensors="pt")
+        output_name, output_axes = "last_hidden_state", {0: "batch", 1: "seq"}
+    else:
+        sample = tokenizer(["pergunta"], ["texto do bloco"], return_tensors="pt")
+        output_name, output_axes = "logits", {0: "batch"}
+
+    # Entradas na ordem da assinatura do forward, para poderem ir como argumentos posicionais.
+    params = list(inspect.signature(hf_model.forward).parameters)
+    input_names = [p for p in params if p in sample]
+    dynamic_axes = {n: {0: "batch", 1: "seq"} for n in input_names}
+    dynamic_axes[output_name] = output_axes
+
+    hf_model.eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            hf_model,
+            tuple(sample[n] for n in input_names),
+            path,
+            input_names=input_names,
+            output_names=[output_name],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+            do_constant_folding=True,
+        )
+
+
+def _parity(kind: str, torch_model, onnx_model) -> dict:
+    if kind == "sbert":
+        ref = torch_model.encode(PROBE_TEXTS, normalize_embeddings=True, convert_to_numpy=True, show_progress_bar=False)
+        got = onnx_model.encode(PROBE_TEXTS, normalize_embeddings=True)
+        cos = np.sum(ref * got, axis=1)
+        return {"min_cos": float(cos.min()), "mean_cos": float(cos.mean())}
+
+    ref = np.asarray(torch_model.predict(PROBE_PAIRS, show_progress_bar=False), dtype=np.float32)
+    got = onnx_model.predict(PROBE_PAIRS)
+    return {
+        "corr": float(np.corrcoef(ref, got)[0, 1]),
+        "max_abs_diff": float(np.abs(ref - got).max()),
+        "same_ranking": bool((np.argsort(-ref) == np.argsort(-got)).all()),
+    }
+
+
+def _parity_ok(kind: str, parity: dict, min_cos: float, min_corr: float) -> bool:
+    if kind == "sbert":
+        return parity["min_cos"] >= min_cos
+    return parity["corr"] >= min_corr
+
+
+def exportar_modelo(kind: str, model_name: str, cache_dir: str, quantize: bool = True,
+                    min_cos: float = 0.98, min_corr: float = 0.98) -> dict:
+    """Exporta, quantiza e valida o modelo. Retorna o meta gravado (com `ok` e a paridade)."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    final_dir = _model_dir(cache_dir, kind, model_name, quantize)
+    tmp_dir = f"{final_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        t0 = time.perf_counter()
+        torch_model, hf_model, tokenizer, info = _load_torch_model(kind, model_name)
+        tokenizer.save_pretrained(tmp_dir)
+        _export_onnx(hf_model, tokenizer, kind, os.path.join(tmp_dir, "model.onnx"))
+        candidates = ["model.onnx"]
+        if quantize:
+            quantize_dynamic(
+                os.path.join(tmp_dir, "model.onnx"),
+                os.path.join(tmp_dir, "model.int8.onnx"),
+                weight_type=QuantType.QInt8,
+            )
+            candidates.insert(0, "model.int8.onnx")
+
+        meta = {"kind": kind, "model_name": model_name, **info, "ok": False, "parity": {}}
+        cls = OnnxSentenceEncoder if kind == "sbert" else OnnxCrossEncoder
+        # int8 primeiro; se não bater com o PyTorch, tenta o grafo float32 antes de desistir.
+        for onnx_file in candidates:
+            parity = _parity(kind, torch_model, cls(tmp_dir, meta, onnx_file=onnx_file))
+            meta["parity"][onnx_file] = parity
+            if _parity_ok(kind, parity, min_cos, min_corr):
+                meta.update({"ok": True, "onnx_file": onnx_file, "quantized": onnx_file != "model.onnx"})
+                break
+        meta["export_seconds"] = round(time.perf_counter() - t0, 2)
+        meta["exported_at"] = time.time()
+
+        # meta.json por último: só vale como exportação completa se chegou até aqui
+        with open(os.path.join(tmp_dir, META_NAME), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(tmp_dir, final_dir)
+        return meta
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def carregar_modelo_onnx(kind: str, model_name: str, cache_dir: str, quantize: bool = True,
+                         min_cos: float = 0.98, min_corr: float = 0.98, threads: int = 0):
+    """Wrapper ONNX do modelo (`kind` = "sbert" ou "ce"); exporta na primeira chamada.
+
+    Retorna None quando a exportação em cache não passou na paridade com o PyTorch.
+    """
+    model_dir = _model_dir(cache_dir, kind, model_name, quantize)
+    meta = _read_meta(model_dir)
+    if meta is None:
+        print(f"[QD-BOT v8.3] Exportando {model_name} para ONNX em {model_dir}...")
+        meta = exportar_modelo(kind, model_name, cache_dir, quantize=quantize, min_cos=min_cos, min_corr=min_corr)
+        print(f"[QD-BOT v8.3] Exportação ONNX: {meta['export_seconds']}s | paridade: {meta['parity']}")
+    if not meta.get("ok"):
+        print(f"[QD-BOT v8.3] ONNX de {model_name} reprovado na paridade ({meta.get('parity')})")
+        return None
+    cls = OnnxSentenceEncoder if kind == "sbert" else OnnxCrossEncoder
+    return cls(model_dir, meta, threads=threads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta os modelos do QD Bot para ONNX (int8) e mede a paridade.")
+    parser.add_argument("--sbert", help="Nome do modelo de embedding")
+    parser.add_argument("--ce", help="Nome do cross-encoder")
+    parser.add_argument("--cache", default="/tmp/qdbot_onnx", help="Pasta do cache de exportação")
+    parser.add_argument("--sem-quantizacao", action="store_true", help="Mantém o grafo em float32")
+    parser.add_argument("--forcar", action="store_true", help="Refaz a exportação mesmo com cache")
+    args = parser.parse_args()
+
+    for kind, name in (("sbert", args.sbert), ("ce", args.ce)):
+        if not name:
+            continue
+        quantize = not args.sem_quantizacao
+        if args.forcar:
+            shutil.rmtree(_model_dir(args.cache, kind, name, quantize), ignore_errors=True)
+        meta = _read_meta(_model_dir(args.cache, kind, name, quantize))
+        if meta is None:
+            meta = exportar_modelo(kind, name, args.cache, quantize=quantize)
+        print(json.dumps({k: meta.get(k) for k in ("model_name", "ok", "onnx_file", "parity", "export_seconds")},
+                         ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
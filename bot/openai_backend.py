@@ -8,24 +8,35 @@
 #   6. Links múltiplos quando a resposta usar mais de um documento
 #   7. Auditoria preservada
 
+import csv
+import hashlib
 import io
 import json
+import os
 import re
+import shutil
+import threading
 import time
 import unicodedata
+import uuid
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from difflib import SequenceMatcher
 from typing import Any, Optional
 
+_IMPORT_T0 = time.perf_counter()
+
 import numpy as np
 import requests
 import streamlit as st
-from docx import Document
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
+# python-docx, googleapiclient e sentence-transformers são importados sob demanda
+# (ver _docx_to_blocks, _make_drive_client e get_sbert_model/get_cross_encoder).
 
 # ========= CONFIG BÁSICA =========
-API_KEY = st.secrets["openai"]["api_key"]
 MODEL_ID = "gpt-4o"
+OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
 
 # ========= PERFORMANCE & QUALIDADE =========
 USE_JSONL = True
@@ -34,6 +45,8 @@ USE_CE = True
 TOP_N_ANN = 15
 TOP_K = 5
 DEDUP_MAX_OVERLAP = 0.75
+DEDUP_MINHASH_PERMS = 128
+DEDUP_AT_BUILD = True      # remove blocos idênticos vindos de cópias DOCX/JSON do mesmo documento
 MIN_SCORE_THRESHOLD = 0.25
 RELATIVE_SCORE_CUTOFF = 0.60
 
@@ -43,16 +56,43 @@ GROUP_WINDOW = 2
 MAX_TOKENS = 750
 REQUEST_TIMEOUT = 60
 TEMPERATURE = 0.30
+LLM_CONCURRENCY = 8
+WARMUP_WAIT_TIMEOUT = 600  # s que uma pergunta espera pelo aquecimento antes de carregar por conta própria
 
 HISTORY_TURNS = 3
 
+# ========= CACHE SEMÂNTICO DE RESPOSTAS =========
+USE_ANSWER_CACHE = True
+ANSWER_CACHE_THRESHOLD = 0.93
+ANSWER_CACHE_MAX_ENTRIES = 256
+ANSWER_CACHE_TTL = 6 * 3600
+
 # ========= EMBEDDING MODEL =========
 EMBED_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
 
+# ========= BACKEND DE INFERÊNCIA (SBERT / CE) =========
+INFERENCE_BACKEND = "torch"     # "torch" ou "onnx" (ONNX Runtime, pesos int8; volta ao torch se falhar)
+ONNX_CACHE_DIR = "/tmp/qdbot_onnx"
+ONNX_QUANTIZE = True
+ONNX_PARITY_MIN_COS = 0.98      # cosseno mínimo entre embeddings PyTorch x ONNX nas frases de teste
+ONNX_PARITY_MIN_CORR = 0.98     # correlação mínima entre escores do CE PyTorch x ONNX
+ONNX_THREADS = 0                # 0 = padrão do onnxruntime
+
+# ========= BM25 (híbrido esparso + denso) =========
+USE_BM25 = True
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_TOP_N = 15
+BM25_WEIGHT = 0.15
+RRF_K = 60
+
 # ========= CROSS-ENCODER MODEL =========
 CE_MODEL_NAME = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
 CE_WEIGHT = 0.45
 EMB_WEIGHT = 0.55
+CE_BATCH_SIZE = 64
+USE_CE_SCORE_CACHE = True
+CE_SCORE_CACHE_MAX_MB = 16
 
 # ========= ÍNDICE PRÉ-COMPUTADO (opcional) =========
 PRECOMP_FAISS_NAME = "faiss.index"
@@ -60,9 +100,52 @@ PRECOMP_VECTORS_NAME = "vectors.npy"
 PRECOMP_BLOCKS_NAME = "blocks.json"
 USE_PRECOMPUTED = False
 
+# ========= SNAPSHOT LOCAL DO ÍNDICE =========
+USE_SNAPSHOT = True
+SNAPSHOT_DIR = "/tmp/qdbot_snapshots"
+SNAPSHOT_KEEP = 2
+SNAPSHOT_EMB_NAME = "emb.npy"
+SNAPSHOT_EMB_SCALE_NAME = "emb_scale.npy"
+SNAPSHOT_BLOCKS_NAME = "blocks.json"
+SNAPSHOT_FAISS_NAME = "faiss.index"
+SNAPSHOT_META_NAME = "meta.json"
+SNAPSHOT_LEXICAL_NAME = "lexical.npz"
+SNAPSHOT_VOCAB_NAME = "vocab.json"
+SNAPSHOT_FAMILIES_NAME = "families.json"
+
+# ========= ÍNDICE ANN (FAISS) =========
+ANN_INDEX_TYPE = "flat"        # "flat" (exato), "hnsw" ou "ivfpq"
+ANN_MIN_BLOCKS = 5000          # abaixo disso o índice exato é usado mesmo com outro tipo configurado
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+IVF_NLIST = 0                  # 0 = automático (~4 * sqrt(n))
+IVF_NPROBE = 16
+PQ_M = 48                      # subquantizadores; precisa dividir a dimensão do embedding
+PQ_NBITS = 8
+ANN_REFINE = True              # recalcula o cosseno exato dos candidatos de índices aproximados
+EMB_STORAGE_DTYPE = "float32"   # matriz de embeddings: "float32", "float16" ou "int8" (escala por dimensão)
+NUMPY_SEARCH_CHUNK = 65536      # linhas processadas por vez (busca sem FAISS e montagem do índice)
+
+# ========= EMBEDDINGS POR ARQUIVO (incremental) =========
+USE_FILE_EMB_STORE = True
+FILE_EMB_STORE_DIR = "/tmp/qdbot_file_emb"
+
+# ========= CACHE LOCAL DE ARQUIVOS DO DRIVE (por md5Checksum) =========
+USE_FILE_CACHE = True
+FILE_CACHE_DIR = "/tmp/qdbot_file_cache"
+FILE_CACHE_MAX_MB = 512   # bytes brutos + blocos parseados; acima disso, sai o menos usado (LRU)
+
 # ========= DRIVE / AUTH =========
 FOLDER_ID = "1fdcVl6RcoyaCpa6PmOX1kUAhXn5YIPTa"
 SCOPES = ["https://www.googleapis.com/auth/drive.readonly"]
+INGEST_WORKERS = 8
+SOURCES_TTL = 600  # s entre relistagens da pasta do Drive
+SOURCES_RETRY_TTL = 60  # s até tentar de novo quando algum arquivo falhou no download
+USE_DRIVE_CHANGES = True   # sincroniza pelo feed de changes (delta) em vez de relistar a pasta inteira
+DRIVE_CHANGES_STATE_PATH = "/tmp/qdbot_drive_changes.json"
+DRIVE_CHANGES_DRIVE_ID = None  # id do drive compartilhado; None = descoberto pela própria pasta
+DRIVE_FULL_RESYNC_S = 24 * 3600  # relistagem completa periódica, mesmo com o feed de changes em dia
 
 # ========= FALLBACK =========
 FALLBACK_MSG = (
@@ -103,18 +186,60 @@ ESTILO:
 "Resumo prático:"
 - Use listas simples com hífen quando necessário, sem formatação decorativa."""
 
+# ========= TELEMETRIA =========
+TELEMETRY_RING_SIZE = 500
+TELEMETRY_JSONL_PATH = None  # ex.: "/tmp/qdbot_traces.jsonl"
+TELEMETRY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
 # ========= CACHE BUSTER =========
 CACHE_BUSTER = "2026-04-02-v8.3-multidoc"
 
+# ========================= INICIALIZAÇÃO =========================
+# Tempos da partida a frio (import, segredos, modelos, Drive, índice). Cada etapa guarda
+# apenas a primeira medição: é ela que o usuário paga no boot ou na primeira pergunta.
+_STARTUP_TIMINGS: "OrderedDict[str, float]" = OrderedDict()
+_STARTUP_LOCK = threading.Lock()
+_WARMUP_STATE = {"thread": None, "inicio": None, "fim": None, "erro": None, "etapa": None}
+_WARMUP_DONE = threading.Event()
+
+@contextmanager
+def _startup_step(nome: str):
+    if threading.current_thread() is _WARMUP_STATE["thread"]:
+        _WARMUP_STATE["etapa"] = nome
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _STARTUP_LOCK:
+            _STARTUP_TIMINGS.setdefault(nome, time.perf_counter() - t0)
+
+_API_KEY_CACHE = {"value": None}
+
+def _api_key() -> str:
+    # st.secrets só é lido na primeira chamada ao LLM (ou no aquecimento), não no import.
+    key = _API_KEY_CACHE["value"]
+    if key is None:
+        with _startup_step("segredos OpenAI"):
+            key = str(st.secrets["openai"]["api_key"]).strip()
+        _API_KEY_CACHE["value"] = key
+    return key
+
+class _BearerAuth(requests.auth.AuthBase):
+    def __call__(self, r):
+        r.headers["Authorization"] = f"Bearer {_api_key()}"
+        return r
+
 # ========= HTTP SESSION =========
 session = requests.Session()
-session.headers.update({
-    "Authorization": f"Bearer {API_KEY.strip()}",
-    "Content-Type": "application/json"
-})
+session.auth = _BearerAuth()
+session.headers.update({"Content-Type": "application/json"})
 
 # ========================= STATE =========================
 _FALLBACK_STATE = {}
+# Corpus carregado de arquivos locais (benchmark/offline); quando definido, substitui o Drive.
+_LOCAL_CORPUS = {"vecdb": None, "catalog": None}
+_FAMILY_INDEX = {"key": None, "index": None}
+_FAMILY_INDEX_LOCK = threading.Lock()
 
 def _state_get(key, default=None):
     try:
@@ -134,6 +259,182 @@ def _state_pop(key, default=None):
     except Exception:
         return _FALLBACK_STATE.pop(key, default)
 
+# ========================= TEMPOS POR ETAPA =========================
+_TRACE_LOCAL = threading.local()
+
+@contextmanager
+def _span(name: str):
+    spans = getattr(_TRACE_LOCAL, "spans", None)
+    if spans is None:
+        yield
+        return
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans[name] = spans.get(name, 0.0) + (time.perf_counter() - t)
+
+def _somar_span(name: str, seconds: float):
+    # Para etapas medidas à mão (ex.: stream, cujo tempo parado no consumidor não conta).
+    spans = getattr(_TRACE_LOCAL, "spans", None)
+    if spans is not None:
+        spans[name] = spans.get(name, 0.0) + seconds
+
+def _trace_meta(key: str, value):
+    meta = getattr(_TRACE_LOCAL, "meta", None)
+    if meta is not None:
+        meta[key] = value
+
+@contextmanager
+def capturar_tempos():
+    """Coleta, na thread atual, os segundos gastos em cada etapa instrumentada com `_span`."""
+    anterior = getattr(_TRACE_LOCAL, "spans", None)
+    spans: dict[str, float] = {}
+    _TRACE_LOCAL.spans = spans
+    try:
+        yield spans
+    finally:
+        _TRACE_LOCAL.spans = anterior
+
+# ========================= TELEMETRIA (sinks) =========================
+class RingBufferSink:
+    """Guarda em memória os últimos traces do processo (base da visão agregada da auditoria)."""
+
+    def __init__(self, maxlen: int = TELEMETRY_RING_SIZE):
+        self._buf = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def emit(self, trace: dict):
+        with self._lock:
+            self._buf.append(trace)
+
+    def snapshot(self) -> list[dict]:
+        with self._lock:
+            return list(self._buf)
+
+class JsonlSink:
+    """Acrescenta um trace por linha em um arquivo JSONL."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def emit(self, trace: dict):
+        line = json.dumps(trace, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+class PrometheusSink:
+    """Histogramas acumulados por etapa, expostos no formato texto do Prometheus."""
+
+    def __init__(self, buckets: tuple = TELEMETRY_BUCKETS):
+        self.buckets = buckets
+        self._stats: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def emit(self, trace: dict):
+        with self._lock:
+            for stage, secs in list(trace["spans"].items()) + [("total", trace["total"])]:
+                st_ = self._stats.setdefault(stage, {"count": 0, "sum": 0.0, "buckets": [0] * len(self.buckets)})
+                st_["count"] += 1
+                st_["sum"] += secs
+                for i, le in enumerate(self.buckets):
+                    if secs <= le:
+                        st_["buckets"][i] += 1
+
+    def render(self) -> str:
+        linhas = [
+            "# HELP qdbot_stage_seconds Tempo gasto por etapa de uma requisição do QD Bot.",
+            "# TYPE qdbot_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage in sorted(self._stats):
+                st_ = self._stats[stage]
+                for le, n in zip(self.buckets, st_["buckets"]):
+                    linhas.append(f'qdbot_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {n}')
+                linhas.append(f'qdbot_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {st_["count"]}')
+                linhas.append(f'qdbot_stage_seconds_sum{{stage="{stage}"}} {st_["sum"]:.6f}')
+                linhas.append(f'qdbot_stage_seconds_count{{stage="{stage}"}} {st_["count"]}')
+        return "\n".join(linhas) + "\n"
+
+_TELEMETRY_RING = RingBufferSink()
+_TELEMETRY_PROM = PrometheusSink()
+_TELEMETRY_SINKS = [_TELEMETRY_RING, _TELEMETRY_PROM]
+if TELEMETRY_JSONL_PATH:
+    _TELEMETRY_SINKS.append(JsonlSink(TELEMETRY_JSONL_PATH))
+
+def registrar_sink_telemetria(sink):
+    """Adiciona um destino de traces; basta o objeto ter `emit(trace: dict)`."""
+    _TELEMETRY_SINKS.append(sink)
+
+@contextmanager
+def _rastrear_requisicao(pergunta: str, origem: str = "chat"):
+    trace = {
+        "id": uuid.uuid4().hex[:12],
+        "ts": time.time(),
+        "origem": origem,
+        "pergunta": (pergunta or "")[:120],
+        "spans": {},
+        "meta": {},
+        "total": 0.0,
+    }
+    anterior = (getattr(_TRACE_LOCAL, "spans", None), getattr(_TRACE_LOCAL, "meta", None))
+    _TRACE_LOCAL.spans = trace["spans"]
+    _TRACE_LOCAL.meta = trace["meta"]
+    t0 = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        trace["total"] = time.perf_counter() - t0
+        _TRACE_LOCAL.spans, _TRACE_LOCAL.meta = anterior
+        for sink in list(_TELEMETRY_SINKS):
+            try:
+                sink.emit(trace)
+            except Exception as e:
+                print(f"[QD-BOT v8.3] Falha no sink de telemetria {type(sink).__name__}: {e}")
+
+def metricas_prometheus() -> str:
+    return _TELEMETRY_PROM.render()
+
+def resumo_latencias() -> str:
+    traces = _TELEMETRY_RING.snapshot()
+    if not traces:
+        return "Nenhuma requisição registrada neste processo ainda."
+
+    por_etapa: dict[str, list[float]] = {}
+    for t in traces:
+        for stage, secs in t["spans"].items():
+            por_etapa.setdefault(stage, []).append(secs)
+        por_etapa.setdefault("total", []).append(t["total"])
+
+    linhas = ["=== Latência por etapa ==="]
+    linhas.append(f"Requisições na janela: {len(traces)} (máx. {TELEMETRY_RING_SIZE})")
+    hits = sum(1 for t in traces if t["meta"].get("cache_hit"))
+    linhas.append(f"Cache de respostas: {hits} hit(s)")
+    ce = ce_score_cache_stats()
+    pares = ce["hits"] + ce["misses"]
+    if pares:
+        linhas.append(
+            f"Cache do cross-encoder: {ce['hits']}/{pares} pares reaproveitados "
+            f"({ce['entries']} entradas, ~{ce['bytes'] / 1e6:.1f} MB)"
+        )
+    modos: dict[str, int] = {}
+    for t in traces:
+        modo = t["meta"].get("mode")
+        if modo:
+            modos[modo] = modos.get(modo, 0) + 1
+    if modos:
+        linhas.append("Modos: " + ", ".join(f"{m}={n}" for m, n in sorted(modos.items())))
+    linhas.append("")
+    linhas.append(f"{'etapa':<10} {'n':>5} {'média ms':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    ordem = sorted(por_etapa, key=lambda k: (k == "total", -float(np.mean(por_etapa[k]))))
+    for stage in ordem:
+        ms = np.asarray(por_etapa[stage]) * 1000.0
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        linhas.append(f"{stage:<10} {len(ms):>5} {ms.mean():>10.1f} {p50:>10.1f} {p95:>10.1f} {p99:>10.1f}")
+    return "\n".join(linhas)
+
 # ========================= UTILS =========================
 def sanitize_doc_name(name: str) -> str:
     name = re.sub(r"^(C[oó]pia de|Copy of)\s+", "", name, flags=re.IGNORECASE)
@@ -238,11 +539,7 @@ def _ngrams_from_query(query: str, max_n: int = 4) -> list[str]:
     return uniq
 
 # ========================= CATALOGO DE DOCUMENTOS =========================
-@st.cache_data(show_spinner=False, ttl=600)
-def _build_document_catalog(folder_id: str, _v=CACHE_BUSTER):
-    src = _list_sources_cached(folder_id)
-    files = (src.get("json", []) or []) + (src.get("docx", []) or [])
-
+def _catalog_from_files(files: list[dict]) -> dict:
     docs = {}
     families = {}
     family_norm_map = {}
@@ -277,33 +574,140 @@ def _build_document_catalog(folder_id: str, _v=CACHE_BUSTER):
         "family_list": sorted(families.keys())
     }
 
+def _catalog_for_state(state: dict, folder_id: str = FOLDER_ID) -> dict:
+    # Montado uma vez por versão do corpus e devolvido por referência (sem cópia por pergunta).
+    catalog = state["catalog"]
+    if catalog is None:
+        catalog = _estado_vivo(folder_id, state)["catalog"]
+        if catalog is None:
+            src = state["sources"]
+            catalog = _catalog_from_files((src.get("json", []) or []) + (src.get("docx", []) or []))
+        _publicar_campos(folder_id, state, catalog=catalog)
+    return catalog
+
+def _build_document_catalog(folder_id: str, _v=CACHE_BUSTER):
+    return _catalog_for_state(_sources_state(folder_id), folder_id)
+
+def _get_document_catalog() -> dict:
+    if _LOCAL_CORPUS["catalog"] is not None:
+        return _LOCAL_CORPUS["catalog"]
+    return _catalog_for_state(_corpus_state())
+
+def _char_trigrams(s: str, pad: bool = True) -> set[str]:
+    if pad:
+        s = f"  {s} "
+    return {s[i:i+3] for i in range(len(s) - 2)}
+
+def _family_threshold(fn: str) -> float:
+    return 0.84 if len(fn) >= 5 else 0.90
+
+def _build_family_index(family_list: list[str]) -> dict:
+    """Índice de trigramas das famílias para evitar o SequenceMatcher contra todas elas.
+
+    Com os limiares usados (>= 0.84), um par que passa no `ratio()` sempre compartilha ao
+    menos um trigrama com padding, então a lista de postings não perde candidatos.
+    """
+    norms = []
+    fuzzy_postings: dict[str, list[int]] = {}
+    exact_postings: dict[str, list[int]] = {}
+    exact_need = []
+    short = []
+
+    for idx, fam in enumerate(family_list):
+        fn = _norm_key(fam)
+        norms.append(fn)
+        if not fn:
+            exact_need.append(0)
+            continue
+        for tri in _char_trigrams(fn):
+            fuzzy_postings.setdefault(tri, []).append(idx)
+        plain = _char_trigrams(fn, pad=False)
+        exact_need.append(len(plain))
+        if plain:
+            for tri in plain:
+                exact_postings.setdefault(tri, []).append(idx)
+        else:
+            short.append(idx)
+
+    return {
+        "families": list(family_list),
+        "norms": norms,
+        "fuzzy_postings": fuzzy_postings,
+        "exact_postings": exact_postings,
+        "exact_need": exact_need,
+        "short": short,
+        "memo": OrderedDict(),
+        "memo_lock": threading.Lock(),
+    }
+
+def _family_index_for(catalog: dict) -> dict:
+    key = tuple(catalog["family_list"])
+    with _FAMILY_INDEX_LOCK:
+        if _FAMILY_INDEX["key"] != key:
+            _FAMILY_INDEX["index"] = _build_family_index(catalog["family_list"])
+            _FAMILY_INDEX["key"] = key
+        return _FAMILY_INDEX["index"]
+
+def _family_substring_hits(fidx: dict, qn: str) -> list[int]:
+    counts: dict[int, int] = {}
+    for tri in _char_trigrams(qn, pad=False):
+        for idx in fidx["exact_postings"].get(tri, ()):
+            counts[idx] = counts.get(idx, 0) + 1
+    cands = [idx for idx, n in counts.items() if n == fidx["exact_need"][idx]]
+    cands.extend(fidx["short"])
+    return [idx for idx in cands if fidx["norms"][idx] in qn]
+
+def _family_fuzzy_hits(fidx: dict, gram: str) -> list[tuple[int, float]]:
+    memo = fidx["memo"]
+    with fidx["memo_lock"]:
+        hit = memo.get(gram)
+        if hit is not None:
+            memo.move_to_end(gram)
+            return hit
+
+    cands = set()
+    for tri in _char_trigrams(gram):
+        cands.update(fidx["fuzzy_postings"].get(tri, ()))
+
+    out = []
+    lg = len(gram)
+    for idx in cands:
+        fn = fidx["norms"][idx]
+        threshold = _family_threshold(fn)
+        if 2.0 * min(lg, len(fn)) / (lg + len(fn)) < threshold:
+            continue
+        ratio = SequenceMatcher(None, gram, fn).ratio()
+        if ratio >= threshold:
+            out.append((idx, ratio))
+
+    with fidx["memo_lock"]:
+        memo[gram] = out
+        if len(memo) > 4096:
+            memo.popitem(last=False)
+    return out
+
+@_span("families")
 def _resolve_requested_families(query: str, max_matches: int = 2) -> list[str]:
-    catalog = _build_document_catalog(FOLDER_ID)
-    family_list = catalog["family_list"]
+    catalog = _get_document_catalog()
+    fidx = _family_index_for(catalog)
+    family_list = fidx["families"]
     qn = _norm_key(query)
     grams = _ngrams_from_query(query, max_n=4)
 
     scored = {}
 
-    for fam in family_list:
-        fn = _norm_key(fam)
-        if fn and fn in qn:
-            scored[fam] = max(scored.get(fam, 0.0), 1.0)
+    for idx in _family_substring_hits(fidx, qn):
+        scored[family_list[idx]] = 1.0
 
-    for fam in family_list:
-        fn = _norm_key(fam)
-        best = scored.get(fam, 0.0)
-        threshold = 0.84 if len(fn) >= 5 else 0.90
-        for gram in grams:
-            ratio = SequenceMatcher(None, gram, fn).ratio()
-            if ratio >= threshold:
-                best = max(best, ratio)
-        if best > 0:
-            scored[fam] = best
+    for gram in grams:
+        for idx, ratio in _family_fuzzy_hits(fidx, gram):
+            fam = family_list[idx]
+            scored[fam] = max(scored.get(fam, 0.0), ratio)
 
     ordered = sorted(scored.items(), key=lambda x: (-x[1], x[0]))
     return [fam for fam, _score in ordered[:max_matches]]
 
+@_span("mode")
 def _detect_query_mode(query: str, families: Optional[list[str]] = None) -> str:
     qn = _norm_key(query)
     families = families or []
@@ -451,8 +855,9 @@ def _expand_query_for_hr(query: str, tipo_contratacao: Optional[str] = None) ->
 
 # ========================= FALLBACK INTERATIVO =========================
 def gerar_resposta_fallback_interativa(pergunta: str,
-                                       api_key: str = API_KEY,
-                                       model_id: str = MODEL_ID) -> str:
+                                       api_key: Optional[str] = None,
+                                       model_id: Optional[str] = None) -> str:
+    model_id = model_id or MODEL_ID
     try:
         prompt_usuario = (
             "O usuário fez a pergunta abaixo, mas não encontramos nenhum conteúdo correspondente "
@@ -483,7 +888,7 @@ def gerar_resposta_fallback_interativa(pergunta: str,
             "stream": False,
         }
         resp = session.post(
-            "https://api.openai.com/v1/chat/completions",
+            OPENAI_CHAT_URL,
             json=payload,
             timeout=REQUEST_TIMEOUT,
         )
@@ -501,31 +906,114 @@ def gerar_resposta_fallback_interativa(pergunta: str,
         return FALLBACK_MSG
 
 # ========================= CLIENTES CACHEADOS =========================
-@st.cache_resource(show_spinner=False)
-def get_drive_client(_v=CACHE_BUSTER):
+def _make_drive_client():
+    with _startup_step("import googleapiclient"):
+        from googleapiclient.discovery import build
+        from google.oauth2 import service_account
     creds = service_account.Credentials.from_service_account_info(
         dict(st.secrets["gcp_service_account"]), scopes=SCOPES
     )
     return build("drive", "v3", credentials=creds)
 
+@st.cache_resource(show_spinner=False)
+def get_drive_client(_v=CACHE_BUSTER):
+    with _startup_step("cliente Drive"):
+        return _make_drive_client()
+
+# O cliente do googleapiclient (httplib2) não é thread-safe: um por worker.
+_DRIVE_THREAD_LOCAL = threading.local()
+
+def _thread_drive_client():
+    client = getattr(_DRIVE_THREAD_LOCAL, "client", None)
+    if client is None:
+        client = _make_drive_client()
+        _DRIVE_THREAD_LOCAL.client = client
+    return client
+
+# Backend efetivo de cada modelo já carregado neste processo ("sbert"/"ce" -> tag).
+_MODEL_BACKEND_LOADED: dict[str, str] = {}
+
+def _model_backend_tag(model) -> str:
+    # Vem do modelo efetivamente carregado: ONNX reprovado ou indisponível cai no PyTorch,
+    # e a exportação pode ter ficado com o grafo float32 em vez do int8.
+    meta = getattr(model, "meta", None)
+    if isinstance(meta, dict) and meta.get("onnx_file"):
+        return f"onnx:{meta['onnx_file']}"
+    return "torch"
+
+def _configured_backend_tag() -> str:
+    # Mesmo formato de _model_backend_tag, mas só pela configuração: não carrega modelo nenhum.
+    if INFERENCE_BACKEND != "onnx":
+        return "torch"
+    return "onnx:model.int8.onnx" if ONNX_QUANTIZE else "onnx:model.onnx"
+
+def _registrar_backend(kind: str, model_name: str, model):
+    tag = _model_backend_tag(model)
+    _MODEL_BACKEND_LOADED[kind] = tag
+    if tag != _configured_backend_tag():
+        print(f"[QD-BOT v8.3] {model_name} carregado como {tag}, não {_configured_backend_tag()} "
+              f"(INFERENCE_BACKEND={INFERENCE_BACKEND}); caches em disco passam a usar {tag}")
+
+def _embed_model_tag() -> str:
+    # Embeddings do ONNX não são bit a bit os do PyTorch: não misturar nos caches em disco.
+    # A chave sai da configuração, para o snapshot ser achado sem carregar o SBERT; se o modelo
+    # já carregou em outro backend (ex.: ONNX reprovado na paridade), vale o efetivo.
+    tag = _MODEL_BACKEND_LOADED.get("sbert") or _configured_backend_tag()
+    return EMBED_MODEL_NAME if tag == "torch" else f"{EMBED_MODEL_NAME}|{tag}"
+
+def _get_onnx_model(kind: str, model_name: str):
+    if INFERENCE_BACKEND != "onnx":
+        return None
+    try:
+        from onnx_inference import carregar_modelo_onnx
+        return carregar_modelo_onnx(
+            kind, model_name, ONNX_CACHE_DIR, quantize=ONNX_QUANTIZE,
+            min_cos=ONNX_PARITY_MIN_COS, min_corr=ONNX_PARITY_MIN_CORR, threads=ONNX_THREADS,
+        )
+    except Exception as e:
+        print(f"[QD-BOT v8.3] Backend ONNX indisponível para {model_name}: {e} — usando PyTorch")
+        return None
+
 @st.cache_resource(show_spinner=False)
 def get_sbert_model(_v=CACHE_BUSTER):
-    from sentence_transformers import SentenceTransformer
-    model = SentenceTransformer(EMBED_MODEL_NAME)
-    model.encode(["teste"], normalize_embeddings=True)
+    with _startup_step("carregar embedding (ONNX)"):
+        model = _get_onnx_model("sbert", EMBED_MODEL_NAME)
+    if model is not None:
+        with _startup_step("aquecer embedding"):
+            model.encode(["teste"], normalize_embeddings=True)
+        print(f"[QD-BOT v8.3] Embedding carregado (ONNX {model.meta['onnx_file']}): {EMBED_MODEL_NAME}")
+        _registrar_backend("sbert", EMBED_MODEL_NAME, model)
+        return model
+    with _startup_step("import sentence_transformers"):
+        from sentence_transformers import SentenceTransformer
+    with _startup_step("carregar embedding"):
+        model = SentenceTransformer(EMBED_MODEL_NAME)
+    with _startup_step("aquecer embedding"):
+        model.encode(["teste"], normalize_embeddings=True)
     print(f"[QD-BOT v8.3] Embedding carregado: {EMBED_MODEL_NAME}")
+    _registrar_backend("sbert", EMBED_MODEL_NAME, model)
     return model
 
 @st.cache_resource(show_spinner=False)
 def get_cross_encoder(_v=CACHE_BUSTER):
     if not USE_CE:
         return None
-    from sentence_transformers import CrossEncoder
+    with _startup_step("carregar cross-encoder (ONNX)"):
+        ce = _get_onnx_model("ce", CE_MODEL_NAME)
+    if ce is not None:
+        print(f"[QD-BOT v8.3] Cross-encoder carregado (ONNX {ce.meta['onnx_file']}): {CE_MODEL_NAME}")
+        _registrar_backend("ce", CE_MODEL_NAME, ce)
+        return ce
+    with _startup_step("import sentence_transformers"):
+        from sentence_transformers import CrossEncoder
     try:
-        ce = CrossEncoder(CE_MODEL_NAME, max_length=512)
-        score = ce.predict([("aditivo de contrato", "procedimento para aditivo contratual")])
+        with _startup_step("carregar cross-encoder"):
+            ce = CrossEncoder(CE_MODEL_NAME, max_length=512)
+        with _startup_step("aquecer cross-encoder"):
+            score = ce.predict([("aditivo de contrato", "procedimento para aditivo contratual")])
         score0 = float(np.atleast_1d(score)[0])
         print(f"[QD-BOT v8.3] Cross-encoder carregado: {CE_MODEL_NAME} (teste={score0:.3f})")
+        _registrar_backend("ce", CE_MODEL_NAME, ce)
         return ce
     except Exception as e:
         print(f"[QD-BOT v8.3] Cross-encoder falhou: {e} — continuando sem CE")
@@ -552,22 +1040,19 @@ def _drive_list_all(drive_service, query: str, fields: str):
             break
     return all_files
 
+_DRIVE_FILE_KEYS = ("id", "name", "md5Checksum", "modifiedTime", "mimeType")
+_DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+_JSON_MIMES = ("application/json", "text/plain")
+
 def _list_by_mime_query(drive_service, folder_id, mime_query):
     query = f"'{folder_id}' in parents and ({mime_query}) and trashed = false"
     fields = "files(id, name, md5Checksum, modifiedTime, mimeType)"
     return _drive_list_all(drive_service, query, fields)
 
 def _list_docx_metadata(drive_service, folder_id):
-    return _list_by_mime_query(
-        drive_service, folder_id,
-        "mimeType='application/vnd.openxmlformats-officedocument.wordprocessingml.document'"
-    )
+    return _list_by_mime_query(drive_service, folder_id, f"mimeType='{_DOCX_MIME}'")
 
-def _list_json_metadata(drive_service, folder_id):
-    files = _list_by_mime_query(
-        drive_service, folder_id,
-        "mimeType='application/json' or mimeType='text/plain'"
-    )
+def _filter_json_files(files):
     ignored = {"blocks_cache.json"}
     return [
         f for f in files
@@ -575,12 +1060,135 @@ def _list_json_metadata(drive_service, folder_id):
         and f.get("name", "") not in ignored
     ]
 
+def _list_json_metadata(drive_service, folder_id):
+    files = _list_by_mime_query(
+        drive_service, folder_id,
+        " or ".join(f"mimeType='{m}'" for m in _JSON_MIMES)
+    )
+    return _filter_json_files(files)
+
 def _list_named_files(drive_service, folder_id, wanted_names):
     fields = "files(id, name, md5Checksum, modifiedTime, mimeType)"
     query = f"'{folder_id}' in parents and trashed = false"
     files = _drive_list_all(drive_service, query, fields)
     return {f["name"]: f for f in files if f.get("name") in wanted_names}
 
+# ========================= DRIVE: SINCRONIZAÇÃO POR CHANGES =========================
+# Mapa id -> metadados de todos os arquivos da pasta, mantido pelo feed de changes do Drive.
+# Uma listagem completa acontece na primeira vez, se o token expirar e, por garantia, a cada
+# DRIVE_FULL_RESYNC_S; no resto, cada atualização busca só as mudanças desde o último token,
+# persistido em disco. Pasta em drive compartilhado: o feed é o daquele drive (driveId).
+_DRIVE_SYNC: dict[str, dict] = {}
+_DRIVE_SYNC_LOCK = threading.Lock()
+
+def _load_drive_sync_state(folder_id: str) -> Optional[dict]:
+    try:
+        with open(DRIVE_CHANGES_STATE_PATH, "r", encoding="utf-8") as f:
+            state = json.load(f).get(folder_id)
+    except (OSError, ValueError):
+        return None
+    if not state or not state.get("token") or not isinstance(state.get("files"), dict):
+        return None
+    return state
+
+def _save_drive_sync_state(folder_id: str, state: dict):
+    try:
+        with open(DRIVE_CHANGES_STATE_PATH, "r", encoding="utf-8") as f:
+            all_states = json.load(f)
+    except (OSError, ValueError):
+        all_states = {}
+    all_states[folder_id] = state
+    tmp_path = f"{DRIVE_CHANGES_STATE_PATH}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(all_states, f, ensure_ascii=False)
+        os.replace(tmp_path, DRIVE_CHANGES_STATE_PATH)
+    except OSError as e:
+        print(f"[QD-BOT v8.3] Falha ao salvar token de changes: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _drive_folder_drive_id(drive_service, folder_id: str) -> str:
+    # "" = Meu Drive; o feed padrão (sem driveId) não traz as mudanças de drives compartilhados.
+    if DRIVE_CHANGES_DRIVE_ID:
+        return DRIVE_CHANGES_DRIVE_ID
+    meta = drive_service.files().get(fileId=folder_id, fields="driveId", supportsAllDrives=True).execute()
+    return meta.get("driveId") or ""
+
+def _drive_scope_kwargs(drive_id: str) -> dict:
+    kwargs = {"supportsAllDrives": True}
+    if drive_id:
+        kwargs["driveId"] = drive_id
+    return kwargs
+
+def _drive_full_sync(drive_service, folder_id: str) -> dict:
+    drive_id = _drive_folder_drive_id(drive_service, folder_id)
+    # O token é pego antes da listagem: mudanças feitas durante ela voltam no próximo delta.
+    token = drive_service.changes().getStartPageToken(**_drive_scope_kwargs(drive_id)).execute()
+    token = token["startPageToken"]
+    query = f"'{folder_id}' in parents and trashed = false"
+    files = _drive_list_all(drive_service, query, "files(id, name, md5Checksum, modifiedTime, mimeType)")
+    return {
+        "token": token,
+        "files": {f["id"]: {k: f[k] for k in _DRIVE_FILE_KEYS if k in f} for f in files},
+        "drive_id": drive_id,
+        "full_at": time.time(),
+    }
+
+def _drive_apply_changes(drive_service, folder_id: str, state: dict) -> tuple[dict, int]:
+    files = dict(state["files"])
+    token = state["token"]
+    fields = ("nextPageToken,newStartPageToken,"
+              "changes(fileId,removed,file(id,name,md5Checksum,modifiedTime,mimeType,parents,trashed))")
+    n_changes = 0
+    while token:
+        resp = drive_service.changes().list(
+            pageToken=token,
+            fields=fields,
+            pageSize=1000,
+            includeItemsFromAllDrives=True,
+            includeRemoved=True,
+            **_drive_scope_kwargs(state.get("drive_id") or ""),
+        ).execute()
+        for ch in resp.get("changes", []) or []:
+            n_changes += 1
+            f = ch.get("file") or {}
+            if ch.get("removed") or f.get("trashed") or folder_id not in (f.get("parents") or []):
+                files.pop(ch.get("fileId"), None)
+            else:
+                files[f["id"]] = {k: f[k] for k in _DRIVE_FILE_KEYS if k in f}
+        if resp.get("newStartPageToken"):
+            token = resp["newStartPageToken"]
+            break
+        token = resp.get("nextPageToken")
+    return dict(state, token=token or state["token"], files=files), n_changes
+
+def _drive_sync_files(drive_service, folder_id: str) -> list[dict]:
+    with _DRIVE_SYNC_LOCK:
+        t0 = time.perf_counter()
+        prev = state = _DRIVE_SYNC.get(folder_id) or _load_drive_sync_state(folder_id)
+        if state is not None and (time.time() - state.get("full_at", 0.0) >= DRIVE_FULL_RESYNC_S
+                                  or "drive_id" not in state):
+            # Rede de segurança contra mudanças que o feed não entregue: relista de tempos em tempos.
+            print("[QD-BOT v8.3] Relistagem periódica da pasta (DRIVE_FULL_RESYNC_S)")
+            state = None
+        if state is not None:
+            try:
+                state, n_changes = _drive_apply_changes(drive_service, folder_id, state)
+                print(f"[QD-BOT v8.3] Drive delta: {n_changes} mudança(s) em {time.perf_counter() - t0:.2f}s "
+                      f"({len(state['files'])} arquivo(s) na pasta)")
+            except Exception as e:
+                print(f"[QD-BOT v8.3] Feed de changes indisponível ({e}) — relistando a pasta")
+                state = None
+        if state is None:
+            state = _drive_full_sync(drive_service, folder_id)
+            print(f"[QD-BOT v8.3] Drive listado por completo: {len(state['files'])} arquivo(s) "
+                  f"em {time.perf_counter() - t0:.2f}s")
+        _DRIVE_SYNC[folder_id] = state
+        if state != prev:
+            _save_drive_sync_state(folder_id, state)
+    return list(state["files"].values())
+
 def _download_bytes(drive_service, file_id):
     request = drive_service.files().get_media(fileId=file_id, supportsAllDrives=True)
     return request.execute()
@@ -589,11 +1197,13 @@ def _download_text(drive_service, file_id) -> str:
     return _download_bytes(drive_service, file_id).decode("utf-8", errors="ignore")
 
 # ========================= PARSE DOCX =========================
-def _split_text_blocks(text, max_words=MAX_WORDS_PER_BLOCK):
+def _split_text_blocks(text, max_words=None):
+    max_words = max_words or MAX_WORDS_PER_BLOCK
     words = text.split()
     return [" ".join(words[i:i + max_words]) for i in range(0, len(words), max_words)]
 
-def _docx_to_blocks(file_bytes, file_name, file_id, max_words=MAX_WORDS_PER_BLOCK):
+def _docx_to_blocks(file_bytes, file_name, file_id, max_words=None):
+    from docx import Document
     doc = Document(io.BytesIO(file_bytes))
     text = "\n".join([p.text.strip() for p in doc.paragraphs if p.text.strip()])
     return [
@@ -747,13 +1357,161 @@ def _texto_para_embedding(block: dict) -> str:
     return texto
 
 # ========================= CACHE DE FONTES =========================
-@st.cache_data(show_spinner=False, ttl=600)
-def _list_sources_cached(folder_id: str, _v=CACHE_BUSTER):
-    drive = get_drive_client()
-    files_json = _list_json_metadata(drive, folder_id) if USE_JSONL else []
-    files_docx = _list_docx_metadata(drive, folder_id)
+# Listagem e versão do corpus ficam no processo. A versão (sha1 da assinatura dos arquivos) só é
+# recalculada quando a listagem é refeita; a pergunta lê o token e o índice por referência.
+# Vencido o TTL, a pergunta segue com a versão atual e uma única thread relista e, se o corpus
+# mudou, monta o novo índice antes de trocar o estado (stale-while-revalidate).
+# O estado é o buffer duplo do índice: {"sources", "version", "catalog", "vecdb", "ts"} é publicado
+# por troca de referência, e cada pergunta fixa o estado que leu primeiro (ver _fixar_corpus).
+_SOURCES_STATE: dict[str, dict] = {}
+_SOURCES_LOCK = threading.Lock()
+_SOURCES_REFRESHING: set[str] = set()
+_INDEX_BUILD_LOCK = threading.Lock()
+_CORPUS_PIN = threading.local()
+
+def _sources_from_files(files: list[dict]) -> dict:
+    files_json = _filter_json_files([f for f in files if f.get("mimeType") in _JSON_MIMES]) if USE_JSONL else []
+    files_docx = [f for f in files if f.get("mimeType") == _DOCX_MIME]
     return {"json": files_json, "docx": files_docx}
 
+def _list_sources_drive(folder_id: str) -> dict:
+    try:
+        drive = get_drive_client()
+        if USE_DRIVE_CHANGES:
+            return _sources_from_files(_drive_sync_files(drive, folder_id))
+        files_json = _list_json_metadata(drive, folder_id) if USE_JSONL else []
+        files_docx = _list_docx_metadata(drive, folder_id)
+        return {"json": files_json, "docx": files_docx}
+    except Exception as e:
+        # Drive fora do ar: segue com a última listagem sincronizada; os arquivos vêm do cache local.
+        synced = _DRIVE_SYNC.get(folder_id) or _load_drive_sync_state(folder_id)
+        if synced is None:
+            raise
+        print(f"[QD-BOT v8.3] Drive inacessível ({e}) — usando a última listagem conhecida "
+              f"({len(synced['files'])} arquivo(s), modo offline)")
+        return _sources_from_files(list(synced["files"].values()))
+
+def _new_sources_state(src: dict, prev: Optional[dict]) -> dict:
+    signature = _build_signature_sources(src.get("json", []), src.get("docx", []))
+    version = hashlib.sha1(signature.encode("utf-8")).hexdigest()
+    if prev is not None and prev["version"] == version:
+        return dict(prev, ts=time.time())
+    return {"sources": src, "version": version, "catalog": None, "vecdb": None, "ts": time.time()}
+
+def _estado_vivo(folder_id: str, state: dict) -> dict:
+    """O estado publicado de `folder_id` se ainda for da versão de `state`; senão o próprio `state`."""
+    atual = _SOURCES_STATE.get(folder_id)
+    if atual is not None and atual["version"] == state["version"]:
+        return atual
+    return state
+
+def _publicar_campos(folder_id: str, state: dict, **campos) -> dict:
+    """Publica uma cópia do estado com `campos` (índice ou catálogo montados depois da listagem).
+
+    Estados publicados nunca são alterados: a cópia parte do estado vivo da mesma versão (para não
+    perder o que outra thread já publicou) e só o substitui por troca de referência. A pergunta que
+    fixou `state` passa a ver a cópia; as demais seguem com o que fixaram.
+    """
+    with _SOURCES_LOCK:
+        base = _estado_vivo(folder_id, state)
+        novo = base
+        if any(base.get(k) is not v for k, v in campos.items()):
+            novo = dict(base, **campos)
+            if _SOURCES_STATE.get(folder_id) is base:
+                _SOURCES_STATE[folder_id] = novo
+    if getattr(_CORPUS_PIN, "state", None) is state:
+        _CORPUS_PIN.state = novo
+    return novo
+
+def _indice_incompleto(state: dict) -> bool:
+    # Índice montado com arquivos que falharam no download: vale até a próxima tentativa.
+    return bool((state.get("vecdb") or {}).get("falhas"))
+
+def _refresh_sources(folder_id: str, prev: dict):
+    t0 = time.perf_counter()
+    remontado = False
+    try:
+        src = _list_sources_drive(folder_id)
+        state = _new_sources_state(src, prev)
+        mudou = state["version"] != prev["version"]
+        if mudou or _indice_incompleto(prev):
+            if folder_id == FOLDER_ID and _LOCAL_CORPUS["vecdb"] is None:
+                # Monta o índice da nova versão fora do caminho da pergunta; até a troca abaixo,
+                # as perguntas continuam no índice anterior.
+                state["vecdb"] = build_vector_index(state["version"], src)
+                remontado = True
+            if mudou:
+                print(f"[QD-BOT v8.3] Corpus atualizado em segundo plano em {time.perf_counter() - t0:.2f}s "
+                      f"({prev['version'][:8]} -> {state['version'][:8]})")
+    except Exception as e:
+        print(f"[QD-BOT v8.3] Atualização da listagem falhou: {e} — mantendo a versão atual")
+        state = dict(prev, ts=time.time())
+    with _SOURCES_LOCK:
+        atual = _SOURCES_STATE.get(folder_id)
+        if atual is not None and atual is not prev and atual["version"] == state["version"] == prev["version"]:
+            # Índice/catálogo publicados enquanto a listagem rodava: renova o TTL sem perdê-los.
+            novo = dict(atual, ts=state["ts"])
+            if remontado:
+                novo["vecdb"] = state["vecdb"]
+            _SOURCES_STATE[folder_id] = novo
+        elif atual is prev:
+            _SOURCES_STATE[folder_id] = state
+        _SOURCES_REFRESHING.discard(folder_id)
+
+def _sources_ttl(state: dict) -> float:
+    return SOURCES_RETRY_TTL if _indice_incompleto(state) else SOURCES_TTL
+
+def _sources_state(folder_id: str) -> dict:
+    state = _SOURCES_STATE.get(folder_id)
+    if state is not None and time.time() - state["ts"] < _sources_ttl(state):
+        return state
+    with _SOURCES_LOCK:
+        state = _SOURCES_STATE.get(folder_id)
+        if state is None:
+            # Primeira carga: síncrona; perguntas concorrentes esperam neste lock pela mesma listagem.
+            state = _new_sources_state(_list_sources_drive(folder_id), None)
+            _SOURCES_STATE[folder_id] = state
+        elif time.time() - state["ts"] >= _sources_ttl(state) and folder_id not in _SOURCES_REFRESHING:
+            _SOURCES_REFRESHING.add(folder_id)
+            threading.Thread(target=_refresh_sources, args=(folder_id, state),
+                             name="qdbot-fontes", daemon=True).start()
+    return state
+
+def _list_sources_cached(folder_id: str, _v=CACHE_BUSTER):
+    return _sources_state(folder_id)["sources"]
+
+@contextmanager
+def _fixar_corpus():
+    """Durante uma pergunta, índice, catálogo e versão vêm do mesmo estado do corpus.
+
+    O estado é fixado no primeiro acesso; uma troca publicada no meio da pergunta só vale para
+    a próxima. O estado antigo é liberado quando a última pergunta que o fixou termina.
+    """
+    if getattr(_CORPUS_PIN, "ativo", False):
+        yield
+        return
+    _CORPUS_PIN.ativo, _CORPUS_PIN.state = True, None
+    try:
+        yield
+    finally:
+        _CORPUS_PIN.ativo, _CORPUS_PIN.state = False, None
+
+def _corpus_state() -> dict:
+    if getattr(_CORPUS_PIN, "ativo", False):
+        state = _CORPUS_PIN.state
+        if state is None:
+            state = _CORPUS_PIN.state = _sources_state(FOLDER_ID)
+        return state
+    return _sources_state(FOLDER_ID)
+
+def invalidar_fontes(folder_id: Optional[str] = None):
+    """Força a próxima consulta a relistar o Drive (todas as pastas se `folder_id` for None)."""
+    with _SOURCES_LOCK:
+        if folder_id is None:
+            _SOURCES_STATE.clear()
+        else:
+            _SOURCES_STATE.pop(folder_id, None)
+
 def _signature_from_files(files):
     return [{k: f.get(k) for k in ("id", "name", "md5Checksum", "modifiedTime")} for f in (files or [])]
 
@@ -764,58 +1522,255 @@ def _build_signature_sources(files_json, files_docx):
     }
     return json.dumps(payload, ensure_ascii=False)
 
+# ========================= CACHE LOCAL DE ARQUIVOS =========================
+# Endereçado pelo md5Checksum do Drive: "<md5>.raw" guarda os bytes baixados e "<chave>.blk" os
+# blocos parseados (JSON compacto comprimido com zlib). Arquivos sem md5 (exportações de
+# documentos nativos do Google) entram por (file_id, modifiedTime, mimeType). Toda entrada leva o
+# sha256 do conteúdo e é conferida na leitura: entrada corrompida é apagada e conta como miss.
+# Sobrevive a reinícios/redeploys, então arquivos inalterados não são baixados de novo; o mtime
+# marca o último uso para a evicção LRU.
+_FILE_CACHE_MAGIC = b"QDC2"
+_FILE_CACHE_HEADER = len(_FILE_CACHE_MAGIC) + 32
+_FILE_CACHE_LOCK = threading.Lock()
+_FILE_CACHE_STATE = {"bytes": None, "hits": 0, "misses": 0, "downloads": 0, "evicted": 0, "corrupted": 0}
+
+def _source_cache_key(f: dict) -> str:
+    """Versão do arquivo para os caches: o md5 do Drive, ou modifiedTime+mimeType se não houver."""
+    md5 = f.get("md5Checksum") or ""
+    if len(md5) == 32:
+        return md5
+    if not f.get("modifiedTime"):
+        return ""
+    return f"mt:{f['modifiedTime']}|{f.get('mimeType', '')}"
+
+def _file_cache_raw_path(file_id: str, key: str) -> str:
+    # Com md5 o conteúdo é o endereço (cópias do mesmo arquivo compartilham a entrada);
+    # sem md5 a chave só vale para aquele file_id.
+    raw = key if len(key) == 32 else f"{file_id}|{key}"
+    return os.path.join(FILE_CACHE_DIR, hashlib.sha1(raw.encode("utf-8")).hexdigest() + ".raw")
+
+def _file_cache_blocks_path(kind: str, file_id: str, md5: str, name: str) -> str:
+    # Os blocos carregam file_id/nome e dependem do tamanho de bloco: entram na chave junto com o md5.
+    raw = f"{kind}|{file_id}|{md5}|{name}|{MAX_WORDS_PER_BLOCK}|{CACHE_BUSTER}"
+    return os.path.join(FILE_CACHE_DIR, hashlib.sha1(raw.encode("utf-8")).hexdigest() + ".blk")
+
+def _file_cache_read(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    payload = data[_FILE_CACHE_HEADER:]
+    if (not data.startswith(_FILE_CACHE_MAGIC)
+            or hashlib.sha256(payload).digest() != data[len(_FILE_CACHE_MAGIC):_FILE_CACHE_HEADER]):
+        print(f"[QD-BOT v8.3] Entrada corrompida no cache de arquivos, descartando: {os.path.basename(path)}")
+        with _FILE_CACHE_LOCK:
+            _FILE_CACHE_STATE["corrupted"] += 1
+            _FILE_CACHE_STATE["bytes"] = None
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return payload
+
+def _file_cache_write(path: str, payload: bytes):
+    data = _FILE_CACHE_MAGIC + hashlib.sha256(payload).digest() + payload
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.makedirs(FILE_CACHE_DIR, exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"[QD-BOT v8.3] Falha ao gravar no cache de arquivos: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+    with _FILE_CACHE_LOCK:
+        if _FILE_CACHE_STATE["bytes"] is not None:
+            _FILE_CACHE_STATE["bytes"] += len(data)
+    _file_cache_evict()
+
+def _file_cache_entries() -> list[tuple[float, int, str]]:
+    out = []
+    try:
+        names = os.listdir(FILE_CACHE_DIR)
+    except OSError:
+        return out
+    for name in names:
+        if not name.endswith((".raw", ".blk")):
+            continue
+        path = os.path.join(FILE_CACHE_DIR, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        out.append((stat.st_mtime, stat.st_size, path))
+    return out
+
+def _file_cache_evict():
+    limit = FILE_CACHE_MAX_MB * 1024 * 1024
+    with _FILE_CACHE_LOCK:
+        if _FILE_CACHE_STATE["bytes"] is not None and _FILE_CACHE_STATE["bytes"] <= limit:
+            return
+        entries = _file_cache_entries()
+        total = sum(size for _mtime, size, _path in entries)
+        if total > limit:
+            # Desce a 90% do teto para não varrer o diretório a cada gravação.
+            for _mtime, size, path in sorted(entries):
+                if total <= limit * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                _FILE_CACHE_STATE["evicted"] += 1
+        _FILE_CACHE_STATE["bytes"] = total
+
+def _file_cache_get_blocks(path: str) -> Optional[list[dict]]:
+    data = _file_cache_read(path)
+    if data is None:
+        return None
+    try:
+        return json.loads(zlib.decompress(data).decode("utf-8"))
+    except (zlib.error, ValueError):
+        return None
+
+def _file_cache_put_blocks(path: str, blocks: list[dict]):
+    payload = json.dumps(blocks, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    _file_cache_write(path, zlib.compress(payload, 6))
+
+class _DownloadFalhou(Exception):
+    """Falha transitória ao baixar um arquivo do Drive (diferente de um arquivo vazio ou ilegível)."""
+
+def _download_bytes_cached(file_id: str, md5: str) -> bytes:
+    if USE_FILE_CACHE and md5:
+        data = _file_cache_read(_file_cache_raw_path(file_id, md5))
+        if data is not None:
+            return data
+    try:
+        data = _download_bytes(_thread_drive_client(), file_id)
+    except Exception as e:
+        raise _DownloadFalhou(f"{type(e).__name__}: {e}") from e
+    with _FILE_CACHE_LOCK:
+        _FILE_CACHE_STATE["downloads"] += 1
+    # Com md5, só grava quando o conteúdo bate com ele; sem md5 a chave já é (file_id, modifiedTime, mimeType).
+    if USE_FILE_CACHE and md5 and (len(md5) != 32 or hashlib.md5(data).hexdigest() == md5):
+        _file_cache_write(_file_cache_raw_path(file_id, md5), data)
+    return data
+
+def _parse_with_file_cache(kind: str, file_id: str, md5: str, name: str, parse) -> list[dict]:
+    path = _file_cache_blocks_path(kind, file_id, md5, name) if USE_FILE_CACHE and md5 else None
+    if path is not None:
+        blocks = _file_cache_get_blocks(path)
+        with _FILE_CACHE_LOCK:
+            _FILE_CACHE_STATE["hits" if blocks is not None else "misses"] += 1
+        if blocks is not None:
+            return blocks
+    blocks = parse(_download_bytes_cached(file_id, md5))
+    if path is not None:
+        _file_cache_put_blocks(path, blocks)
+    return blocks
+
+def file_cache_stats() -> dict:
+    with _FILE_CACHE_LOCK:
+        stats = {k: v for k, v in _FILE_CACHE_STATE.items() if k != "bytes"}
+    entries = _file_cache_entries()
+    stats["entries"] = len(entries)
+    stats["bytes"] = sum(size for _mtime, size, _path in entries)
+    return stats
+
+def _parse_docx(file_id: str, md5: str, name: str):
+    return _parse_with_file_cache(
+        "docx", file_id, md5, name, lambda raw: _docx_to_blocks(raw, name, file_id)
+    )
+
 @st.cache_data(show_spinner=False)
 def _parse_docx_cached(file_id: str, md5: str, name: str):
-    drive = get_drive_client()
-    return _docx_to_blocks(_download_bytes(drive, file_id), name, file_id)
+    return _parse_docx(file_id, md5, name)
 
-@st.cache_data(show_spinner=False)
-def _parse_json_cached(file_id: str, md5: str, name: str):
-    drive = get_drive_client()
-    raw_text = _download_text(drive, file_id)
-    loaded = _load_jsonish(raw_text)
+def _json_bytes_to_blocks(raw: bytes, file_id: str, name: str) -> list[dict]:
+    loaded = _load_jsonish(raw.decode("utf-8", errors="ignore"))
     blocks = _json_records_to_blocks(loaded, fallback_name=name, file_id=file_id)
     print(f"[QD-BOT v8.3] JSON parseado: {name} -> {len(blocks)} blocos")
     return blocks
 
-@st.cache_data(show_spinner=False, ttl=600)
-def _download_and_parse_blocks(signature: str, folder_id: str, _v=CACHE_BUSTER):
-    sources = _list_sources_cached(folder_id)
+def _parse_json(file_id: str, md5: str, name: str):
+    return _parse_with_file_cache(
+        "json", file_id, md5, name, lambda raw: _json_bytes_to_blocks(raw, file_id, name)
+    )
+
+@st.cache_data(show_spinner=False)
+def _parse_json_cached(file_id: str, md5: str, name: str):
+    return _parse_json(file_id, md5, name)
+
+def _source_entries(sources: dict) -> list[tuple[str, dict]]:
     files_json = sources.get("json", []) if USE_JSONL else []
     files_docx = sources.get("docx", []) or []
+    return [("json", f) for f in files_json] + [("docx", f) for f in files_docx]
 
-    blocks = []
+def _parse_source_file(kind: str, f: dict, cached: bool = True) -> Optional[list[dict]]:
+    """Blocos do arquivo; [] se vazio ou ilegível, None se o download falhou (tentar de novo depois).
 
-    for f in files_json:
-        try:
-            md5 = f.get("md5Checksum", f.get("modifiedTime", ""))
-            parsed = _parse_json_cached(f["id"], md5, f["name"])
-            if parsed:
-                blocks.extend(parsed)
-        except Exception as e:
-            print(f"[QD-BOT v8.3] Falha ao parsear JSON {f.get('name')}: {e}")
-            continue
+    Nas threads do pool de ingestão (sem ScriptRunContext) vale só o cache em disco: cached=False.
+    """
+    if kind == "json":
+        parse = _parse_json_cached if cached else _parse_json
+    else:
+        parse = _parse_docx_cached if cached else _parse_docx
+    try:
+        return parse(f["id"], _source_cache_key(f), f["name"]) or []
+    except _DownloadFalhou as e:
+        print(f"[QD-BOT v8.3] Falha ao baixar {kind.upper()} {f.get('name')}: {e}")
+        return None
+    except Exception as e:
+        print(f"[QD-BOT v8.3] Falha ao parsear {kind.upper()} {f.get('name')}: {e}")
+        return []
 
-    for f in files_docx:
-        try:
-            md5 = f.get("md5Checksum", f.get("modifiedTime", ""))
-            parsed = _parse_docx_cached(f["id"], md5, f["name"])
-            if parsed:
-                blocks.extend(parsed)
-        except Exception as e:
-            print(f"[QD-BOT v8.3] Falha ao parsear DOCX {f.get('name')}: {e}")
-            continue
+# Pool único por processo: as threads (e o cliente Drive de cada uma) sobrevivem entre montagens.
+_INGEST_POOL = {"pool": None}
+_INGEST_POOL_LOCK = threading.Lock()
+
+def _ingest_pool() -> ThreadPoolExecutor:
+    with _INGEST_POOL_LOCK:
+        if _INGEST_POOL["pool"] is None:
+            _INGEST_POOL["pool"] = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="qdbot-ingest")
+        return _INGEST_POOL["pool"]
 
+def _parse_sources_parallel(entries: list[tuple[str, dict]]) -> list[Optional[list[dict]]]:
+    # Download (I/O) de um arquivo se sobrepõe ao parse (CPU) de outro; a ordem de saída segue `entries`.
+    if len(entries) <= 1 or INGEST_WORKERS <= 1:
+        return [_parse_source_file(kind, f) for kind, f in entries]
+    return list(_ingest_pool().map(lambda e: _parse_source_file(*e, cached=False), entries))
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def _download_and_parse_blocks(signature: str, folder_id: str, _v=CACHE_BUSTER):
+    sources = _list_sources_cached(folder_id)
+    blocks = []
+    for parsed in _parse_sources_parallel(_source_entries(sources)):
+        blocks.extend(parsed or [])
     return blocks
 
+def _current_signature(folder_id: str) -> str:
+    """Token de versão do corpus (hex curto); não reserializa a listagem a cada chamada."""
+    if folder_id == FOLDER_ID:
+        return _corpus_state()["version"]
+    return _sources_state(folder_id)["version"]
+
 def load_all_blocks_cached(folder_id: str):
-    src = _list_sources_cached(folder_id)
-    signature = _build_signature_sources(src.get("json", []), src.get("docx", []))
+    signature = _current_signature(folder_id)
     blocks = _download_and_parse_blocks(signature, folder_id)
     return blocks, signature
 
 # ========================= AGRUPAMENTO =========================
-def agrupar_blocos(blocos, janela=GROUP_WINDOW):
+def agrupar_blocos(blocos, janela=None):
+    janela = GROUP_WINDOW if janela is None else janela
     grouped = []
     n = len(blocos)
     if n == 0:
@@ -844,9 +1799,12 @@ def agrupar_blocos(blocos, janela=GROUP_WINDOW):
     return grouped
 
 # ========================= DEDUPLICAÇÃO =========================
-def _deduplicate_results(results: list, max_overlap: float = DEDUP_MAX_OVERLAP) -> list:
+def _deduplicate_results(results: list, max_overlap: Optional[float] = None, lex: Optional[dict] = None) -> list:
     if not results:
         return results
+    max_overlap = DEDUP_MAX_OVERLAP if max_overlap is None else max_overlap
+    if lex is not None and "minhash" in lex:
+        return _deduplicate_by_minhash(results, lex, max_overlap)
     selected = [results[0]]
     for r in results[1:]:
         txt = r["block"].get("texto", "")
@@ -862,11 +1820,34 @@ def _deduplicate_results(results: list, max_overlap: float = DEDUP_MAX_OVERLAP)
             selected.append(r)
     return selected
 
+def _deduplicate_by_minhash(results: list, lex: dict, max_overlap: float) -> list:
+    # Mesmo critério de _overlap_score (interseção / menor conjunto), estimado pela
+    # similaridade de Jaccard das assinaturas e pelo tamanho dos conjuntos de tokens.
+    rows = np.fromiter((r["idx"] for r in results), dtype=np.int64, count=len(results))
+    sig = lex["minhash"][rows]
+    sizes = np.diff(lex["texto_indptr"])[rows].astype(np.float64)
+
+    keep = [0]
+    for j in range(1, len(results)):
+        if sizes[j] > 0:
+            sel = np.asarray(keep)
+            jac = (sig[sel] == sig[j]).mean(axis=1)
+            inter = jac * (sizes[sel] + sizes[j]) / (1.0 + jac)
+            denom = np.minimum(sizes[sel], sizes[j])
+            overlap = np.divide(inter, denom, out=np.zeros_like(inter), where=denom > 0)
+            if (overlap > max_overlap).any():
+                continue
+        keep.append(j)
+    return [results[j] for j in keep]
+
 # ========================= ÍNDICE / EMBEDDINGS =========================
 def _list_named_files_map():
-    drive = get_drive_client()
     want = {PRECOMP_FAISS_NAME, PRECOMP_VECTORS_NAME, PRECOMP_BLOCKS_NAME}
-    name_map = _list_named_files(drive, FOLDER_ID, want)
+    synced = _DRIVE_SYNC.get(FOLDER_ID) if USE_DRIVE_CHANGES else None
+    if synced is not None:
+        name_map = {f["name"]: f for f in synced["files"].values() if f.get("name") in want}
+    else:
+        name_map = _list_named_files(get_drive_client(), FOLDER_ID, want)
     return name_map if all(n in name_map for n in want) else None
 
 @st.cache_resource(show_spinner=False)
@@ -899,82 +1880,876 @@ def try_import_faiss():
     except Exception:
         return None
 
-@st.cache_resource(show_spinner=False)
-def build_vector_index(signature: str, _v=CACHE_BUSTER):
-    pre = _load_precomputed_index()
-    if pre is not None:
-        return pre
+def _ann_params(n: int, dim: int, kind: str = None, min_blocks: Optional[int] = None) -> dict:
+    kind = (kind or ANN_INDEX_TYPE).lower()
+    min_blocks = ANN_MIN_BLOCKS if min_blocks is None else min_blocks
+    if kind not in ("flat", "hnsw", "ivfpq") or n < min_blocks:
+        kind = "flat"
+    sq = {"float16": "fp16", "int8": "8bit"}.get(EMB_STORAGE_DTYPE)
+    if kind == "hnsw":
+        return {"type": "hnsw", "M": HNSW_M, "ef_construction": HNSW_EF_CONSTRUCTION, "ef_search": HNSW_EF_SEARCH,
+                "sq": sq}
+    if kind == "ivfpq":
+        nlist = IVF_NLIST or int(4 * np.sqrt(n))
+        # k-means do IVF precisa de ~39 pontos por lista para não reclamar de treino insuficiente
+        nlist = max(1, min(nlist, n // 39))
+        pq_m = PQ_M if dim % PQ_M == 0 else next(m for m in (64, 48, 32, 24, 16, 8, 4, 2, 1) if dim % m == 0)
+        # cada subquantizador tem 2**nbits centróides e também precisa de pontos para treinar
+        nbits = max(1, min(PQ_NBITS, int(np.log2(max(n, 2)))))
+        return {"type": "ivfpq", "nlist": nlist, "nprobe": min(IVF_NPROBE, nlist), "pq_m": pq_m, "nbits": nbits}
+    return {"type": "flat", "sq": sq}
+
+def _apply_ann_search_params(index, params: dict):
+    if params.get("type") == "hnsw":
+        index.hnsw.efSearch = int(params["ef_search"])
+    elif params.get("type") == "ivfpq":
+        index.nprobe = int(params["nprobe"])
+
+def build_ann_index(emb, params: Optional[dict] = None, scale=None):
+    """Monta o índice FAISS descrito por `params` (ver `_ann_params`). Retorna (index, params).
+
+    `emb` pode estar quantizada (ver `quantize_embeddings`); é convertida para float32 aos poucos.
+    """
+    faiss = try_import_faiss()
+    if faiss is None:
+        return None, {"type": "numpy"}
+    n, dim = emb.shape
+    params = params or _ann_params(n, dim)
+    qtypes = {"fp16": faiss.ScalarQuantizer.QT_fp16, "8bit": faiss.ScalarQuantizer.QT_8bit}
+    sq = params.get("sq")
+    t0 = time.perf_counter()
 
-    blocks_raw, _sig = load_all_blocks_cached(FOLDER_ID)
-    grouped = agrupar_blocos(blocks_raw, janela=GROUP_WINDOW)
-    if not grouped:
-        return {"blocks": [], "emb": None, "index": None, "use_faiss": False}
+    max_train = NUMPY_SEARCH_CHUNK
+    if params["type"] == "hnsw":
+        if sq:
+            index = faiss.IndexHNSWSQ(dim, qtypes[sq], int(params["M"]), faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexHNSWFlat(dim, int(params["M"]), faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = int(params["ef_construction"])
+    elif params["type"] == "ivfpq":
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, int(params["nlist"]), int(params["pq_m"]),
+                                 int(params["nbits"]), faiss.METRIC_INNER_PRODUCT)
+        max_train = 256 * int(params["nlist"])
+    elif sq:
+        index = faiss.IndexScalarQuantizer(dim, qtypes[sq], faiss.METRIC_INNER_PRODUCT)
+    else:
+        index = faiss.IndexFlatIP(dim)
 
-    sbert = get_sbert_model()
-    texts = [_texto_para_embedding(b) for b in grouped]
+    if not index.is_trained:
+        rows = None
+        if n > max_train:
+            rows = np.sort(np.random.RandomState(0).choice(n, max_train, replace=False))
+        index.train(np.ascontiguousarray(dequantize_embeddings(emb, scale, rows)))
+    for start in range(0, n, NUMPY_SEARCH_CHUNK):
+        index.add(np.ascontiguousarray(dequantize_embeddings(emb[start:start + NUMPY_SEARCH_CHUNK], scale)))
+
+    _apply_ann_search_params(index, params)
+    if params["type"] != "flat" or sq:
+        print(f"[QD-BOT v8.3] Índice {params['type']}{'/' + sq if sq else ''} montado: "
+              f"{n} vetores em {time.perf_counter() - t0:.2f}s")
+    return index, params
+
+def _faiss_index_bytes(index) -> int:
+    faiss = try_import_faiss()
+    storage = faiss.downcast_index(index.storage) if hasattr(index, "storage") else index
+    try:
+        total = int(index.ntotal) * int(storage.sa_code_size())
+    except Exception:
+        total = int(index.ntotal) * int(index.d) * 4
+    if hasattr(index, "hnsw"):
+        total += int(index.hnsw.neighbors.size()) * 4
+    if hasattr(index, "invlists"):
+        total += int(index.ntotal) * 8
+    return total
+
+def quantize_embeddings(emb, dtype: Optional[str] = None):
+    """Converte a matriz de embeddings para `dtype`. Retorna (matriz, escala por dimensão ou None)."""
+    dtype = dtype or EMB_STORAGE_DTYPE
+    emb = np.asarray(emb, dtype=np.float32)
+    if dtype == "float16":
+        return emb.astype(np.float16), None
+    if dtype == "int8":
+        scale = np.abs(emb).max(axis=0) / 127.0
+        scale[scale == 0] = 1.0
+        q = np.clip(np.rint(emb / scale), -127, 127).astype(np.int8)
+        return q, scale.astype(np.float32)
+    return emb, None
+
+def dequantize_embeddings(mat, scale=None, rows=None) -> np.ndarray:
+    """float32 das linhas `rows` (ou de todas) de uma matriz possivelmente quantizada."""
+    out = np.asarray(mat if rows is None else mat[rows], dtype=np.float32)
+    if scale is not None:
+        out = out * scale
+    return out
 
-    @st.cache_data(show_spinner=False)
-    def _embed_texts_cached(texts_, sig: str, _v2=CACHE_BUSTER):
-        return sbert.encode(
-            texts_,
-            convert_to_numpy=True,
-            normalize_embeddings=True,
-            show_progress_bar=False,
-            batch_size=64,
+def _emb_rows(vecdb: dict, rows=None) -> np.ndarray:
+    if vecdb.get("emb") is None and vecdb.get("index") is not None:
+        # sem cópia da matriz (ver _release_emb_copy): o índice exato devolve os próprios vetores
+        index = vecdb["index"]
+        if rows is None:
+            return index.reconstruct_n(0, int(index.ntotal))
+        return np.vstack([index.reconstruct(int(i)) for i in rows]).astype(np.float32, copy=False)
+    return dequantize_embeddings(vecdb["emb"], vecdb.get("emb_scale"), rows)
+
+def numpy_topk(mat, q_mat, top_n: int, scale=None, chunk_rows: Optional[int] = None):
+    """Top-n por produto interno para um lote de consultas, sem ordenar o corpus inteiro.
+
+    `mat` pode ser float32, float16 ou int8; com `scale`, o escore é q · (mat * scale).
+    Retorna (índices, escores), ambos com uma linha por consulta, em ordem decrescente.
+    """
+    q_mat = np.atleast_2d(np.asarray(q_mat, dtype=np.float32))
+    if scale is not None:
+        q_mat = q_mat * scale
+    n = mat.shape[0]
+    k = min(top_n, n)
+    if k <= 0:
+        return np.zeros((q_mat.shape[0], 0), dtype=np.int64), np.zeros((q_mat.shape[0], 0), dtype=np.float32)
+
+    cand_idx, cand_scores = [], []
+    chunk_rows = chunk_rows or NUMPY_SEARCH_CHUNK
+    for start in range(0, n, chunk_rows):
+        block = np.asarray(mat[start:start + chunk_rows], dtype=np.float32)
+        scores = q_mat @ block.T
+        kk = min(k, block.shape[0])
+        part = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+        cand_idx.append(part + start)
+        cand_scores.append(np.take_along_axis(scores, part, axis=1))
+
+    idx = np.concatenate(cand_idx, axis=1)
+    scores = np.concatenate(cand_scores, axis=1)
+    if idx.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        idx = np.take_along_axis(idx, part, axis=1)
+        scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-scores, axis=1)
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+# ========================= EMBEDDINGS POR ARQUIVO =========================
+def _file_store_key(file_id: str, md5: str) -> str:
+    raw = f"{file_id}|{md5}|{_embed_model_tag()}|{GROUP_WINDOW}|{MAX_WORDS_PER_BLOCK}|{CACHE_BUSTER}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def _load_file_embeddings(key: str):
+    base = os.path.join(FILE_EMB_STORE_DIR, key)
+    try:
+        with open(base + ".json", "r", encoding="utf-8") as f:
+            grouped = json.load(f)
+        emb = np.load(base + ".npy")
+        if len(grouped) != emb.shape[0]:
+            return None
+        return grouped, emb
+    except (OSError, ValueError):
+        return None
+
+def _save_file_embeddings(key: str, grouped: list[dict], emb):
+    base = os.path.join(FILE_EMB_STORE_DIR, key)
+    try:
+        os.makedirs(FILE_EMB_STORE_DIR, exist_ok=True)
+        tmp = f"{base}.tmp-{os.getpid()}"
+        np.save(tmp + ".npy", np.asarray(emb, dtype=np.float32))
+        with open(tmp + ".json", "w", encoding="utf-8") as f:
+            json.dump(grouped, f, ensure_ascii=False)
+        os.replace(tmp + ".npy", base + ".npy")
+        os.replace(tmp + ".json", base + ".json")
+    except Exception as e:
+        print(f"[QD-BOT v8.3] Falha ao salvar embeddings do arquivo {key}: {e}")
+
+def _prune_file_embeddings(live_keys: set[str]):
+    try:
+        names = os.listdir(FILE_EMB_STORE_DIR)
+    except OSError:
+        return
+    for name in names:
+        key = name.split(".", 1)[0]
+        if key not in live_keys:
+            try:
+                os.remove(os.path.join(FILE_EMB_STORE_DIR, name))
+            except OSError:
+                pass
+
+def _encode_texts(sbert, texts: list[str]):
+    return sbert.encode(
+        texts,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False,
+        batch_size=64,
+    )
+
+def _embed_sources_incremental(sources: dict):
+    """(blocos, embeddings, falhas): só arquivos novos/alterados (file_id, md5) passam pelo SBERT.
+
+    Removidos saem do índice; `falhas` lista os arquivos cujo download falhou, que ficam de fora
+    desta montagem e sem embeddings gravados.
+    """
+    entries = _source_entries(sources)
+    per_file: list[Optional[tuple[list[dict], Any]]] = [None] * len(entries)
+    keys = [_file_store_key(f["id"], _source_cache_key(f)) for _kind, f in entries]
+
+    missing = []
+    falhas: list[str] = []
+    for pos, key in enumerate(keys):
+        hit = _load_file_embeddings(key) if USE_FILE_EMB_STORE else None
+        if hit is not None:
+            per_file[pos] = hit
+        else:
+            missing.append(pos)
+
+    if missing:
+        parsed_by_pos = {}
+        for pos, parsed in zip(missing, _parse_sources_parallel([entries[pos] for pos in missing])):
+            if parsed is None:
+                falhas.append(entries[pos][1].get("name") or entries[pos][1]["id"])
+            else:
+                parsed_by_pos[pos] = parsed
+        missing = list(parsed_by_pos)
+        grouped_missing = {pos: agrupar_blocos(parsed, janela=GROUP_WINDOW) for pos, parsed in parsed_by_pos.items()}
+
+        texts = [_texto_para_embedding(b) for pos in missing for b in grouped_missing[pos]]
+        emb_new = _encode_texts(get_sbert_model(), texts) if texts else None
+
+        offset = 0
+        for pos in missing:
+            grouped = grouped_missing[pos]
+            n = len(grouped)
+            if n:
+                emb_file = emb_new[offset:offset + n]
+            else:
+                emb_file = np.zeros((0, 0), dtype=np.float32)
+            offset += n
+            per_file[pos] = (grouped, emb_file)
+            if USE_FILE_EMB_STORE and n:
+                _save_file_embeddings(keys[pos], grouped, emb_file)
+
+        print(
+            f"[QD-BOT v8.3] Embeddings incrementais: {len(missing)} arquivo(s) codificado(s), "
+            f"{len(entries) - len(missing) - len(falhas)} reaproveitado(s), {len(texts)} blocos novos"
         )
 
-    emb = _embed_texts_cached(texts, signature)
+    if USE_FILE_EMB_STORE:
+        _prune_file_embeddings(set(keys))
 
+    grouped_all = []
+    emb_parts = []
+    for item in per_file:
+        if item is None or not item[0]:
+            continue
+        grouped, emb_file = item
+        grouped_all.extend(grouped)
+        emb_parts.append(np.asarray(emb_file, dtype=np.float32))
+
+    if not grouped_all:
+        return [], None, falhas
+    return grouped_all, np.vstack(emb_parts), falhas
+
+# ========================= ÍNDICE LÉXICO (tokens internados) =========================
+def _token_ids_csr(token_lists: list[list[int]]):
+    indptr = np.zeros(len(token_lists) + 1, dtype=np.int64)
+    for i, ids in enumerate(token_lists):
+        indptr[i + 1] = indptr[i] + len(ids)
+    flat = [t for ids in token_lists for t in ids]
+    return indptr, np.asarray(flat, dtype=np.int32)
+
+def _block_field_token_ids(blocks: list[dict], vocab: dict[str, int]) -> dict[str, list[list[int]]]:
+    fields = {"pagina": [], "texto": []}
+    for b in blocks:
+        for field, rows in fields.items():
+            rows.append([vocab.setdefault(tok, len(vocab)) for tok in _tokenize(b.get(field, ""))])
+    return fields
+
+def build_lexical_index(blocks: list[dict]) -> dict:
+    vocab: dict[str, int] = {}
+    fields = _block_field_token_ids(blocks, vocab)
+    return _lexical_index_from_fields(vocab, fields)
+
+def _lexical_index_from_fields(vocab: dict[str, int], fields: dict[str, list[list[int]]], minhash=None) -> dict:
+    # Conjuntos de tokens de `texto` e `pagina` por bloco, em CSR (ids ordenados e únicos).
+    lex = {"vocab": vocab}
+    for field, rows in fields.items():
+        indptr, ids = _token_ids_csr([sorted(set(r)) for r in rows])
+        lex[f"{field}_indptr"] = indptr
+        lex[f"{field}_ids"] = ids
+    lex["minhash"] = minhash if minhash is not None else build_minhash_signatures(fields["texto"], vocab)
+    if USE_BM25:
+        doc_tokens = [p + t for p, t in zip(fields["pagina"], fields["texto"])]
+        lex.update(build_bm25_index(doc_tokens, len(vocab)))
+    return lex
+
+_MINHASH_PRIME = (1 << 61) - 1
+
+def build_minhash_signatures(token_lists: list[list[int]], vocab: dict[str, int],
+                             n_perms: Optional[int] = None) -> np.ndarray:
+    """Assinatura MinHash (uint32, uma linha por bloco) do conjunto de tokens de cada bloco."""
+    n_perms = n_perms or DEDUP_MINHASH_PERMS
+    inv = [""] * len(vocab)
+    for tok, i in vocab.items():
+        inv[i] = tok
+    # crc32 em vez de hash(): o valor precisa ser o mesmo entre processos (snapshot).
+    tok_hash = np.fromiter((zlib.crc32(t.encode("utf-8")) for t in inv), dtype=np.uint64, count=len(inv))
+
+    indptr, ids = _token_ids_csr([sorted(set(r)) for r in token_lists])
+    sig = np.full((len(token_lists), n_perms), np.iinfo(np.uint32).max, dtype=np.uint32)
+    if ids.size == 0:
+        return sig
+    nonempty = np.flatnonzero(np.diff(indptr) > 0)
+
+    rng = np.random.RandomState(1_000_003)
+    a = rng.randint(1, 1 << 31, size=n_perms).astype(np.uint64)
+    b = rng.randint(0, 1 << 31, size=n_perms).astype(np.uint64)
+    # Permutações calculadas sobre o vocabulário (pequeno) e depois só indexadas por bloco.
+    perm = ((a[:, None] * tok_hash[None, :] + b[:, None]) % np.uint64(_MINHASH_PRIME)).astype(np.uint32)
+    starts = indptr[nonempty]
+    for k in range(n_perms):
+        sig[nonempty, k] = np.minimum.reduceat(perm[k][ids], starts)
+    return sig
+
+def _duplicate_block_mask(blocks: list[dict], minhash: np.ndarray) -> np.ndarray:
+    # Só descarta o bloco quando a cópia idêntica é do mesmo documento e de outro arquivo.
+    keep = np.ones(len(blocks), dtype=bool)
+    first_seen: dict[tuple, int] = {}
+    for i, b in enumerate(blocks):
+        key = (_base_document_name(b.get("pagina", "?")), minhash[i].tobytes())
+        first = first_seen.setdefault(key, i)
+        if first != i and blocks[first].get("file_id") != b.get("file_id"):
+            keep[i] = False
+    return keep
+
+def _lexical_overlap_rows(lex: dict, field: str, q_ids, n_query_tokens: int, rows):
+    # Equivale a _lexical_overlap(query, block[field]) para todas as linhas de uma vez.
+    out = np.zeros(len(rows), dtype=np.float32)
+    if n_query_tokens == 0 or len(rows) == 0 or len(q_ids) == 0:
+        return out
+    indptr = lex[f"{field}_indptr"]
+    ids = lex[f"{field}_ids"]
+    starts = indptr[rows]
+    lens = indptr[rows + 1] - starts
+    total = int(lens.sum())
+    if total == 0:
+        return out
+    seg_start = np.repeat(starts - np.concatenate(([0], np.cumsum(lens)[:-1])), lens)
+    positions = seg_start + np.arange(total)
+    hits = np.isin(ids[positions], q_ids, assume_unique=False)
+    owner = np.repeat(np.arange(len(rows)), lens)
+    counts = np.bincount(owner, weights=hits, minlength=len(rows))
+    return (counts / n_query_tokens).astype(np.float32)
+
+def lexical_overlap_batch(lex: dict, query: str, rows) -> tuple:
+    q_tokens = set(_tokenize(query))
+    vocab = lex["vocab"]
+    q_ids = np.asarray(sorted(vocab[t] for t in q_tokens if t in vocab), dtype=np.int32)
+    rows = np.asarray(rows, dtype=np.int64)
+    return (
+        _lexical_overlap_rows(lex, "texto", q_ids, len(q_tokens), rows),
+        _lexical_overlap_rows(lex, "pagina", q_ids, len(q_tokens), rows),
+    )
+
+def build_bm25_index(doc_tokens: list[list[int]], n_terms: int) -> dict:
+    # Índice invertido sobre `pagina` + `texto`, com o peso BM25 de cada posting já calculado.
+    n_docs = len(doc_tokens)
+    postings: dict[int, list[tuple[int, int]]] = {}
+    doc_len = np.zeros(n_docs, dtype=np.float32)
+    for doc, toks in enumerate(doc_tokens):
+        doc_len[doc] = len(toks)
+        counts: dict[int, int] = {}
+        for tid in toks:
+            counts[tid] = counts.get(tid, 0) + 1
+        for tid, tf in counts.items():
+            postings.setdefault(tid, []).append((doc, tf))
+
+    avgdl = float(doc_len.mean()) if n_docs else 0.0
+    indptr = np.zeros(n_terms + 1, dtype=np.int64)
+    for tid in range(n_terms):
+        indptr[tid + 1] = indptr[tid] + len(postings.get(tid, ()))
+    docs = np.empty(int(indptr[-1]), dtype=np.int32)
+    weights = np.empty(int(indptr[-1]), dtype=np.float32)
+
+    for tid, plist in postings.items():
+        start, end = indptr[tid], indptr[tid + 1]
+        p_docs = np.fromiter((d for d, _tf in plist), dtype=np.int32, count=len(plist))
+        p_tf = np.fromiter((tf for _d, tf in plist), dtype=np.float32, count=len(plist))
+        df = len(plist)
+        idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+        norm = BM25_K1 * (1.0 - BM25_B + BM25_B * doc_len[p_docs] / max(avgdl, 1e-9))
+        docs[start:end] = p_docs
+        weights[start:end] = idf * p_tf * (BM25_K1 + 1.0) / (p_tf + norm)
+
+    return {"bm25_indptr": indptr, "bm25_docs": docs, "bm25_weights": weights}
+
+def bm25_search(lex: dict, query: str, top_n: int) -> list[tuple[int, float]]:
+    vocab = lex["vocab"]
+    indptr = lex.get("bm25_indptr")
+    if indptr is None:
+        return []
+    q_ids = sorted({vocab[t] for t in _tokenize(query) if t in vocab and vocab[t] < len(indptr) - 1})
+    if not q_ids:
+        return []
+    docs = np.concatenate([lex["bm25_docs"][indptr[t]:indptr[t + 1]] for t in q_ids])
+    if docs.size == 0:
+        return []
+    weights = np.concatenate([lex["bm25_weights"][indptr[t]:indptr[t + 1]] for t in q_ids])
+    uniq, inverse = np.unique(docs, return_inverse=True)
+    scores = np.bincount(inverse, weights=weights)
+    k = min(top_n, len(uniq))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(int(uniq[j]), float(scores[j])) for j in top]
+
+def _fuse_rrf(dense: list[tuple[int, float]], sparse: list[tuple[int, float]], top_n: int) -> list[int]:
+    fused: dict[int, float] = {}
+    for ranking in (dense, sparse):
+        for rank, (i, _s) in enumerate(ranking):
+            fused[i] = fused.get(i, 0.0) + 1.0 / (RRF_K + rank + 1)
+    ordered = sorted(fused.items(), key=lambda x: (-x[1], x[0]))
+    return [i for i, _score in ordered[:top_n]]
+
+def _save_lexical_index(snap_dir: str, lex: dict):
+    arrays = {k: v for k, v in lex.items() if k != "vocab"}
+    np.savez(os.path.join(snap_dir, SNAPSHOT_LEXICAL_NAME), **arrays)
+    vocab_list = [None] * len(lex["vocab"])
+    for tok, i in lex["vocab"].items():
+        vocab_list[i] = tok
+    with open(os.path.join(snap_dir, SNAPSHOT_VOCAB_NAME), "w", encoding="utf-8") as f:
+        json.dump(vocab_list, f, ensure_ascii=False)
+
+def _load_lexical_index(snap_dir: str) -> Optional[dict]:
+    lex_path = os.path.join(snap_dir, SNAPSHOT_LEXICAL_NAME)
+    vocab_path = os.path.join(snap_dir, SNAPSHOT_VOCAB_NAME)
+    if not (os.path.isfile(lex_path) and os.path.isfile(vocab_path)):
+        return None
+    with open(vocab_path, "r", encoding="utf-8") as f:
+        vocab_list = json.load(f)
+    with np.load(lex_path) as data:
+        lex = {k: data[k] for k in data.files}
+    lex["vocab"] = {tok: i for i, tok in enumerate(vocab_list)}
+    return lex
+
+# ========================= SNAPSHOT EM DISCO =========================
+def _snapshot_key(signature: str) -> str:
+    raw = f"{signature}|{_embed_model_tag()}|{GROUP_WINDOW}|{MAX_WORDS_PER_BLOCK}|{EMB_STORAGE_DTYPE}|{CACHE_BUSTER}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def _snapshot_path(signature: str) -> str:
+    return os.path.join(SNAPSHOT_DIR, _snapshot_key(signature))
+
+def _prune_snapshots(keep: Optional[int] = None):
+    keep = SNAPSHOT_KEEP if keep is None else keep
+    try:
+        entries = [
+            os.path.join(SNAPSHOT_DIR, d) for d in os.listdir(SNAPSHOT_DIR)
+            if os.path.isfile(os.path.join(SNAPSHOT_DIR, d, SNAPSHOT_META_NAME))
+        ]
+    except OSError:
+        return
+    entries.sort(key=lambda d: os.path.getmtime(os.path.join(d, SNAPSHOT_META_NAME)), reverse=True)
+    for d in entries[keep:]:
+        shutil.rmtree(d, ignore_errors=True)
+
+def build_family_map(blocks: list[dict]) -> dict[str, dict[str, list[int]]]:
+    """família normalizada -> documento -> posições dos blocos no índice (em ordem)."""
+    fam_map: dict[str, dict[str, list[int]]] = {}
+    doc_family: dict[str, str] = {}
+    for pos, block in enumerate(blocks):
+        doc_name = _base_document_name(block.get("pagina", "?"))
+        fam_norm = doc_family.get(doc_name)
+        if fam_norm is None:
+            fam_norm = doc_family[doc_name] = _norm_key(_extract_document_family(doc_name))
+        fam_map.setdefault(fam_norm, {}).setdefault(doc_name, []).append(pos)
+    return fam_map
+
+def _load_family_map(snap_dir: str, blocks: list[dict]) -> dict:
+    path = os.path.join(snap_dir, SNAPSHOT_FAMILIES_NAME)
+    if os.path.isfile(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            pass
+    return build_family_map(blocks)
+
+def _save_index_snapshot(signature: str, vecdb: dict) -> Optional[str]:
+    """Grava o snapshot da versão `signature`. Retorna o diretório salvo ou None."""
+    if not USE_SNAPSHOT or vecdb.get("emb") is None:
+        return None
+    final_dir = _snapshot_path(signature)
+    tmp_dir = f"{final_dir}.tmp-{os.getpid()}"
+    try:
+        os.makedirs(tmp_dir, exist_ok=True)
+        emb = np.ascontiguousarray(vecdb["emb"])
+        np.save(os.path.join(tmp_dir, SNAPSHOT_EMB_NAME), emb)
+        if vecdb.get("emb_scale") is not None:
+            np.save(os.path.join(tmp_dir, SNAPSHOT_EMB_SCALE_NAME), vecdb["emb_scale"])
+        with open(os.path.join(tmp_dir, SNAPSHOT_BLOCKS_NAME), "w", encoding="utf-8") as f:
+            json.dump(vecdb["blocks"], f, ensure_ascii=False)
+        if vecdb.get("lex") is not None:
+            _save_lexical_index(tmp_dir, vecdb["lex"])
+        if vecdb.get("family_map") is not None:
+            with open(os.path.join(tmp_dir, SNAPSHOT_FAMILIES_NAME), "w", encoding="utf-8") as f:
+                json.dump(vecdb["family_map"], f, ensure_ascii=False)
+        if vecdb.get("use_faiss") and vecdb.get("index") is not None:
+            faiss = try_import_faiss()
+            if faiss is not None:
+                faiss.write_index(vecdb["index"], os.path.join(tmp_dir, SNAPSHOT_FAISS_NAME))
+        meta = {
+            "key": _snapshot_key(signature),
+            "embed_model": _embed_model_tag(),
+            "cache_buster": CACHE_BUSTER,
+            "n_blocks": len(vecdb["blocks"]),
+            "dim": int(emb.shape[1]),
+            "emb_dtype": str(emb.dtype),
+            "ann": vecdb.get("ann") or {"type": "flat"},
+            "created_at": time.time(),
+        }
+        # meta.json por último: só é um snapshot válido se chegou até aqui
+        with open(os.path.join(tmp_dir, SNAPSHOT_META_NAME), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(tmp_dir, final_dir)
+        print(f"[QD-BOT v8.3] Snapshot salvo: {final_dir} ({meta['n_blocks']} blocos)")
+        _prune_snapshots()
+        return final_dir
+    except Exception as e:
+        print(f"[QD-BOT v8.3] Falha ao salvar snapshot: {e}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return None
+
+def _release_emb_copy(vecdb: dict, snap_dir: Optional[str] = None):
+    """Descarta a matriz de embeddings recém-montada, que duplicaria em RAM os vetores do índice FAISS.
+
+    Com snapshot, passa a usar a view somente leitura (mmap) do emb.npy salvo, como numa carga
+    de snapshot. Sem snapshot, só descarta se o índice for exato (flat/HNSW sem SQ): _emb_rows
+    reconstrói as linhas dele. Índices com perda (PQ/SQ) mantêm a cópia para o refino exato.
+    """
+    if vecdb.get("emb") is None:
+        return
+    if snap_dir:
+        vecdb["emb"] = np.load(os.path.join(snap_dir, SNAPSHOT_EMB_NAME), mmap_mode="r")
+        return
+    ann = vecdb.get("ann") or {}
+    if vecdb.get("use_faiss") and ann.get("type", "flat") in ("flat", "hnsw") and not ann.get("sq"):
+        vecdb["emb"] = None
+        vecdb["emb_scale"] = None
+
+def _update_snapshot_ann(snap_dir: str, meta: dict, index, ann: dict):
     faiss = try_import_faiss()
-    use_faiss = False
-    index = None
-    if faiss is not None:
-        dim = emb.shape[1]
-        index = faiss.IndexFlatIP(dim)
-        index.add(emb.astype(np.float32))
-        use_faiss = True
+    try:
+        tmp_index = os.path.join(snap_dir, f"{SNAPSHOT_FAISS_NAME}.tmp-{os.getpid()}")
+        faiss.write_index(index, tmp_index)
+        os.replace(tmp_index, os.path.join(snap_dir, SNAPSHOT_FAISS_NAME))
+        tmp_meta = os.path.join(snap_dir, f"{SNAPSHOT_META_NAME}.tmp-{os.getpid()}")
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump(dict(meta, ann=ann), f)
+        os.replace(tmp_meta, os.path.join(snap_dir, SNAPSHOT_META_NAME))
+    except Exception as e:
+        print(f"[QD-BOT v8.3] Falha ao atualizar índice ANN do snapshot: {e}")
 
-    return {"blocks": grouped, "emb": emb, "index": index, "use_faiss": use_faiss}
+def _load_index_snapshot(signature: str):
+    if not USE_SNAPSHOT:
+        return None
+    snap_dir = _snapshot_path(signature)
+    meta_path = os.path.join(snap_dir, SNAPSHOT_META_NAME)
+    if not os.path.isfile(meta_path):
+        return None
+    try:
+        t0 = time.perf_counter()
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("embed_model") != _embed_model_tag():
+            return None
+        emb = np.load(os.path.join(snap_dir, SNAPSHOT_EMB_NAME), mmap_mode="r")
+        scale_path = os.path.join(snap_dir, SNAPSHOT_EMB_SCALE_NAME)
+        emb_scale = np.load(scale_path) if os.path.isfile(scale_path) else None
+        with open(os.path.join(snap_dir, SNAPSHOT_BLOCKS_NAME), "r", encoding="utf-8") as f:
+            blocks = json.load(f)
+        if len(blocks) != emb.shape[0]:
+            return None
+
+        index = None
+        use_faiss = False
+        faiss = try_import_faiss()
+        faiss_path = os.path.join(snap_dir, SNAPSHOT_FAISS_NAME)
+        ann = meta.get("ann") or {"type": "flat"}
+        if faiss is not None:
+            wanted = _ann_params(emb.shape[0], emb.shape[1])
+            if os.path.isfile(faiss_path) and ann.get("type") == wanted["type"]:
+                try:
+                    index = faiss.read_index(faiss_path, faiss.IO_FLAG_MMAP)
+                except Exception:
+                    index = faiss.read_index(faiss_path)
+                ann = dict(ann, **{k: wanted[k] for k in ("ef_search", "nprobe") if k in wanted})
+                _apply_ann_search_params(index, ann)
+            else:
+                # tipo de índice mudou na configuração: os embeddings continuam valendo
+                index, ann = build_ann_index(emb, wanted, scale=emb_scale)
+                _update_snapshot_ann(snap_dir, meta, index, ann)
+            use_faiss = True
+
+        lex = _load_lexical_index(snap_dir)
+        if lex is None:
+            lex = build_lexical_index(blocks)
+        elif "minhash" not in lex or (USE_BM25 and "bm25_indptr" not in lex):
+            fields = _block_field_token_ids(blocks, lex["vocab"])
+            if "minhash" not in lex:
+                lex["minhash"] = build_minhash_signatures(fields["texto"], lex["vocab"])
+            if USE_BM25 and "bm25_indptr" not in lex:
+                doc_tokens = [p + t for p, t in zip(fields["pagina"], fields["texto"])]
+                lex.update(build_bm25_index(doc_tokens, len(lex["vocab"])))
+
+        family_map = _load_family_map(snap_dir, blocks)
+
+        os.utime(meta_path)
+        print(f"[QD-BOT v8.3] Snapshot carregado: {len(blocks)} blocos em {time.perf_counter() - t0:.2f}s")
+        return {"blocks": blocks, "emb": emb, "index": index, "use_faiss": use_faiss, "lex": lex,
+                "family_map": family_map, "ann": ann if use_faiss else {"type": "numpy"},
+                "emb_scale": emb_scale}
+    except Exception as e:
+        print(f"[QD-BOT v8.3] Snapshot inválido em {snap_dir}: {e}")
+        return None
+
+def build_vector_index(signature: str, sources: Optional[dict] = None) -> dict:
+    """Monta o índice de uma versão do corpus (pré-computado, snapshot ou embeddings incrementais).
+
+    Não é cacheado aqui: o índice vivo fica no estado do corpus, que o publica por troca de
+    referência (ver get_vector_index e _refresh_sources).
+    """
+    t0 = time.perf_counter()
+    vecdb = _load_precomputed_index()
+    if vecdb is not None:
+        if vecdb.get("lex") is None:
+            vecdb["lex"] = build_lexical_index(vecdb["blocks"])
+        if vecdb.get("family_map") is None:
+            vecdb["family_map"] = build_family_map(vecdb["blocks"])
+        vecdb["version"] = f"precomp:{_snapshot_key(signature)}"
+    else:
+        vecdb = _load_index_snapshot(signature)
+        if vecdb is None:
+            with _startup_step("baixar e codificar documentos"):
+                grouped, emb, falhas = _embed_sources_incremental(sources or _list_sources_cached(FOLDER_ID))
+            with _startup_step("montar índice"):
+                vecdb = _vecdb_from_embeddings(grouped, emb)
+            if falhas:
+                # Índice parcial: serve as perguntas até a próxima tentativa, mas não vira snapshot
+                # desta versão (ver _sources_ttl / _refresh_sources).
+                print(f"[QD-BOT v8.3] Índice montado sem {len(falhas)} arquivo(s) que falharam no download: "
+                      f"{falhas[:5]} — sem snapshot; nova tentativa em {SOURCES_RETRY_TTL}s")
+                vecdb["falhas"] = falhas
+                _release_emb_copy(vecdb)
+            elif grouped:
+                _release_emb_copy(vecdb, _save_index_snapshot(signature, vecdb))
+        vecdb["version"] = _snapshot_key(signature)
+    vecdb["corpus_version"] = signature
+    vecdb["built_at"] = time.time()
+    vecdb["build_s"] = time.perf_counter() - t0
+    return vecdb
+
+def _vecdb_from_embeddings(grouped: list[dict], emb) -> dict:
+    if not grouped:
+        return {"blocks": [], "emb": None, "index": None, "use_faiss": False, "lex": None, "family_map": {},
+                "ann": {"type": "flat"}}
+
+    vocab: dict[str, int] = {}
+    fields = _block_field_token_ids(grouped, vocab)
+    minhash = build_minhash_signatures(fields["texto"], vocab)
+    if DEDUP_AT_BUILD:
+        keep = _duplicate_block_mask(grouped, minhash)
+        if not keep.all():
+            rows = np.flatnonzero(keep)
+            print(f"[QD-BOT v8.3] Deduplicação: {len(grouped) - len(rows)} bloco(s) repetido(s) entre cópias removido(s)")
+            grouped = [grouped[i] for i in rows]
+            emb = emb[rows]
+            fields = {f: [token_rows[i] for i in rows] for f, token_rows in fields.items()}
+            minhash = minhash[rows]
+
+    index, ann = build_ann_index(emb)
+    use_faiss = index is not None
+    emb, emb_scale = quantize_embeddings(emb, EMB_STORAGE_DTYPE)
+
+    return {
+        "blocks": grouped,
+        "emb": emb,
+        "index": index,
+        "use_faiss": use_faiss,
+        "lex": _lexical_index_from_fields(vocab, fields, minhash),
+        "family_map": build_family_map(grouped),
+        "ann": ann,
+        "emb_scale": emb_scale,
+    }
 
 def get_vector_index():
-    _blocks, signature = load_all_blocks_cached(FOLDER_ID)
-    return build_vector_index(signature)
+    if _LOCAL_CORPUS["vecdb"] is not None:
+        return _LOCAL_CORPUS["vecdb"]
+    with _startup_step("listar Drive"):
+        state = _corpus_state()
+    vecdb = state["vecdb"]
+    if vecdb is None:
+        # Primeira carga (ou após invalidar_fontes): uma única montagem, as demais perguntas esperam.
+        # O índice entra num novo estado publicado por troca de referência (ver _publicar_campos).
+        with _INDEX_BUILD_LOCK:
+            vecdb = _estado_vivo(FOLDER_ID, state)["vecdb"]
+            if vecdb is None:
+                with _startup_step("índice vetorial (1ª carga)"):
+                    vecdb = build_vector_index(state["version"], state["sources"])
+            _publicar_campos(FOLDER_ID, state, vecdb=vecdb)
+    return vecdb
+
+def _corpus_version() -> str:
+    if _LOCAL_CORPUS["vecdb"] is not None:
+        return _LOCAL_CORPUS["vecdb"]["version"]
+    return _corpus_state()["version"]
+
+# ========================= CORPUS LOCAL (offline) =========================
+def _local_file_to_blocks(path: str) -> list[dict]:
+    name = os.path.basename(path)
+    file_id = f"local:{name}"
+    ext = os.path.splitext(name)[1].lower()
+    with open(path, "rb") as f:
+        raw = f.read()
+
+    if ext == ".docx":
+        return _docx_to_blocks(raw, name, file_id)
 
-# ========================= BUSCA ANN =========================
-def ann_search(query_text: str, top_n: int, tipo_contratacao: Optional[str] = None):
-    vecdb = get_vector_index()
-    blocks = vecdb["blocks"]
-    if not blocks:
-        return []
+    try:
+        text = raw.decode("utf-8")
+    except UnicodeDecodeError:
+        text = raw.decode("cp1252", errors="ignore")
+
+    if ext in (".json", ".jsonl"):
+        return _json_records_to_blocks(_load_jsonish(text), fallback_name=name, file_id=file_id)
+
+    if ext == ".csv":
+        rows = list(csv.reader(io.StringIO(text)))
+        header = [_norm_key(h) for h in (rows[0] if rows else [])]
+        if "texto" in header:
+            recs = [dict(zip(header, r)) for r in rows[1:]]
+            return _json_records_to_blocks(recs, fallback_name=sanitize_doc_name(name), file_id=file_id)
+        # CSV "achatado" (uma linha de texto por registro): trata o arquivo como um documento.
+        text = "\n".join(" ".join(c.strip() for c in r if c.strip()) for r in rows)
 
-    sbert = get_sbert_model()
-    query_expanded = _expand_query_for_hr(query_text, tipo_contratacao=tipo_contratacao)
-    q = sbert.encode([query_expanded], convert_to_numpy=True, normalize_embeddings=True)[0]
+    return [
+        {"pagina": sanitize_doc_name(name), "texto": chunk, "file_id": file_id}
+        for chunk in _split_text_blocks(_normalize_spaces(text)) if chunk.strip()
+    ]
 
-    if vecdb["use_faiss"]:
-        D, I = vecdb["index"].search(q.reshape(1, -1).astype(np.float32), top_n)
-        idxs = I[0].tolist()
-        scores = D[0].tolist()
-    else:
-        emb = vecdb["emb"]
-        scores_all = emb @ q
-        idxs = np.argsort(-scores_all)[:top_n].tolist()
-        scores = [float(scores_all[i]) for i in idxs]
-
-    results = []
-    for i, s in zip(idxs, scores):
-        if i < 0:
+def carregar_blocos_locais(paths: list[str]) -> list[dict]:
+    arquivos = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _dirs, names in os.walk(path):
+                arquivos.extend(os.path.join(root, n) for n in names)
+        else:
+            arquivos.append(path)
+
+    exts = (".json", ".jsonl", ".docx", ".csv", ".txt")
+    blocks = []
+    for path in sorted(arquivos):
+        if not path.lower().endswith(exts):
             continue
-        block = blocks[i]
-        lex = _lexical_overlap(query_text, block.get("texto", ""))
-        pagina_lex = _lexical_overlap(query_text, block.get("pagina", ""))
-        b_tipo = _tipo_boost(block, tipo_contratacao) if tipo_contratacao else 0.0
-        b_domain = _domain_boost(query_text, block)
-        adj_score = float(s) + 0.20 * lex + 0.30 * pagina_lex + b_tipo + b_domain
-        results.append({"idx": i, "score": adj_score, "block": block})
+        try:
+            blocks.extend(_local_file_to_blocks(path))
+        except Exception as e:
+            print(f"[QD-BOT v8.3] Falha ao ler arquivo local {path}: {e}")
+    return blocks
+
+def usar_corpus_local(blocks: Optional[list[dict]]):
+    """Monta índice e catálogo a partir de blocos locais (None volta a usar o Drive)."""
+    if blocks is None:
+        _LOCAL_CORPUS.update({"vecdb": None, "catalog": None})
+        return None
+    grouped = agrupar_blocos(blocks, janela=GROUP_WINDOW)
+    emb = _encode_texts(get_sbert_model(), [_texto_para_embedding(b) for b in grouped]) if grouped else None
+    vecdb = _vecdb_from_embeddings(grouped, emb)
+    _release_emb_copy(vecdb)
+    digest = hashlib.sha1()
+    for b in grouped:
+        digest.update(f"{b.get('pagina', '')}\x00{b.get('texto', '')}\x00".encode("utf-8"))
+    vecdb["version"] = f"local:{digest.hexdigest()}"
+    vecdb["built_at"] = time.time()
+
+    docs = {}
+    for b in grouped:
+        docs.setdefault(_base_document_name(b.get("pagina", "")), b.get("file_id"))
+    catalog = _catalog_from_files([{"name": n, "id": fid} for n, fid in docs.items()])
+
+    _LOCAL_CORPUS.update({"vecdb": vecdb, "catalog": catalog})
+    return vecdb
+
+# ========================= BUSCA ANN =========================
+def _encode_queries(query_texts: list[str], tipos: list[Optional[str]]):
+    sbert = get_sbert_model()
+    expanded = [_expand_query_for_hr(q, tipo_contratacao=t) for q, t in zip(query_texts, tipos)]
+    with _span("encode"):
+        return sbert.encode(
+            expanded,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+            batch_size=64,
+        )
+
+def _encode_query(query_text: str, tipo_contratacao: Optional[str] = None):
+    return _encode_queries([query_text], [tipo_contratacao])[0]
+
+def _dense_search(vecdb: dict, q_mat, top_n: int) -> list[list[tuple[int, float]]]:
+    q_mat = np.atleast_2d(np.asarray(q_mat, dtype=np.float32))
+    with _span("search"):
+        if vecdb["use_faiss"]:
+            D, I = vecdb["index"].search(q_mat, top_n)
+            approx = (vecdb.get("ann") or {}).get("type", "flat") != "flat"
+            out = []
+            for r in range(q_mat.shape[0]):
+                ids = [int(i) for i in I[r] if i >= 0]
+                if approx and ANN_REFINE and ids:
+                    # PQ/HNSW devolvem só a ordem aproximada; o escore segue sendo o cosseno exato
+                    sims = _emb_rows(vecdb, ids) @ q_mat[r]
+                    order = np.argsort(-sims)
+                    out.append([(ids[j], float(sims[j])) for j in order])
+                else:
+                    out.append([(i, float(s)) for i, s in zip(I[r], D[r]) if i >= 0])
+            return out
+
+        # busca direto na matriz armazenada (float32, float16 ou int8), sem cópia float32
+        idx, scores = numpy_topk(vecdb["emb"], q_mat, top_n, scale=vecdb.get("emb_scale"))
+        return [
+            list(zip(idx[r].tolist(), scores[r].tolist()))
+            for r in range(q_mat.shape[0])
+        ]
+
+def _score_candidates(vecdb: dict, query_text: str, q, hits: list[tuple[int, float]],
+                      top_n: int, tipo_contratacao: Optional[str] = None) -> list[dict]:
+    blocks = vecdb["blocks"]
+    bm25_by_idx: dict[int, float] = {}
+    if USE_BM25 and vecdb["lex"].get("bm25_indptr") is not None:
+        with _span("bm25"):
+            sparse = bm25_search(vecdb["lex"], query_text, BM25_TOP_N)
+            if sparse:
+                bm25_by_idx = dict(sparse)
+                dense_by_idx = dict(hits)
+                fused = _fuse_rrf(hits, sparse, top_n)
+                # Candidatos só do lado esparso precisam do cosseno para entrar na mesma escala.
+                missing = [i for i in fused if i not in dense_by_idx]
+                if missing:
+                    sims = _emb_rows(vecdb, missing) @ np.asarray(q, dtype=np.float32)
+                    dense_by_idx.update(zip(missing, sims.tolist()))
+                hits = [(i, dense_by_idx[i]) for i in fused]
+    bm25_max = max(bm25_by_idx.values(), default=0.0)
+
+    with _span("lexical"):
+        lex_texto, lex_pagina = lexical_overlap_batch(vecdb["lex"], query_text, [i for i, _s in hits])
+
+        results = []
+        for pos, (i, s) in enumerate(hits):
+            block = blocks[i]
+            lex = float(lex_texto[pos])
+            pagina_lex = float(lex_pagina[pos])
+            bm25 = bm25_by_idx.get(i, 0.0) / bm25_max if bm25_max > 0 else 0.0
+            b_tipo = _tipo_boost(block, tipo_contratacao) if tipo_contratacao else 0.0
+            b_domain = _domain_boost(query_text, block)
+            adj_score = float(s) + 0.20 * lex + 0.30 * pagina_lex + BM25_WEIGHT * bm25 + b_tipo + b_domain
+            results.append({"idx": i, "score": adj_score, "block": block, "bm25": bm25})
 
     results.sort(key=lambda x: x["score"], reverse=True)
-    results = _deduplicate_results(results)
+    with _span("dedup"):
+        results = _deduplicate_results(results, lex=vecdb["lex"])
     results = [r for r in results if r["score"] >= MIN_SCORE_THRESHOLD]
 
     if len(results) >= 2:
@@ -984,6 +2759,29 @@ def ann_search(query_text: str, top_n: int, tipo_contratacao: Optional[str] = No
 
     return results[:top_n]
 
+def ann_search(query_text: str, top_n: int, tipo_contratacao: Optional[str] = None, q_emb=None):
+    vecdb = get_vector_index()
+    if not vecdb["blocks"]:
+        return []
+
+    q = q_emb if q_emb is not None else _encode_query(query_text, tipo_contratacao)
+    hits = _dense_search(vecdb, q, top_n)[0]
+    return _score_candidates(vecdb, query_text, q, hits, top_n, tipo_contratacao)
+
+def ann_search_batch(query_texts: list[str], top_n: int, tipos: list[Optional[str]], q_mat=None) -> list[list[dict]]:
+    vecdb = get_vector_index()
+    if not vecdb["blocks"] or not query_texts:
+        return [[] for _ in query_texts]
+
+    if q_mat is None:
+        q_mat = _encode_queries(query_texts, tipos)
+    hits_all = _dense_search(vecdb, q_mat, top_n)
+    return [
+        _score_candidates(vecdb, qt, q, hits, top_n, tipo)
+        for qt, q, hits, tipo in zip(query_texts, q_mat, hits_all, tipos)
+    ]
+
+
 # ========================= SELEÇÃO MULTIDOCUMENTO =========================
 def _group_candidates_by_doc(candidates: list[dict]) -> dict[str, list[dict]]:
     grouped: dict[str, list[dict]] = {}
@@ -1017,20 +2815,16 @@ def _select_family_summary_blocks(query: str, families: list[str], max_docs_tota
     if not blocks:
         return []
 
-    target = {_norm_key(f) for f in families}
-    by_doc: dict[str, list[dict]] = {}
-
-    for block in blocks:
-        doc_name = _base_document_name(block.get("pagina", "?"))
-        family = _extract_document_family(doc_name)
-        if _norm_key(family) in target:
-            by_doc.setdefault(doc_name, []).append(block)
+    fam_map = vecdb["family_map"]
+    by_doc: dict[str, list[int]] = {}
+    for fam_norm in {_norm_key(f) for f in families}:
+        by_doc.update(fam_map.get(fam_norm, {}))
 
     selected = []
     doc_names = sorted(by_doc.keys())[:max_docs_total]
     for doc_name in doc_names:
-        for block in by_doc[doc_name][:blocks_per_doc]:
-            selected.append(block)
+        for pos in by_doc[doc_name][:blocks_per_doc]:
+            selected.append(blocks[pos])
     return selected
 
 def _select_compare_blocks(query: str, families: list[str], max_docs_per_family: int = 3, blocks_per_doc: int = 2) -> list[dict]:
@@ -1039,37 +2833,20 @@ def _select_compare_blocks(query: str, families: list[str], max_docs_per_family:
     if not blocks:
         return []
 
+    fam_map = vecdb["family_map"]
     selected = []
     for fam in families[:2]:
-        fam_norm = _norm_key(fam)
-        by_doc: dict[str, list[dict]] = {}
-        for block in blocks:
-            doc_name = _base_document_name(block.get("pagina", "?"))
-            family = _extract_document_family(doc_name)
-            if _norm_key(family) == fam_norm:
-                by_doc.setdefault(doc_name, []).append(block)
-
+        by_doc = fam_map.get(_norm_key(fam), {})
         doc_names = sorted(by_doc.keys())[:max_docs_per_family]
         for doc_name in doc_names:
-            for block in by_doc[doc_name][:blocks_per_doc]:
-                selected.append(block)
+            for pos in by_doc[doc_name][:blocks_per_doc]:
+                selected.append(blocks[pos])
 
     return selected
 
 # ========================= RERANKING COM CROSS-ENCODER =========================
-def _rerank_with_ce(query: str, candidates: list, top_k: int) -> list:
-    ce = get_cross_encoder()
-    if ce is None or not candidates:
-        return candidates[:top_k]
-
-    pairs = [(query, r["block"].get("texto", "")[:512]) for r in candidates]
-
-    try:
-        ce_scores = ce.predict(pairs, show_progress_bar=False)
-    except Exception as e:
-        print(f"[QD-BOT v8.3] CE predict falhou: {e}")
-        return candidates[:top_k]
 
+def _apply_ce_scores(candidates: list, ce_scores, top_k: int) -> list:
     ce_min = float(min(ce_scores))
     ce_max = float(max(ce_scores))
     ce_range = ce_max - ce_min if ce_max > ce_min else 1.0
@@ -1082,6 +2859,105 @@ def _rerank_with_ce(query: str, candidates: list, top_k: int) -> list:
     candidates.sort(key=lambda x: x["score_combined"], reverse=True)
     return candidates[:top_k]
 
+# Escores do CE por par (pergunta normalizada, texto do bloco); valem enquanto índice e modelo não mudam.
+_CE_SCORE_CACHE = OrderedDict()
+_CE_SCORE_CACHE_LOCK = threading.Lock()
+_CE_SCORE_CACHE_STATE = {"version": None, "hits": 0, "misses": 0}
+_CE_SCORE_ENTRY_BYTES = 240  # tupla com 2 ints + float + nó do OrderedDict (aproximado)
+
+def _ce_hash(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+def _ce_score_cache_get(keys: list[tuple], version: tuple) -> list[Optional[float]]:
+    with _CE_SCORE_CACHE_LOCK:
+        if _CE_SCORE_CACHE_STATE["version"] != version:
+            _CE_SCORE_CACHE.clear()
+            _CE_SCORE_CACHE_STATE["version"] = version
+        out = []
+        for k in keys:
+            v = _CE_SCORE_CACHE.get(k)
+            if v is not None:
+                _CE_SCORE_CACHE.move_to_end(k)
+            out.append(v)
+        hits = sum(v is not None for v in out)
+        _CE_SCORE_CACHE_STATE["hits"] += hits
+        _CE_SCORE_CACHE_STATE["misses"] += len(out) - hits
+        return out
+
+def _ce_score_cache_put(keys: list[tuple], scores, version: tuple):
+    max_entries = max(1, int(CE_SCORE_CACHE_MAX_MB * 1024 * 1024 / _CE_SCORE_ENTRY_BYTES))
+    with _CE_SCORE_CACHE_LOCK:
+        if _CE_SCORE_CACHE_STATE["version"] != version:
+            return
+        for k, v in zip(keys, scores):
+            _CE_SCORE_CACHE[k] = float(v)
+            _CE_SCORE_CACHE.move_to_end(k)
+        while len(_CE_SCORE_CACHE) > max_entries:
+            _CE_SCORE_CACHE.popitem(last=False)
+
+def ce_score_cache_stats() -> dict:
+    with _CE_SCORE_CACHE_LOCK:
+        n = len(_CE_SCORE_CACHE)
+        return {
+            "entries": n,
+            "bytes": n * _CE_SCORE_ENTRY_BYTES,
+            "hits": _CE_SCORE_CACHE_STATE["hits"],
+            "misses": _CE_SCORE_CACHE_STATE["misses"],
+        }
+
+def _rerank_with_ce(query: str, candidates: list, top_k: int) -> list:
+    return _rerank_with_ce_batch([query], [candidates], top_k)[0]
+
+def _rerank_with_ce_batch(queries: list[str], candidates_list: list[list], top_k: int) -> list[list]:
+    # Um único ce.predict para os pares de todas as perguntas; a normalização continua por pergunta.
+    ce = get_cross_encoder()
+    if ce is None:
+        return [c[:top_k] for c in candidates_list]
+
+    pairs = []
+    keys = []
+    for query, candidates in zip(queries, candidates_list):
+        q_hash = _ce_hash(_norm_key(query))
+        for r in candidates:
+            text = r["block"].get("texto", "")[:512]
+            pairs.append((query, text))
+            keys.append((q_hash, _ce_hash(text)))
+    if not pairs:
+        return [c[:top_k] for c in candidates_list]
+
+    ce_scores = np.zeros(len(pairs), dtype=np.float32)
+    missing = list(range(len(pairs)))
+    if USE_CE_SCORE_CACHE:
+        version = (get_vector_index().get("version"), CE_MODEL_NAME, _model_backend_tag(ce))
+        cached = _ce_score_cache_get(keys, version)
+        missing = [i for i, v in enumerate(cached) if v is None]
+        for i, v in enumerate(cached):
+            if v is not None:
+                ce_scores[i] = v
+        _trace_meta("ce_cache_hits", len(pairs) - len(missing))
+
+    if missing:
+        try:
+            with _span("rerank"):
+                preds = ce.predict([pairs[i] for i in missing], show_progress_bar=False, batch_size=CE_BATCH_SIZE)
+        except Exception as e:
+            print(f"[QD-BOT v8.3] CE predict falhou: {e}")
+            return [c[:top_k] for c in candidates_list]
+        ce_scores[missing] = preds
+        if USE_CE_SCORE_CACHE:
+            _ce_score_cache_put([keys[i] for i in missing], preds, version)
+
+    out = []
+    offset = 0
+    for candidates in candidates_list:
+        n = len(candidates)
+        if n:
+            out.append(_apply_ce_scores(candidates, ce_scores[offset:offset + n], top_k))
+        else:
+            out.append(candidates)
+        offset += n
+    return out
+
 # ========================= LINKS =========================
 def _escolher_documentos_para_link(pergunta: str, resposta: str, blocos: list[dict], max_docs: int = 5):
     if not blocos:
@@ -1192,24 +3068,109 @@ def _append_to_history(role: str, content: str):
     _state_set("chat_history", history)
 
 # ========================= AUDITORIA =========================
+def _fmt_bytes(n: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.1f} {unit}" if unit != "B" else f"{int(n)} B"
+        n /= 1024.0
+
+def memoria_por_estrutura(vecdb: Optional[dict] = None) -> list[tuple[str, int, str]]:
+    """(estrutura, bytes, observação) das principais estruturas mantidas em memória."""
+    vecdb = vecdb if vecdb is not None else get_vector_index()
+    itens = []
+
+    emb = vecdb.get("emb")
+    index = vecdb.get("index")
+    if emb is not None:
+        if isinstance(emb, np.memmap):
+            origem = "mmap do snapshot (page cache, fora do heap)"
+        elif index is not None:
+            origem = "RAM (cópia além do índice, p/ refino exato)"
+        else:
+            origem = "RAM"
+        itens.append((f"embeddings {emb.dtype} {tuple(emb.shape)}", int(emb.nbytes), origem))
+    elif index is not None:
+        itens.append(("embeddings", 0, "sem cópia: linhas reconstruídas do índice"))
+    if vecdb.get("emb_scale") is not None:
+        itens.append(("escala int8 por dimensão", int(vecdb["emb_scale"].nbytes), "RAM"))
+    if index is not None:
+        ann = vecdb.get("ann") or {}
+        tipo = ann.get("type", "flat") + (f"/{ann['sq']}" if ann.get("sq") else "")
+        itens.append((f"índice FAISS ({tipo}, {int(index.ntotal)} vetores)", _faiss_index_bytes(index),
+                      "RAM (códigos + grafo/listas; estimado)"))
+
+    lex = vecdb.get("lex") or {}
+    for prefixo, nome in (("texto_", "conjuntos de tokens (texto)"), ("pagina_", "conjuntos de tokens (página)"),
+                          ("bm25_", "postings BM25"), ("minhash", "assinaturas MinHash")):
+        total = sum(int(v.nbytes) for k, v in lex.items() if k.startswith(prefixo) and isinstance(v, np.ndarray))
+        if total:
+            itens.append((nome, total, "RAM"))
+    if lex.get("vocab"):
+        # dict[str, int]: ~50 B de overhead do str + ~100 B por entrada no dict/int
+        itens.append((f"vocabulário ({len(lex['vocab'])} termos)",
+                      sum(len(t) + 150 for t in lex["vocab"]), "estimado"))
+
+    blocks = vecdb.get("blocks") or []
+    if blocks:
+        texto = sum(len(b.get("texto", "")) + len(b.get("pagina", "")) for b in blocks)
+        itens.append((f"blocos ({len(blocks)})", texto + 400 * len(blocks), "estimado"))
+
+    with _ANSWER_CACHE_LOCK:
+        cache = sum(int(e["emb"].nbytes) + len(e["resposta"]) + len(e["pergunta"]) for e in _ANSWER_CACHE.values())
+        n_cache = len(_ANSWER_CACHE)
+    itens.append((f"cache de respostas ({n_cache})", cache, "estimado"))
+    return itens
+
+def relatorio_memoria(vecdb: Optional[dict] = None) -> str:
+    itens = memoria_por_estrutura(vecdb)
+    linhas = [f"=== Memória por estrutura (EMB_STORAGE_DTYPE={EMB_STORAGE_DTYPE}) ==="]
+    for nome, n, obs in itens:
+        linhas.append(f"{nome:<48} {_fmt_bytes(n):>10}  {obs}")
+    linhas.append(f"{'total':<48} {_fmt_bytes(sum(n for _nome, n, _obs in itens)):>10}")
+    return "\n".join(linhas)
+
 def auditar_base_conhecimento():
     try:
         src = _list_sources_cached(FOLDER_ID)
         files_json = src.get("json", []) if USE_JSONL else []
         files_docx = src.get("docx", []) or []
 
-        signature = _build_signature_sources(files_json, files_docx)
+        signature = _current_signature(FOLDER_ID)
         blocks_raw = _download_and_parse_blocks(signature, FOLDER_ID)
         grouped = agrupar_blocos(blocks_raw, janela=GROUP_WINDOW)
         catalog = _build_document_catalog(FOLDER_ID)
+        vecdb = get_vector_index()
 
         linhas = []
         linhas.append("=== Auditoria da base de conhecimento ===")
         linhas.append(f"FOLDER_ID: {FOLDER_ID}")
         linhas.append(f"CACHE_BUSTER: {CACHE_BUSTER}")
+        linhas.append(f"ÍNDICE ATIVO: {vecdb.get('version')} ({len(vecdb.get('blocks') or [])} blocos)")
+        if vecdb.get("built_at"):
+            montado = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(vecdb["built_at"]))
+            linhas.append(f"  montado em {montado} ({vecdb.get('build_s', 0.0):.1f}s), "
+                          f"corpus {str(vecdb.get('corpus_version', signature))[:12]}")
+        if vecdb.get("falhas"):
+            linhas.append(f"  INCOMPLETO: {len(vecdb['falhas'])} arquivo(s) falharam no download "
+                          f"({', '.join(vecdb['falhas'][:5])}); nova tentativa a cada {SOURCES_RETRY_TTL}s")
+        if FOLDER_ID in _SOURCES_REFRESHING:
+            linhas.append("  atualização da listagem em andamento (a versão acima segue servindo)")
+        if USE_FILE_CACHE:
+            fc = file_cache_stats()
+            linhas.append(
+                f"CACHE DE ARQUIVOS: {fc['entries']} entrada(s), {_fmt_bytes(fc['bytes'])} de {FILE_CACHE_MAX_MB} MB "
+                f"| blocos reaproveitados {fc['hits']}/{fc['hits'] + fc['misses']} | downloads {fc['downloads']} "
+                f"| evictados {fc['evicted']} | corrompidos {fc['corrupted']}"
+            )
         linhas.append(f"EMBED_MODEL: {EMBED_MODEL_NAME}")
+        ce_model = get_cross_encoder()
+        linhas.append(
+            f"INFERENCE_BACKEND: {INFERENCE_BACKEND} | embedding: {_model_backend_tag(get_sbert_model())} "
+            f"| cross-encoder: {_model_backend_tag(ce_model) if ce_model is not None else 'desligado'}"
+        )
         linhas.append(f"CE_MODEL: {CE_MODEL_NAME}")
         linhas.append(f"USE_CE: {USE_CE}")
+        linhas.append(f"ANN_INDEX: {ANN_INDEX_TYPE} (exato abaixo de {ANN_MIN_BLOCKS} blocos)")
         linhas.append(f"TOP_N_ANN: {TOP_N_ANN} | TOP_K: {TOP_K} | DEDUP: {DEDUP_MAX_OVERLAP}")
         linhas.append(f"MIN_SCORE: {MIN_SCORE_THRESHOLD} | REL_CUTOFF: {RELATIVE_SCORE_CUTOFF}")
         linhas.append("")
@@ -1243,158 +3204,620 @@ def auditar_base_conhecimento():
         for fam in catalog["family_list"]:
             linhas.append(f"- {fam} ({len(catalog['families'].get(fam, []))} docs)")
 
+        linhas.append("")
+        linhas.append(relatorio_memoria(vecdb))
+
         return "\n".join(linhas)
 
     except Exception as e:
         return f"Erro ao auditar base: {e}"
 
-# ========================= ORQUESTRAÇÃO DE CONTEXTO =========================
-def _prepare_context_for_query(pergunta: str, tipo_contratacao: Optional[str]):
-    families = _resolve_requested_families(pergunta, max_matches=2)
-    query_mode = _detect_query_mode(pergunta, families=families)
+# ========================= CACHE SEMÂNTICO DE RESPOSTAS =========================
+# Compartilhado entre sessões do processo; escopo = (modo, tipo de contratação, famílias, assinatura da base).
+# Perguntas com histórico de conversa ficam fora (ver _preparar_consulta).
+_ANSWER_CACHE = OrderedDict()
+_ANSWER_CACHE_LOCK = threading.Lock()
+_ANSWER_CACHE_STATE = {"signature": None, "next_id": 0}
+
+def _answer_cache_scope(query_mode: str, tipo_contratacao: Optional[str], families: list[str],
+                        signature: str) -> tuple:
+    # As famílias entram no escopo: "documentos da COSANPA" e "... da SEINFRA" ficam acima do limiar.
+    return (query_mode, tipo_contratacao or "", tuple(sorted(families or [])), signature, CACHE_BUSTER)
+
+def _answer_cache_sync_signature(signature: str):
+    # Chamado com o lock adquirido: base mudou -> nenhuma resposta antiga é válida.
+    if _ANSWER_CACHE_STATE["signature"] != signature:
+        _ANSWER_CACHE.clear()
+        _ANSWER_CACHE_STATE["signature"] = signature
+
+def _answer_cache_lookup(q_emb, scope: tuple, signature: str) -> Optional[dict]:
+    if not USE_ANSWER_CACHE or q_emb is None:
+        return None
+    now = time.time()
+    with _ANSWER_CACHE_LOCK:
+        _answer_cache_sync_signature(signature)
+        expired = [k for k, e in _ANSWER_CACHE.items() if now - e["ts"] > ANSWER_CACHE_TTL]
+        for k in expired:
+            del _ANSWER_CACHE[k]
+
+        keys = [k for k, e in _ANSWER_CACHE.items() if e["scope"] == scope]
+        if not keys:
+            return None
+        mat = np.stack([_ANSWER_CACHE[k]["emb"] for k in keys])
+        sims = mat @ np.asarray(q_emb, dtype=np.float32)
+        best = int(np.argmax(sims))
+        if float(sims[best]) < ANSWER_CACHE_THRESHOLD:
+            return None
+        key = keys[best]
+        _ANSWER_CACHE.move_to_end(key)
+        return dict(_ANSWER_CACHE[key], similarity=float(sims[best]))
+
+def _answer_cache_store(q_emb, scope: tuple, signature: str, pergunta: str, resposta: str):
+    if not USE_ANSWER_CACHE or q_emb is None:
+        return
+    with _ANSWER_CACHE_LOCK:
+        _answer_cache_sync_signature(signature)
+        key = _ANSWER_CACHE_STATE["next_id"]
+        _ANSWER_CACHE_STATE["next_id"] += 1
+        _ANSWER_CACHE[key] = {
+            "scope": scope,
+            "emb": np.asarray(q_emb, dtype=np.float32),
+            "pergunta": pergunta,
+            "resposta": resposta,
+            "ts": time.time(),
+        }
+        while len(_ANSWER_CACHE) > ANSWER_CACHE_MAX_ENTRIES:
+            _ANSWER_CACHE.popitem(last=False)
 
+# ========================= ORQUESTRAÇÃO DE CONTEXTO =========================
+def _select_mode_blocks(pergunta: str, families: list[str], query_mode: str) -> Optional[list[dict]]:
+    # Resumo/comparação por família dispensam a busca ANN; None = seguir pelo caminho ANN + CE.
     if query_mode == QUERY_MODE_FAMILY_SUMMARY and families:
-        blocos_relevantes = _select_family_summary_blocks(pergunta, families, max_docs_total=8, blocks_per_doc=2)
-        reranked = [{"block": b, "score": 0.0, "score_combined": 0.0, "ce_score": 0.0} for b in blocos_relevantes]
-        return query_mode, families, reranked, blocos_relevantes
-
+        return _select_family_summary_blocks(pergunta, families, max_docs_total=8, blocks_per_doc=2)
     if query_mode == QUERY_MODE_COMPARE and families:
-        blocos_relevantes = _select_compare_blocks(pergunta, families, max_docs_per_family=3, blocks_per_doc=2)
-        reranked = [{"block": b, "score": 0.0, "score_combined": 0.0, "ce_score": 0.0} for b in blocos_relevantes]
-        return query_mode, families, reranked, blocos_relevantes
+        return _select_compare_blocks(pergunta, families, max_docs_per_family=3, blocks_per_doc=2)
+    return None
+
+def _context_from_blocks(blocos_relevantes: list[dict]):
+    reranked = [{"block": b, "score": 0.0, "score_combined": 0.0, "ce_score": 0.0} for b in blocos_relevantes]
+    return reranked, blocos_relevantes
 
-    candidates = ann_search(pergunta, top_n=TOP_N_ANN, tipo_contratacao=tipo_contratacao)
+def _context_from_reranked(query_mode: str, reranked: list[dict]):
+    if query_mode in {QUERY_MODE_FAMILY_SUMMARY, QUERY_MODE_COMPARE}:
+        reranked = _select_diverse_candidates(reranked, max_docs=5, max_blocks_per_doc=2)
+    return reranked, [r["block"] for r in reranked]
+
+def _prepare_context_for_query(pergunta: str, tipo_contratacao: Optional[str],
+                               families: Optional[list[str]] = None,
+                               query_mode: Optional[str] = None,
+                               q_emb=None):
+    if families is None:
+        families = _resolve_requested_families(pergunta, max_matches=2)
+    if query_mode is None:
+        query_mode = _detect_query_mode(pergunta, families=families)
+
+    blocos_modo = _select_mode_blocks(pergunta, families, query_mode)
+    if blocos_modo is not None:
+        return (query_mode, families, *_context_from_blocks(blocos_modo))
+
+    candidates = ann_search(pergunta, top_n=TOP_N_ANN, tipo_contratacao=tipo_contratacao, q_emb=q_emb)
     if not candidates:
         return query_mode, families, [], []
 
     reranked = _rerank_with_ce(pergunta, candidates, TOP_K)
+    return (query_mode, families, *_context_from_reranked(query_mode, reranked))
+
+def _prepare_contexts_batch(perguntas: list[str], tipos: list[Optional[str]],
+                            families_list: list[list[str]], modes: list[str], q_mat) -> list[tuple]:
+    out: list[Optional[tuple]] = [None] * len(perguntas)
+    ann_pos = []
+    for i, (pergunta, families, mode) in enumerate(zip(perguntas, families_list, modes)):
+        blocos_modo = _select_mode_blocks(pergunta, families, mode)
+        if blocos_modo is not None:
+            out[i] = _context_from_blocks(blocos_modo)
+        else:
+            ann_pos.append(i)
+
+    if ann_pos:
+        cand_lists = ann_search_batch(
+            [perguntas[i] for i in ann_pos],
+            TOP_N_ANN,
+            [tipos[i] for i in ann_pos],
+            q_mat=q_mat[ann_pos],
+        )
+        com_cand = [(i, c) for i, c in zip(ann_pos, cand_lists) if c]
+        for i, c in zip(ann_pos, cand_lists):
+            if not c:
+                out[i] = ([], [])
+        reranked_lists = _rerank_with_ce_batch([perguntas[i] for i, _c in com_cand], [c for _i, c in com_cand], TOP_K)
+        for (i, _c), reranked in zip(com_cand, reranked_lists):
+            out[i] = _context_from_reranked(modes[i], reranked)
 
-    if query_mode in {QUERY_MODE_FAMILY_SUMMARY, QUERY_MODE_COMPARE}:
-        reranked = _select_diverse_candidates(reranked, max_docs=5, max_blocks_per_doc=2)
-
-    blocos_relevantes = [r["block"] for r in reranked]
-    return query_mode, families, reranked, blocos_relevantes
+    return out
 
 # ========================= PRINCIPAL =========================
-def responder_pergunta(pergunta, top_k: int = TOP_K, api_key: str = API_KEY,
-                       model_id: str = MODEL_ID, history: list[dict] = None):
+
+@_fixar_corpus()
+def _preparar_consulta(pergunta, model_id: str, history: Optional[list[dict]]):
+    """Retorna (ctx, resposta_imediata); ctx é None quando a resposta já está pronta."""
     t0 = time.perf_counter()
-    try:
-        pergunta = (pergunta or "").strip().replace("\n", " ").replace("\r", " ")
-        if not pergunta:
-            return "Pergunta vazia."
+    pergunta = (pergunta or "").strip().replace("\n", " ").replace("\r", " ")
+    if not pergunta:
+        return None, "Pergunta vazia."
 
-        comando = pergunta.lower().strip()
-        if comando in ["/auditar", "/debug_base", "/base", "auditar base", "debug base"]:
-            return auditar_base_conhecimento()
+    comando = pergunta.lower().strip()
+    if comando in ["/auditar", "/debug_base", "/base", "auditar base", "debug base"]:
+        return None, auditar_base_conhecimento()
 
-        tipo_contratacao: Optional[str] = _parse_tipo_contratacao(pergunta)
+    if _WARMUP_STATE["thread"] is not None and not _WARMUP_DONE.is_set():
+        # Pergunta chegou durante o aquecimento: espera a carga compartilhada em vez de disparar outra.
+        with _span("warmup"):
+            aguardar_aquecimento(WARMUP_WAIT_TIMEOUT)
 
-        _state_set("awaiting_rh_tipo", False)
-        _state_pop("pending_rh_question", None)
+    tipo_contratacao: Optional[str] = _parse_tipo_contratacao(pergunta)
 
-        query_mode, families, reranked, blocos_relevantes = _prepare_context_for_query(pergunta, tipo_contratacao)
+    _state_set("awaiting_rh_tipo", False)
+    _state_pop("pending_rh_question", None)
 
-        if not blocos_relevantes:
-            print(f"[QD-BOT v8.3] Nenhum candidato passou os filtros para: '{pergunta[:60]}'")
-            resp = gerar_resposta_fallback_interativa(pergunta, api_key, model_id)
+    families = _resolve_requested_families(pergunta, max_matches=2)
+    query_mode = _detect_query_mode(pergunta, families=families)
+
+    conv_history = history if history is not None else _get_conversation_history()
+    # O cache é compartilhado entre sessões e a resposta depende do histórico enviado ao LLM:
+    # só perguntas sem histórico (autocontidas) consultam ou alimentam o cache.
+    usar_cache = USE_ANSWER_CACHE and not conv_history
+
+    q_emb = None
+    cache_scope = None
+    signature = ""
+    if usar_cache or query_mode == QUERY_MODE_SINGLE:
+        q_emb = _encode_query(pergunta, tipo_contratacao)
+    if usar_cache:
+        signature = _corpus_version()
+        cache_scope = _answer_cache_scope(query_mode, tipo_contratacao, families, signature)
+        with _span("cache"):
+            hit = _answer_cache_lookup(q_emb, cache_scope, signature)
+        _trace_meta("cache_hit", hit is not None)
+        if hit is not None:
+            print(
+                f"[QD-BOT v8.3] Cache de respostas: '{pergunta[:60]}' ~ '{hit['pergunta'][:60]}' "
+                f"(sim={hit['similarity']:.3f})"
+            )
             _append_to_history("user", pergunta)
-            _append_to_history("assistant", resp)
-            return resp
+            _append_to_history("assistant", hit["resposta"])
+            return None, hit["resposta"]
 
-        t_context = time.perf_counter()
+    query_mode, families, reranked, blocos_relevantes = _prepare_context_for_query(
+        pergunta, tipo_contratacao, families=families, query_mode=query_mode, q_emb=q_emb
+    )
+    _trace_meta("mode", query_mode)
+    _trace_meta("n_blocos", len(blocos_relevantes))
 
-        prompt = montar_prompt_rag(
-            pergunta,
-            blocos_relevantes,
-            tipo_contratacao=tipo_contratacao,
-            query_mode=query_mode,
-            target_families=families,
-        )
+    if not blocos_relevantes:
+        return {"pergunta": pergunta, "t0": t0, "sem_contexto": True}, None
 
-        messages = [{"role": "system", "content": SYSTEM_PROMPT_RAG}]
+    ctx = _montar_ctx(
+        pergunta, tipo_contratacao, query_mode, families, reranked, blocos_relevantes,
+        conv_history, model_id, t0,
+    )
+    ctx.update({"q_emb": q_emb, "cache_scope": cache_scope, "signature": signature})
+    return ctx, None
+
+@_span("prompt")
+def _montar_ctx(pergunta: str, tipo_contratacao: Optional[str], query_mode: str, families: list[str],
+                reranked: list[dict], blocos_relevantes: list[dict], conv_history: list[dict],
+                model_id: str, t0: float) -> dict:
+    t_context = time.perf_counter()
+
+    prompt = montar_prompt_rag(
+        pergunta,
+        blocos_relevantes,
+        tipo_contratacao=tipo_contratacao,
+        query_mode=query_mode,
+        target_families=families,
+    )
 
-        conv_history = history if history is not None else _get_conversation_history()
-        if conv_history:
-            for msg in conv_history:
-                content = msg.get("content", "")
-                if len(content) > 500:
-                    content = content[:500] + "..."
-                messages.append({"role": msg["role"], "content": content})
+    messages = [{"role": "system", "content": SYSTEM_PROMPT_RAG}]
 
-        messages.append({"role": "user", "content": prompt})
+    if conv_history:
+        for msg in conv_history:
+            content = msg.get("content", "")
+            if len(content) > 500:
+                content = content[:500] + "..."
+            messages.append({"role": msg["role"], "content": content})
 
-        payload = {
-            "model": model_id,
-            "messages": messages,
-            "max_tokens": MAX_TOKENS,
-            "temperature": TEMPERATURE,
-            "n": 1,
-            "stream": False,
-        }
+    messages.append({"role": "user", "content": prompt})
 
-        try:
-            resp = session.post(
-                "https://api.openai.com/v1/chat/completions",
-                json=payload,
-                timeout=REQUEST_TIMEOUT,
-            )
-            resp.raise_for_status()
-            data = resp.json()
-            resposta_final = (
-                data.get("choices", [{}])[0]
-                .get("message", {})
-                .get("content", "")
-            )
-        except requests.exceptions.RequestException as e:
-            return f"Erro de conexao com a API: {e}"
-        except (ValueError, KeyError, IndexError):
-            return "Nao consegui interpretar a resposta da API."
-
-        if not resposta_final or not resposta_final.strip():
-            return "A resposta da API veio vazia ou incompleta."
-
-        resposta = resposta_final.strip()
-
-        if blocos_relevantes and not _is_off_domain_reply(resposta):
-            docs_para_link = _escolher_documentos_para_link(pergunta, resposta, blocos_relevantes, max_docs=5)
-            if docs_para_link:
-                if len(docs_para_link) == 1:
-                    doc = docs_para_link[0]
-                    link = f"https://drive.google.com/file/d/{doc['file_id']}/view?usp=sharing"
-                    resposta += f"\n\nDocumento relacionado: {doc['doc_name']}\n{link}"
-                else:
-                    resposta += "\n\nDocumentos relacionados:"
-                    for doc in docs_para_link:
-                        link = f"https://drive.google.com/file/d/{doc['file_id']}/view?usp=sharing"
-                        resposta += f"\n- {doc['doc_name']}\n{link}"
+    payload = {
+        "model": model_id,
+        "messages": messages,
+        "max_tokens": MAX_TOKENS,
+        "temperature": TEMPERATURE,
+        "n": 1,
+        "stream": False,
+    }
+
+    return {
+        "pergunta": pergunta,
+        "t0": t0,
+        "t_context": t_context,
+        "sem_contexto": False,
+        "query_mode": query_mode,
+        "families": families,
+        "reranked": reranked,
+        "blocos_relevantes": blocos_relevantes,
+        "payload": payload,
+    }
 
+@_span("http")
+def _chamar_llm(payload: dict):
+    """Retorna (texto, erro); exatamente um dos dois é None."""
+    try:
+        resp = session.post(
+            OPENAI_CHAT_URL,
+            json=payload,
+            timeout=REQUEST_TIMEOUT,
+        )
+        resp.raise_for_status()
+        data = resp.json()
+        resposta_final = (
+            data.get("choices", [{}])[0]
+            .get("message", {})
+            .get("content", "")
+        )
+    except requests.exceptions.RequestException as e:
+        return None, f"Erro de conexao com a API: {e}"
+    except (ValueError, KeyError, IndexError):
+        return None, "Nao consegui interpretar a resposta da API."
+
+    if not resposta_final or not resposta_final.strip():
+        return None, "A resposta da API veio vazia ou incompleta."
+    return resposta_final, None
+
+def _responder_sem_contexto(ctx: dict, api_key: str, model_id: str) -> str:
+    pergunta = ctx["pergunta"]
+    print(f"[QD-BOT v8.3] Nenhum candidato passou os filtros para: '{pergunta[:60]}'")
+    resp = gerar_resposta_fallback_interativa(pergunta, api_key, model_id)
+    _append_to_history("user", pergunta)
+    _append_to_history("assistant", resp)
+    return resp
+
+@_span("links")
+def _sufixo_links(pergunta: str, resposta: str, blocos_relevantes: list[dict]) -> str:
+    if not blocos_relevantes or _is_off_domain_reply(resposta):
+        return ""
+    docs_para_link = _escolher_documentos_para_link(pergunta, resposta, blocos_relevantes, max_docs=5)
+    if not docs_para_link:
+        return ""
+    if len(docs_para_link) == 1:
+        doc = docs_para_link[0]
+        link = f"https://drive.google.com/file/d/{doc['file_id']}/view?usp=sharing"
+        return f"\n\nDocumento relacionado: {doc['doc_name']}\n{link}"
+    sufixo = "\n\nDocumentos relacionados:"
+    for doc in docs_para_link:
+        link = f"https://drive.google.com/file/d/{doc['file_id']}/view?usp=sharing"
+        sufixo += f"\n- {doc['doc_name']}\n{link}"
+    return sufixo
+
+def _finalizar_resposta(ctx: dict, resposta_llm: str, top_k: int, registrar_historico: bool = True) -> str:
+    pergunta = ctx["pergunta"]
+    resposta = resposta_llm.strip()
+    resposta += _sufixo_links(pergunta, resposta, ctx["blocos_relevantes"])
+
+    if registrar_historico:
         _append_to_history("user", pergunta)
         _append_to_history("assistant", resposta)
+    if ctx.get("cache_scope") is not None:
+        _answer_cache_store(ctx["q_emb"], ctx["cache_scope"], ctx["signature"], pergunta, resposta)
+
+    t0 = ctx["t0"]
+    t_context = ctx["t_context"]
+    reranked = ctx["reranked"]
+    t_end = time.perf_counter()
+    top_docs = [_base_document_name(r["block"].get("pagina", "?")) for r in reranked[:top_k]]
+    top_scores_emb = [f"{r.get('score', 0):.3f}" for r in reranked[:top_k]]
+    top_scores_ce = [f"{r.get('ce_score', 0):.3f}" for r in reranked[:top_k]]
+    top_scores_final = [f"{r.get('score_combined', r.get('score', 0)):.3f}" for r in reranked[:top_k]]
+    ttft = ctx.get("t_first_token")
+    ttft_txt = f" | TTFT: {ttft - t0:.2f}s" if ttft else ""
+    print(
+        f"[QD-BOT v8.3] Query: '{pergunta[:60]}'\n"
+        f"  Mode: {ctx['query_mode']} | Families: {ctx['families']}\n"
+        f"  Contexto: {t_context - t0:.2f}s | LLM: {t_end - t_context:.2f}s | Total: {t_end - t0:.2f}s{ttft_txt}\n"
+        f"  Docs:       {top_docs}\n"
+        f"  Emb+boost:  {top_scores_emb}\n"
+        f"  CE raw:     {top_scores_ce}\n"
+        f"  Final:      {top_scores_final}"
+    )
+    return resposta
 
-        t_end = time.perf_counter()
-        top_docs = [_base_document_name(r["block"].get("pagina", "?")) for r in reranked[:top_k]]
-        top_scores_emb = [f"{r.get('score', 0):.3f}" for r in reranked[:top_k]]
-        top_scores_ce = [f"{r.get('ce_score', 0):.3f}" for r in reranked[:top_k]]
-        top_scores_final = [f"{r.get('score_combined', r.get('score', 0)):.3f}" for r in reranked[:top_k]]
-        print(
-            f"[QD-BOT v8.3] Query: '{pergunta[:60]}'\n"
-            f"  Mode: {query_mode} | Families: {families}\n"
-            f"  Contexto: {t_context - t0:.2f}s | LLM: {t_end - t_context:.2f}s | Total: {t_end - t0:.2f}s\n"
-            f"  Docs:       {top_docs}\n"
-            f"  Emb+boost:  {top_scores_emb}\n"
-            f"  CE raw:     {top_scores_ce}\n"
-            f"  Final:      {top_scores_final}"
-        )
+def responder_pergunta(pergunta, top_k: Optional[int] = None, api_key: Optional[str] = None,
+                       model_id: Optional[str] = None, history: list[dict] = None):
+    top_k, model_id = top_k or TOP_K, model_id or MODEL_ID
+    with _rastrear_requisicao(pergunta):
+        try:
+            ctx, pronta = _preparar_consulta(pergunta, model_id, history)
+            if ctx is None:
+                return pronta
+            if ctx["sem_contexto"]:
+                return _responder_sem_contexto(ctx, api_key, model_id)
+
+            resposta_final, erro = _chamar_llm(ctx["payload"])
+            if erro:
+                return erro
+
+            return _finalizar_resposta(ctx, resposta_final, top_k)
 
-        return resposta
+        except Exception as e:
+            return f"Erro interno: {e}"
+
+def _iter_sse_deltas(resp):
+    for line in resp.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        chunk = json.loads(data)
+        choices = chunk.get("choices") or []
+        if not choices:
+            continue
+        delta = (choices[0].get("delta") or {}).get("content")
+        if delta:
+            yield delta
+
+def responder_pergunta_stream(pergunta, top_k: Optional[int] = None, api_key: Optional[str] = None,
+                              model_id: Optional[str] = None, history: list[dict] = None):
+    """Versão em streaming de `responder_pergunta`: gera os trechos do texto conforme chegam.
+
+    Links e histórico são tratados ao fim do stream; os links saem como último trecho.
+    """
+    top_k, model_id = top_k or TOP_K, model_id or MODEL_ID
+    with _rastrear_requisicao(pergunta, origem="stream"):
+        try:
+            ctx, pronta = _preparar_consulta(pergunta, model_id, history)
+            if ctx is None:
+                yield pronta
+                return
+            if ctx["sem_contexto"]:
+                yield _responder_sem_contexto(ctx, api_key, model_id)
+                return
+
+            payload = dict(ctx["payload"], stream=True)
+            partes = []
+            # O span "http" soma só o tempo esperando a API: enquanto o gerador está parado no
+            # yield, quem gasta é o consumidor (renderização), e isso não é latência da API.
+            t_http = t = time.perf_counter()
+            http = 0.0
+            try:
+                with session.post(
+                    OPENAI_CHAT_URL,
+                    json=payload,
+                    timeout=REQUEST_TIMEOUT,
+                    stream=True,
+                ) as resp:
+                    resp.raise_for_status()
+                    for delta in _iter_sse_deltas(resp):
+                        if not partes:
+                            delta = delta.lstrip()
+                            if not delta:
+                                continue
+                            ctx["t_first_token"] = time.perf_counter()
+                            _trace_meta("ttft", ctx["t_first_token"] - t_http)
+                        partes.append(delta)
+                        http += time.perf_counter() - t
+                        yield delta
+                        t = time.perf_counter()
+            except requests.exceptions.RequestException as e:
+                _somar_span("http", http + time.perf_counter() - t)
+                yield ("\n\n" if partes else "") + f"Erro de conexao com a API: {e}"
+                return
+            except (ValueError, KeyError, IndexError):
+                _somar_span("http", http + time.perf_counter() - t)
+                yield ("\n\n" if partes else "") + "Nao consegui interpretar a resposta da API."
+                return
+            _somar_span("http", http + time.perf_counter() - t)
+
+            resposta_llm = "".join(partes)
+            if not resposta_llm.strip():
+                yield "A resposta da API veio vazia ou incompleta."
+                return
+
+            resposta = _finalizar_resposta(ctx, resposta_llm, top_k)
+            sufixo = resposta[len(resposta_llm.strip()):]
+            if sufixo:
+                yield sufixo
 
+        except Exception as e:
+            yield f"Erro interno: {e}"
+
+# ========================= LOTE =========================
+def responder_perguntas_em_lote(perguntas: list[str], top_k: Optional[int] = None, api_key: Optional[str] = None,
+                                model_id: Optional[str] = None, max_concorrencia: Optional[int] = None) -> list[str]:
+    """Responde várias perguntas independentes (sem histórico), na mesma ordem da entrada.
+
+    Embeddings, busca FAISS e cross-encoder rodam em lote; as chamadas ao LLM
+    são disparadas em paralelo, limitadas por `max_concorrencia`.
+    """
+    top_k, model_id = top_k or TOP_K, model_id or MODEL_ID
+    max_concorrencia = max_concorrencia or LLM_CONCURRENCY
+    t0 = time.perf_counter()
+    normalizadas = [(p or "").strip().replace("\n", " ").replace("\r", " ") for p in perguntas]
+    respostas = ["Pergunta vazia."] * len(normalizadas)
+    pos = [i for i, p in enumerate(normalizadas) if p]
+    if not pos:
+        return respostas
+
+    with _rastrear_requisicao(f"lote de {len(pos)} pergunta(s)", origem="lote"), _fixar_corpus():
+        # Resolução por pergunta: uma pergunta problemática não derruba o resto do lote.
+        resolvidas = []
+        for i in pos:
+            q = normalizadas[i]
+            try:
+                tipo = _parse_tipo_contratacao(q)
+                families = _resolve_requested_families(q, max_matches=2)
+                resolvidas.append((i, q, tipo, families, _detect_query_mode(q, families=families)))
+            except Exception as e:
+                print(f"[QD-BOT v8.3] Lote: falha ao interpretar a pergunta {i}: {e}")
+                respostas[i] = f"Erro interno: {e}"
+        if not resolvidas:
+            return respostas
+        pos, qs, tipos, families_list, modes = (list(c) for c in zip(*resolvidas))
+
+        try:
+            q_mat = _encode_queries(qs, tipos)
+            # Mesmo cache de responder_pergunta: as perguntas do lote não têm histórico.
+            signature = _corpus_version() if USE_ANSWER_CACHE else ""
+            scopes = [_answer_cache_scope(m, t, f, signature) if USE_ANSWER_CACHE else None
+                      for m, t, f in zip(modes, tipos, families_list)]
+            hits = [None] * len(qs)
+            if USE_ANSWER_CACHE:
+                with _span("cache"):
+                    hits = [_answer_cache_lookup(q_mat[j], scopes[j], signature) for j in range(len(qs))]
+            pend = [j for j, hit in enumerate(hits) if hit is None]
+            contextos = _prepare_contexts_batch(
+                [qs[j] for j in pend], [tipos[j] for j in pend], [families_list[j] for j in pend],
+                [modes[j] for j in pend], q_mat[pend],
+            ) if pend else []
+        except Exception as e:
+            for i in pos:
+                respostas[i] = f"Erro interno: {e}"
+            return respostas
+
+    for j, hit in enumerate(hits):
+        if hit is not None:
+            with _rastrear_requisicao(qs[j], origem="lote"):
+                _trace_meta("cache_hit", True)
+            respostas[pos[j]] = hit["resposta"]
+    if len(pend) < len(qs):
+        print(f"[QD-BOT v8.3] Lote: {len(qs) - len(pend)} pergunta(s) servida(s) pelo cache de respostas")
+
+    ctxs = []
+    for j, (reranked, blocos) in zip(pend, contextos):
+        if not blocos:
+            ctxs.append({"pergunta": qs[j], "t0": t0, "sem_contexto": True})
+        else:
+            ctx = _montar_ctx(qs[j], tipos[j], modes[j], families_list[j], reranked, blocos, [], model_id, t0)
+            ctx.update({"q_emb": q_mat[j], "cache_scope": scopes[j], "signature": signature})
+            ctxs.append(ctx)
+    print(f"[QD-BOT v8.3] Lote: contexto de {len(pend)} perguntas em {time.perf_counter() - t0:.2f}s")
+
+    def _responder_ctx(ctx: dict) -> str:
+        # Cada pergunta do lote vira uma amostra de latência, como no chat.
+        with _rastrear_requisicao(ctx["pergunta"], origem="lote"):
+            if ctx.get("cache_scope") is not None:
+                _trace_meta("cache_hit", False)
+            try:
+                if ctx["sem_contexto"]:
+                    return gerar_resposta_fallback_interativa(ctx["pergunta"], api_key, model_id)
+                _trace_meta("mode", ctx["query_mode"])
+                _trace_meta("n_blocos", len(ctx["blocos_relevantes"]))
+                texto, erro = _chamar_llm(ctx["payload"])
+                if erro:
+                    return erro
+                return _finalizar_resposta(ctx, texto, top_k, registrar_historico=False)
+            except Exception as e:
+                return f"Erro interno: {e}"
+
+    if ctxs:
+        workers = max(1, min(max_concorrencia, len(ctxs)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="qdbot-llm") as pool:
+            for j, resposta in zip(pend, pool.map(_responder_ctx, ctxs)):
+                respostas[pos[j]] = resposta
+
+    print(f"[QD-BOT v8.3] Lote: {len(qs)} perguntas em {time.perf_counter() - t0:.2f}s")
+    return respostas
+
+# ========================= AQUECIMENTO =========================
+def _aquecer():
+    _WARMUP_STATE["inicio"] = time.time()
+    try:
+        with _startup_step("aquecimento (total)"):
+            _api_key()
+            get_sbert_model()
+            get_cross_encoder()
+            get_vector_index()
+        print(f"[QD-BOT v8.3] Aquecimento concluído em {_STARTUP_TIMINGS['aquecimento (total)']:.2f}s")
     except Exception as e:
-        return f"Erro interno: {e}"
+        _WARMUP_STATE["erro"] = f"{type(e).__name__}: {e}"
+        print(f"[QD-BOT v8.3] Aquecimento falhou: {e} — os recursos serão carregados na primeira pergunta")
+    finally:
+        _WARMUP_STATE["fim"] = time.time()
+        _WARMUP_STATE["etapa"] = None
+        _WARMUP_DONE.set()
+
+def iniciar_aquecimento() -> bool:
+    """Carrega segredos, modelos e índice numa thread de fundo (uma vez por processo).
+
+    Chamado no boot do app: a interface sobe sem esperar, e os caches de recurso do
+    Streamlit fazem a primeira pergunta aguardar só o que ainda estiver carregando.
+    Retorna False se o aquecimento já tinha sido iniciado.
+    """
+    with _STARTUP_LOCK:
+        if _WARMUP_STATE["thread"] is not None:
+            return False
+        t = threading.Thread(target=_aquecer, name="qdbot-aquecimento", daemon=True)
+        _WARMUP_STATE["thread"] = t
+    t.start()
+    return True
+
+def estado_aquecimento() -> dict:
+    """Prontidão do backend para a UI: estado ("parado", "aquecendo", "pronto", "falhou"),
+    etapa em andamento e segundos decorridos desde o início do aquecimento."""
+    inicio, fim = _WARMUP_STATE["inicio"], _WARMUP_STATE["fim"]
+    if _WARMUP_STATE["thread"] is None:
+        estado = "parado"
+    elif fim is None:
+        estado = "aquecendo"
+    else:
+        estado = "falhou" if _WARMUP_STATE["erro"] else "pronto"
+    return {
+        "estado": estado,
+        "etapa": _WARMUP_STATE["etapa"],
+        "segundos": ((fim or time.time()) - inicio) if inicio else 0.0,
+        "erro": _WARMUP_STATE["erro"],
+    }
+
+def aguardar_aquecimento(timeout: Optional[float] = None) -> bool:
+    """Bloqueia até o aquecimento terminar (True) ou o timeout vencer (False).
+
+    Sem aquecimento em andamento retorna na hora: a pergunta segue e carrega o que faltar.
+    """
+    if _WARMUP_STATE["thread"] is None or threading.current_thread() is _WARMUP_STATE["thread"]:
+        return True
+    return _WARMUP_DONE.wait(timeout)
+
+def relatorio_inicializacao() -> str:
+    with _STARTUP_LOCK:
+        etapas = list(_STARTUP_TIMINGS.items())
+    if _WARMUP_STATE["thread"] is None:
+        estado = "não iniciado"
+    elif _WARMUP_STATE["erro"]:
+        estado = f"falhou ({_WARMUP_STATE['erro']})"
+    elif _WARMUP_STATE["fim"] is None:
+        estado = f"em andamento há {time.time() - _WARMUP_STATE['inicio']:.1f}s"
+    else:
+        estado = "concluído"
+    linhas = [f"Aquecimento: {estado}", f"{'etapa':<32} {'segundos':>9}"]
+    for nome, dt in etapas:
+        linhas.append(f"{nome:<32} {dt:>9.2f}")
+    return "\n".join(linhas)
+
+_STARTUP_TIMINGS["import openai_backend"] = time.perf_counter() - _IMPORT_T0
 
 # ========================= CLI =========================
 if __name__ == "__main__":
+    import sys
+
     print(f"\nQD-Bot v8.3 | Embed: {EMBED_MODEL_NAME} | CE: {CE_MODEL_NAME} ({USE_CE})")
+    if len(sys.argv) >= 3 and sys.argv[1] == "--lote":
+        # Uso: python openai_backend.py --lote perguntas.txt  (uma pergunta por linha)
+        with open(sys.argv[2], "r", encoding="utf-8") as f:
+            perguntas_lote = [line.strip() for line in f if line.strip()]
+        for q, r in zip(perguntas_lote, responder_perguntas_em_lote(perguntas_lote)):
+            print(f"Pergunta: {q}\n" + "=" * 40 + f"\n{r}\n" + "=" * 40 + "\n")
+        sys.exit(0)
+
     print("Digite sua pergunta (ou 'sair'):\n")
     cli_history = []
     while True:
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bot"))
+import openai_backend as ob  # noqa: E402
+
+
+class FakeSbert:
+    """Embedding determinístico: tokens espalhados por hash em 64 dimensões."""
+
+    def __init__(self):
+        self.textos = 0
+
+    def encode(self, texts, convert_to_numpy=True, normalize_embeddings=True, **kw):
+        self.textos += len(texts)
+        out = np.zeros((len(texts), 64), dtype=np.float32)
+        for i, t in enumerate(texts):
+            for tok in ob._tokenize(t):
+                out[i, int(hashlib.md5(tok.encode()).hexdigest(), 16) % 64] += 1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.where(norms == 0, 1.0, norms)
+
+
+class _Req:
+    def __init__(self, fn):
+        self.fn = fn
+
+    def execute(self):
+        return self.fn()
+
+
+class FakeDrive:
+    """Pasta do Drive em memória, com listagem, download, feed de changes e falhas injetáveis."""
+
+    def __init__(self):
+        self.files = {}
+        self.content = {}
+        self.log = []
+        self.calls = {"list": 0, "get_media": 0, "changes": 0}
+        self.falhar_download = {}  # file_id -> quantas vezes ainda falha
+        self.offline = False
+        self.drive_id = None
+
+    def put(self, fid, name, data: bytes, mime="application/json", modified="2026-01-01T00:00:00Z", md5=True):
+        meta = {"id": fid, "name": name, "modifiedTime": modified, "mimeType": mime}
+        if md5:
+            meta["md5Checksum"] = hashlib.md5(data).hexdigest()
+        self.files[fid] = meta
+        self.content[fid] = data
+        self.log.append({"fileId": fid, "removed": False, "file": dict(meta, parents=[ob.FOLDER_ID], trashed=False)})
+
+    def put_json(self, fid, pagina, texto):
+        self.put(fid, f"{pagina}.json", json.dumps([{"pagina": pagina, "texto": texto}]).encode())
+
+    def delete(self, fid):
+        self.files.pop(fid)
+        self.log.append({"fileId": fid, "removed": True})
+
+    def _check(self):
+        if self.offline:
+            raise ConnectionError("sem rede")
+
+
+class _FakeFiles:
+    def __init__(self, d):
+        self.d = d
+
+    def list(self, q=None, fields=None, pageSize=None, pageToken=None, **kw):
+        def run():
+            self.d._check()
+            self.d.calls["list"] += 1
+            out = []
+            for f in self.d.files.values():
+                if "mimeType='application/json'" in (q or "") and f["mimeType"] not in ob._JSON_MIMES:
+                    continue
+                if "wordprocessingml" in (q or "") and f["mimeType"] != ob._DOCX_MIME:
+                    continue
+                out.append(dict(f))
+            return {"files": out}
+        return _Req(run)
+
+    def get(self, fileId=None, fields=None, **kw):
+        def run():
+            self.d._check()
+            return {"id": fileId, "driveId": self.d.drive_id} if self.d.drive_id else {"id": fileId}
+        return _Req(run)
+
+    def get_media(self, fileId=None, **kw):
+        def run():
+            self.d._check()
+            self.d.calls["get_media"] += 1
+            if self.d.falhar_download.get(fileId, 0) > 0:
+                self.d.falhar_download[fileId] -= 1
+                raise RuntimeError("HttpError 503: backendError")
+            return self.d.content[fileId]
+        return _Req(run)
+
+
+class _FakeChanges:
+    def __init__(self, d):
+        self.d = d
+
+    def getStartPageToken(self, **kw):
+        def run():
+            self.d._check()
+            return {"startPageToken": str(len(self.d.log))}
+        return _Req(run)
+
+    def list(self, pageToken=None, pageSize=1000, **kw):
+        def run():
+            self.d._check()
+            self.d.calls["changes"] += 1
+            self.d.changes_kwargs = kw
+            i = int(pageToken)
+            out = {"changes": self.d.log[i:i + pageSize]}
+            if i + pageSize < len(self.d.log):
+                out["nextPageToken"] = str(i + pageSize)
+            else:
+                out["newStartPageToken"] = str(len(self.d.log))
+            return out
+        return _Req(run)
+
+
+class FakeDriveService:
+    def __init__(self, d):
+        self.d = d
+
+    def files(self):
+        return _FakeFiles(self.d)
+
+    def changes(self):
+        return _FakeChanges(self.d)
+
+
+def reiniciar_processo():
+    """Esquece todo o estado em memória do backend, como um novo processo (os diretórios ficam)."""
+    ob.invalidar_fontes()
+    ob._DRIVE_SYNC.clear()
+    ob._FILE_CACHE_STATE.update({"bytes": None, "hits": 0, "misses": 0, "downloads": 0, "evicted": 0, "corrupted": 0})
+    for fn in (ob._parse_json_cached, ob._parse_docx_cached, ob._download_and_parse_blocks):
+        fn.clear()
+
+
+@pytest.fixture
+def drive(monkeypatch, tmp_path):
+    """Backend apontado para um FakeDrive, com snapshot/caches em diretórios temporários."""
+    d = FakeDrive()
+    svc = FakeDriveService(d)
+    sbert = FakeSbert()
+    monkeypatch.setattr(ob, "get_drive_client", lambda _v=None: svc)
+    monkeypatch.setattr(ob, "_make_drive_client", lambda: svc)
+    monkeypatch.setattr(ob, "_DRIVE_THREAD_LOCAL", threading.local())
+    monkeypatch.setattr(ob, "get_sbert_model", lambda _v=None: sbert)
+    monkeypatch.setattr(ob, "get_cross_encoder", lambda _v=None: None)
+    monkeypatch.setattr(ob, "USE_PRECOMPUTED", False)
+    for nome in ("SNAPSHOT_DIR", "FILE_EMB_STORE_DIR", "FILE_CACHE_DIR"):
+        monkeypatch.setattr(ob, nome, str(tmp_path / nome.lower()))
+    monkeypatch.setattr(ob, "DRIVE_CHANGES_STATE_PATH", str(tmp_path / "changes.json"))
+    d.sbert = sbert
+    reiniciar_processo()
+    yield d
+    reiniciar_processo()
@@ -0,0 +1,122 @@
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bot"))
+import openai_backend as ob  # noqa: E402
+
+
+class _FakeSbert:
+    def encode(self, texts, convert_to_numpy=True, normalize_embeddings=True, **kw):
+        out = np.zeros((len(texts), 64), dtype=np.float32)
+        for i, t in enumerate(texts):
+            for tok in ob._tokenize(t):
+                out[i, int(hashlib.md5(tok.encode()).hexdigest(), 16) % 64] += 1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.where(norms == 0, 1.0, norms)
+
+
+class _FakeResp:
+    def __init__(self, texto):
+        self.texto = texto
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"choices": [{"message": {"content": self.texto}}]}
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    monkeypatch.setattr(ob, "get_sbert_model", lambda _v=None: _FakeSbert())
+    monkeypatch.setattr(ob, "get_cross_encoder", lambda _v=None: None)
+    monkeypatch.setattr(ob, "USE_ANSWER_CACHE", True)
+    ob._ANSWER_CACHE.clear()
+    ob.usar_corpus_local([
+        {"pagina": "COSANPA - Gestão de contratos", "file_id": "f1",
+         "texto": "Aditivo contratual: prazo de 30 dias para análise do fiscal. " * 5},
+        {"pagina": "PO.08 - Controle de Pessoal", "file_id": "f2",
+         "texto": "Admissão de colaboradores: prazo de 5 dias para entrega do ASO. " * 5},
+        {"pagina": "SEINFRA - Medições", "file_id": "f3",
+         "texto": "Medições de obra: boletim aprovado pelo fiscal em 10 dias. " * 5},
+    ])
+    posts = []
+
+    def post(url, json=None, timeout=None, stream=False):
+        posts.append(json)
+        return _FakeResp(f"resposta {len(posts)}")
+
+    monkeypatch.setattr(ob.session, "post", post)
+    yield posts
+    ob.usar_corpus_local(None)
+    ob._ANSWER_CACHE.clear()
+
+
+def test_follow_up_with_different_histories_does_not_share_answer(backend):
+    h1 = [{"role": "user", "content": "como fazer aditivo de contrato?"},
+          {"role": "assistant", "content": "O aditivo é analisado pelo fiscal."}]
+    h2 = [{"role": "user", "content": "como é a admissão de colaboradores?"},
+          {"role": "assistant", "content": "A admissão exige o ASO."}]
+
+    r1 = ob.responder_pergunta("e o prazo?", history=h1)
+    r2 = ob.responder_pergunta("e o prazo?", history=h2)
+
+    assert len(backend) == 2
+    assert r1.startswith("resposta 1")
+    assert r2.startswith("resposta 2")
+
+
+def test_question_without_history_is_served_from_cache(backend):
+    pergunta = "qual o prazo do aditivo de contrato?"
+    r1 = ob.responder_pergunta(pergunta, history=[])
+    r2 = ob.responder_pergunta(pergunta, history=[])
+
+    assert len(backend) == 1
+    assert r1 == r2
+
+
+def test_batch_shares_the_answer_cache_and_records_latency(backend):
+    pergunta = "qual o prazo do aditivo de contrato?"
+    r_chat = ob.responder_pergunta(pergunta, history=[])
+    n_traces = len(ob._TELEMETRY_RING.snapshot())
+
+    r_lote = ob.responder_perguntas_em_lote([pergunta, "como é a admissão de colaboradores?"])
+
+    assert len(backend) == 2
+    assert r_lote[0] == r_chat
+    novos = ob._TELEMETRY_RING.snapshot()[n_traces:]
+    por_pergunta = [t for t in novos if t["origem"] == "lote" and not t["pergunta"].startswith("lote de")]
+    assert sorted(bool(t["meta"].get("cache_hit")) for t in por_pergunta) == [False, True]
+
+
+def test_questions_about_different_families_do_not_share_answer(backend, monkeypatch):
+    # Limiar zero: só o escopo separa as perguntas, como duas frases quase idênticas no MiniLM.
+    monkeypatch.setattr(ob, "ANSWER_CACHE_THRESHOLD", 0.0)
+    assert ob._resolve_requested_families("documentos da COSANPA", max_matches=2) != \
+        ob._resolve_requested_families("documentos da SEINFRA", max_matches=2)
+
+    r1 = ob.responder_pergunta("documentos da COSANPA", history=[])
+    r2 = ob.responder_pergunta("documentos da SEINFRA", history=[])
+
+    assert len(backend) == 2
+    assert r1 != r2
+
+
+def test_batch_isolates_a_question_that_fails_to_resolve(backend, monkeypatch):
+    original = ob._resolve_requested_families
+
+    def resolve(query, max_matches=2):
+        if "quebra" in query:
+            raise ValueError("família inválida")
+        return original(query, max_matches=max_matches)
+
+    monkeypatch.setattr(ob, "_resolve_requested_families", resolve)
+    r = ob.responder_perguntas_em_lote(["pergunta que quebra", "como é a admissão de colaboradores?", ""])
+
+    assert r[0] == "Erro interno: família inválida"
+    assert r[1].startswith("resposta 1")
+    assert r[2] == "Pergunta vazia."
@@ -0,0 +1,23 @@
+import pytest
+
+import benchmark_retrieval as br
+import openai_backend as ob
+
+
+def _resultados():
+    textos = ["aditivo contratual prazo fiscal medição boletim obra", "aditivo contratual prazo fiscal medição boletim"]
+    return [{"idx": i, "block": {"pagina": f"DOC{i}", "texto": t}, "score": 1.0 - i / 10}
+            for i, t in enumerate(textos)]
+
+
+def test_set_overrides_parameters_read_through_defaults(monkeypatch):
+    monkeypatch.setattr(ob, "DEDUP_MAX_OVERLAP", ob.DEDUP_MAX_OVERLAP)
+    assert len(ob._deduplicate_results(_resultados())) == 1
+
+    br._aplicar_overrides(["DEDUP_MAX_OVERLAP=1.0"])
+    assert len(ob._deduplicate_results(_resultados())) == 2
+
+
+def test_set_rejects_parameters_read_only_at_import():
+    with pytest.raises(SystemExit):
+        br._aplicar_overrides(["TELEMETRY_RING_SIZE=10"])
@@ -0,0 +1,52 @@
+import openai_backend as ob
+
+_BASE = "O aditivo contratual deve ser analisado pelo fiscal em trinta dias corridos após o protocolo"
+
+
+def _resultados(textos):
+    blocks = [{"pagina": f"Doc {i}", "texto": t} for i, t in enumerate(textos)]
+    lex = ob.build_lexical_index(blocks)
+    results = [{"idx": i, "score": 1.0 - 0.01 * i, "block": b} for i, b in enumerate(blocks)]
+    return results, lex
+
+
+def _idx(results):
+    return [r["idx"] for r in results]
+
+
+def test_minhash_matches_exact_dedup():
+    textos = [
+        _BASE,
+        _BASE + " na sede",                                  # quase cópia
+        "Admissão de colaboradores exige o ASO antes do primeiro dia de trabalho na obra",
+        _BASE.replace("trinta", "quinze"),                   # uma palavra diferente
+        "Boletim de medição aprovado pelo fiscal da obra",
+    ]
+    results, lex = _resultados(textos)
+
+    exato = ob._deduplicate_results(results, max_overlap=0.75)
+    minhash = ob._deduplicate_results(results, max_overlap=0.75, lex=lex)
+
+    assert _idx(exato) == [0, 2, 4]
+    assert _idx(minhash) == _idx(exato)
+
+
+def test_threshold_is_honored_by_both_paths():
+    results, lex = _resultados([_BASE, _BASE + " na sede", "Outro assunto sem relação nenhuma"])
+
+    assert _idx(ob._deduplicate_results(results, max_overlap=1.0)) == [0, 1, 2]
+    assert _idx(ob._deduplicate_results(results, max_overlap=1.0, lex=lex)) == [0, 1, 2]
+
+
+def test_identical_copies_from_other_file_are_dropped_at_build():
+    blocks = [
+        {"pagina": "PO.08 - Controle de Pessoal.docx", "texto": _BASE, "file_id": "a"},
+        {"pagina": "PO.08 - Controle de Pessoal.json", "texto": _BASE, "file_id": "b"},
+        {"pagina": "PO.08 - Controle de Pessoal.docx", "texto": _BASE, "file_id": "a"},
+        {"pagina": "COSANPA - Gestão de contratos", "texto": _BASE, "file_id": "c"},
+    ]
+    vocab = {}
+    fields = ob._block_field_token_ids(blocks, vocab)
+    keep = ob._duplicate_block_mask(blocks, ob.build_minhash_signatures(fields["texto"], vocab))
+    # Cópia de outro arquivo do mesmo documento sai; repetição no mesmo arquivo e outro documento ficam.
+    assert keep.tolist() == [True, False, True, True]
@@ -0,0 +1,78 @@
+import openai_backend as ob
+from conftest import reiniciar_processo
+
+
+def _ids(src):
+    return sorted(f["id"] for f in src["json"])
+
+
+def _corpus(drive):
+    drive.put_json("f1", "COSANPA - Gestão de contratos", "Aditivo contratual e medição. " * 10)
+    drive.put_json("f2", "PO.08 - Controle de Pessoal", "Admissão de colaboradores. " * 10)
+
+
+def test_delta_sync_applies_changes_without_relisting(drive):
+    _corpus(drive)
+    assert _ids(ob._list_sources_drive(ob.FOLDER_ID)) == ["f1", "f2"]
+    listagens = drive.calls["list"]
+
+    drive.put_json("f3", "SEINFRA - Medições", "Medições de obra. " * 10)
+    drive.put_json("f1", "COSANPA - Gestão de contratos", "Texto novo do aditivo. " * 10)
+    drive.delete("f2")
+    src = ob._list_sources_drive(ob.FOLDER_ID)
+
+    assert _ids(src) == ["f1", "f3"]
+    assert drive.calls["list"] == listagens
+    f1 = next(f for f in src["json"] if f["id"] == "f1")
+    assert f1["md5Checksum"] == drive.files["f1"]["md5Checksum"]
+
+
+def test_restart_resumes_from_persisted_token(drive):
+    _corpus(drive)
+    antes = ob._list_sources_drive(ob.FOLDER_ID)
+    listagens = drive.calls["list"]
+
+    reiniciar_processo()
+    assert ob._list_sources_drive(ob.FOLDER_ID) == antes
+    assert drive.calls["list"] == listagens
+
+
+def test_invalid_token_falls_back_to_full_listing(drive):
+    _corpus(drive)
+    ob._list_sources_drive(ob.FOLDER_ID)
+    ob._DRIVE_SYNC[ob.FOLDER_ID]["token"] = "expirado"
+
+    assert _ids(ob._list_sources_drive(ob.FOLDER_ID)) == ["f1", "f2"]
+
+
+def test_offline_start_uses_last_known_listing(drive):
+    _corpus(drive)
+    antes = ob._list_sources_drive(ob.FOLDER_ID)
+
+    reiniciar_processo()
+    drive.offline = True
+    assert ob._list_sources_drive(ob.FOLDER_ID) == antes
+
+
+def test_shared_drive_feed_is_scoped_to_the_folder_drive(drive):
+    drive.drive_id = "0AShared"
+    _corpus(drive)
+    ob._list_sources_drive(ob.FOLDER_ID)
+    ob._list_sources_drive(ob.FOLDER_ID)
+
+    assert ob._DRIVE_SYNC[ob.FOLDER_ID]["drive_id"] == "0AShared"
+    assert drive.changes_kwargs["driveId"] == "0AShared"
+
+
+def test_periodic_full_resync(drive, monkeypatch):
+    _corpus(drive)
+    ob._list_sources_drive(ob.FOLDER_ID)
+    listagens = drive.calls["list"]
+
+    # Mudança que o feed não entrega: só a relistagem periódica a enxerga.
+    drive.files["f9"] = dict(drive.files["f1"], id="f9", name="NOVO - Doc.json")
+    assert _ids(ob._list_sources_drive(ob.FOLDER_ID)) == ["f1", "f2"]
+
+    monkeypatch.setattr(ob, "DRIVE_FULL_RESYNC_S", 0)
+    assert _ids(ob._list_sources_drive(ob.FOLDER_ID)) == ["f1", "f2", "f9"]
+    assert drive.calls["list"] > listagens
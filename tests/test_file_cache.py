@@ -0,0 +1,69 @@
+import os
+
+import openai_backend as ob
+from conftest import reiniciar_processo
+
+
+def _arquivos(sufixo):
+    return sorted(n for n in os.listdir(ob.FILE_CACHE_DIR) if n.endswith(sufixo))
+
+
+def test_restart_reuses_cached_blocks_without_download(drive):
+    drive.put_json("f1", "COSANPA - Gestão de contratos", "Aditivo contratual e medição do boletim. " * 20)
+    ob._parse_json("f1", ob._source_cache_key(drive.files["f1"]), "COSANPA - Gestão de contratos.json")
+    assert drive.calls["get_media"] == 1
+
+    reiniciar_processo()
+    blocks = ob._parse_json("f1", ob._source_cache_key(drive.files["f1"]), "COSANPA - Gestão de contratos.json")
+    assert blocks and drive.calls["get_media"] == 1
+    assert ob.file_cache_stats()["hits"] == 1
+
+
+def test_corrupted_entry_is_discarded_and_downloaded_again(drive):
+    drive.put_json("f1", "COSANPA - Gestão de contratos", "Aditivo contratual e medição do boletim. " * 20)
+    key = ob._source_cache_key(drive.files["f1"])
+    ob._download_bytes_cached("f1", key)
+    raw = ob._file_cache_raw_path("f1", key)
+    with open(raw, "r+b") as f:
+        f.seek(-5, os.SEEK_END)
+        f.write(b"XXXXX")
+
+    data = ob._download_bytes_cached("f1", key)
+    assert data == drive.content["f1"]
+    assert drive.calls["get_media"] == 2
+    assert ob.file_cache_stats()["corrupted"] == 1
+    # A entrada foi regravada íntegra.
+    assert ob._file_cache_read(raw) == drive.content["f1"]
+
+
+def test_native_export_is_keyed_by_file_modified_time_and_mime(drive):
+    drive.put("g1", "Manual", b"conteudo v1", mime="text/plain", modified="2026-01-01T00:00:00Z", md5=False)
+    drive.put("g2", "Outro", b"conteudo de outro", mime="text/plain", modified="2026-01-01T00:00:00Z", md5=False)
+    k1, k2 = ob._source_cache_key(drive.files["g1"]), ob._source_cache_key(drive.files["g2"])
+    assert k1 == k2 == "mt:2026-01-01T00:00:00Z|text/plain"
+    # Mesmo modifiedTime em arquivos diferentes não colide.
+    assert ob._download_bytes_cached("g1", k1) == b"conteudo v1"
+    assert ob._download_bytes_cached("g2", k2) == b"conteudo de outro"
+
+    drive.put("g1", "Manual", b"conteudo v2", mime="text/plain", modified="2026-02-01T00:00:00Z", md5=False)
+    novo = ob._source_cache_key(drive.files["g1"])
+    assert novo != k1
+    assert ob._download_bytes_cached("g1", novo) == b"conteudo v2"
+    assert drive.calls["get_media"] == 3
+
+
+def test_eviction_keeps_cache_under_limit_dropping_least_recent(drive, monkeypatch):
+    monkeypatch.setattr(ob, "FILE_CACHE_MAX_MB", 1)
+    for i in range(3):
+        drive.put(f"b{i}", f"big{i}", os.urandom(400 * 1024), mime="text/plain")
+        ob._download_bytes_cached(f"b{i}", ob._source_cache_key(drive.files[f"b{i}"]))
+        os.utime(ob._file_cache_raw_path(f"b{i}", ob._source_cache_key(drive.files[f"b{i}"])), (i, i))
+
+    drive.put("b3", "big3", os.urandom(400 * 1024), mime="text/plain")
+    ob._download_bytes_cached("b3", ob._source_cache_key(drive.files["b3"]))
+
+    stats = ob.file_cache_stats()
+    assert stats["bytes"] <= 1024 * 1024
+    assert stats["evicted"] >= 1
+    assert not os.path.exists(ob._file_cache_raw_path("b0", ob._source_cache_key(drive.files["b0"])))
+    assert os.path.exists(ob._file_cache_raw_path("b3", ob._source_cache_key(drive.files["b3"])))
@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+
+import openai_backend as ob
+
+
+def _fontes(drive):
+    return {"json": list(drive.files.values()), "docx": []}
+
+
+def _corpus(drive):
+    drive.put_json("f1", "COSANPA - Gestão de contratos", "Aditivo contratual e medição do boletim da obra. " * 20)
+    drive.put_json("f2", "PO.08 - Controle de Pessoal", "Admissão de colaboradores na obra e entrega do ASO. " * 20)
+    drive.put_json("f3", "SEINFRA - Medições", "Medições de obra SEINFRA e aprovação do fiscal. " * 20)
+
+
+def test_only_changed_file_is_encoded_again(drive):
+    _corpus(drive)
+    _grouped, _emb, falhas = ob._embed_sources_incremental(_fontes(drive))
+    assert not falhas
+    antes = drive.sbert.textos
+
+    drive.put_json("f2", "PO.08 - Controle de Pessoal", "Demissão de colaboradores e baixa do ASO. " * 20)
+    grouped, emb, _falhas = ob._embed_sources_incremental(_fontes(drive))
+
+    novos = [b for b in grouped if b["file_id"] == "f2"]
+    assert drive.sbert.textos - antes == len(novos)
+    # Mesmo resultado de codificar tudo do zero.
+    esperado = ob._encode_texts(drive.sbert, [ob._texto_para_embedding(b) for b in grouped])
+    np.testing.assert_allclose(emb, esperado, atol=1e-6)
+
+
+def test_removed_file_leaves_index_and_store(drive):
+    _corpus(drive)
+    ob._embed_sources_incremental(_fontes(drive))
+    assert len(os.listdir(ob.FILE_EMB_STORE_DIR)) == 6  # .json + .npy por arquivo
+
+    drive.delete("f3")
+    grouped, emb, _falhas = ob._embed_sources_incremental(_fontes(drive))
+
+    assert {b["file_id"] for b in grouped} == {"f1", "f2"}
+    assert emb.shape[0] == len(grouped)
+    assert len(os.listdir(ob.FILE_EMB_STORE_DIR)) == 4
+
+
+def test_model_change_invalidates_stored_embeddings(drive, monkeypatch):
+    _corpus(drive)
+    ob._embed_sources_incremental(_fontes(drive))
+    antes = drive.sbert.textos
+
+    monkeypatch.setattr(ob, "_MODEL_BACKEND_LOADED", {"sbert": "onnx:model.int8.onnx"})
+    grouped, _emb, _falhas = ob._embed_sources_incremental(_fontes(drive))
+    assert drive.sbert.textos - antes == len(grouped)
@@ -0,0 +1,59 @@
+import pytest
+
+import openai_backend as ob
+from conftest import FakeSbert
+
+
+def _blocos():
+    return [
+        {"pagina": "COSANPA - Gestão de contratos", "texto": "Aditivo contratual e prazo de análise do fiscal."},
+        {"pagina": "PO.08 - Controle de Pessoal", "texto": "Admissão de colaboradores e entrega do ASO."},
+        {"pagina": "SEINFRA - Medições", "texto": "Boletim de medição XZ991 aprovado pelo fiscal da obra."},
+        {"pagina": "SEINFRA - Anexos", "texto": "Medição " + "planilha de quantitativos da obra " * 10 + "XZ991."},
+    ]
+
+
+def test_bm25_ranks_rare_term_and_prefers_shorter_document():
+    lex = ob.build_lexical_index(_blocos())
+    ranking = ob.bm25_search(lex, "medição XZ991", top_n=10)
+
+    assert [i for i, _s in ranking][:2] == [2, 3]
+    assert ranking[0][1] > ranking[1][1] > 0
+    assert ob.bm25_search(lex, "termo inexistente", top_n=10) == []
+
+
+def test_rrf_rewards_candidates_found_by_both_rankings():
+    dense = [(0, 0.9), (1, 0.8), (2, 0.7)]
+    sparse = [(2, 12.0), (3, 8.0)]
+
+    fused = ob._fuse_rrf(dense, sparse, top_n=3)
+
+    assert fused[0] == 2
+    # 1 (denso) e 3 (esparso) empatam no rank 2 de cada lado: desempata pelo índice.
+    assert fused[1:] == [0, 1]
+
+
+def test_sparse_only_candidate_enters_with_its_cosine(monkeypatch):
+    monkeypatch.setattr(ob, "get_sbert_model", lambda _v=None: FakeSbert())
+    monkeypatch.setattr(ob, "GROUP_WINDOW", 1)
+    monkeypatch.setattr(ob, "MIN_SCORE_THRESHOLD", -1.0)
+    monkeypatch.setattr(ob, "RELATIVE_SCORE_CUTOFF", 0.0)
+    vecdb = ob.usar_corpus_local([dict(b, file_id=f"f{i}") for i, b in enumerate(_blocos())])
+    try:
+        q = ob._encode_texts(FakeSbert(), ["código XZ991"])[0]
+        # O denso não trouxe o bloco do código; o BM25 traz, e a fusão o inclui.
+        results = ob._score_candidates(vecdb, "código XZ991", q, [(0, 0.5), (1, 0.4)], top_n=4)
+    finally:
+        ob.usar_corpus_local(None)
+
+    por_idx = {r["idx"]: r for r in results}
+    achado = next(i for i, b in enumerate(vecdb["blocks"]) if "XZ991 aprovado" in b["texto"])
+    assert achado in por_idx
+    assert por_idx[achado]["bm25"] == pytest.approx(1.0)
+
+
+def test_bm25_disabled_builds_no_inverted_index(monkeypatch):
+    monkeypatch.setattr(ob, "USE_BM25", False)
+    lex = ob.build_lexical_index(_blocos())
+    assert "bm25_indptr" not in lex
+    assert ob.bm25_search(lex, "XZ991", top_n=5) == []
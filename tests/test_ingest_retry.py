@@ -0,0 +1,48 @@
+import os
+
+import openai_backend as ob
+from conftest import reiniciar_processo
+
+
+def _paginas(vecdb):
+    return {b["pagina"] for b in vecdb["blocks"]}
+
+
+def _corpus(drive):
+    drive.put_json("f1", "COSANPA - Gestão de contratos", "Aditivo contratual e medição do boletim da obra. " * 20)
+    drive.put_json("f2", "PO.08 - Controle de Pessoal", "Admissão de colaboradores na obra e entrega do ASO. " * 20)
+    drive.put_json("f3", "SEINFRA - Medições", "Medições de obra SEINFRA e aprovação do fiscal. " * 20)
+
+
+def test_failed_download_is_not_saved_as_snapshot(drive):
+    _corpus(drive)
+    drive.falhar_download["f1"] = 1
+
+    vecdb = ob.get_vector_index()
+    assert vecdb["falhas"] == ["COSANPA - Gestão de contratos.json"]
+    assert "COSANPA - Gestão de contratos" not in _paginas(vecdb)
+    assert not os.path.isdir(ob.SNAPSHOT_DIR) or not os.listdir(ob.SNAPSHOT_DIR)
+
+    # Novo processo com o Drive saudável: nada parcial foi persistido para esta versão.
+    reiniciar_processo()
+    vecdb = ob.get_vector_index()
+    assert not vecdb.get("falhas")
+    assert "COSANPA - Gestão de contratos" in _paginas(vecdb)
+
+
+def test_incomplete_index_is_rebuilt_on_refresh(drive, monkeypatch):
+    _corpus(drive)
+    drive.falhar_download["f1"] = 1
+    vecdb = ob.get_vector_index()
+    assert vecdb["falhas"]
+
+    state = ob._SOURCES_STATE[ob.FOLDER_ID]
+    assert ob._sources_ttl(state) == ob.SOURCES_RETRY_TTL
+    ob._refresh_sources(ob.FOLDER_ID, state)
+
+    novo = ob._SOURCES_STATE[ob.FOLDER_ID]
+    assert novo["version"] == state["version"]
+    assert not novo["vecdb"].get("falhas")
+    assert "COSANPA - Gestão de contratos" in _paginas(novo["vecdb"])
+    # Só o arquivo que falhou foi codificado de novo.
+    assert drive.calls["get_media"] == 4
@@ -0,0 +1,24 @@
+import openai_backend as ob
+from conftest import reiniciar_processo
+
+
+def test_snapshot_is_found_without_loading_the_model(drive, monkeypatch):
+    drive.put_json("f1", "COSANPA - Gestão de contratos", "Aditivo contratual e medição do boletim da obra. " * 20)
+    ob.get_vector_index()
+
+    reiniciar_processo()
+    carregou = []
+    monkeypatch.setattr(ob, "get_sbert_model", lambda _v=None: carregou.append(1) or drive.sbert)
+    vecdb = ob.get_vector_index()
+    assert vecdb["blocks"]
+    assert drive.calls["get_media"] == 1  # veio do snapshot, sem baixar de novo
+    assert not carregou
+
+
+def test_loaded_backend_overrides_configured_tag(monkeypatch):
+    monkeypatch.setattr(ob, "INFERENCE_BACKEND", "onnx")
+    monkeypatch.setattr(ob, "_MODEL_BACKEND_LOADED", {})
+    assert ob._embed_model_tag() == f"{ob.EMBED_MODEL_NAME}|{ob._configured_backend_tag()}"
+    # ONNX reprovado na carga: o modelo efetivo (PyTorch) passa a definir a chave.
+    ob._registrar_backend("sbert", ob.EMBED_MODEL_NAME, object())
+    assert ob._embed_model_tag() == ob.EMBED_MODEL_NAME
@@ -0,0 +1,54 @@
+import json
+import time
+
+import pytest
+
+import openai_backend as ob
+from conftest import FakeSbert
+
+
+class _StreamResp:
+    def __init__(self, deltas, atraso):
+        self.deltas = deltas
+        self.atraso = atraso
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self, decode_unicode=True):
+        for d in self.deltas:
+            time.sleep(self.atraso)
+            yield "data: " + json.dumps({"choices": [{"delta": {"content": d}}]})
+        yield "data: [DONE]"
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    monkeypatch.setattr(ob, "get_sbert_model", lambda _v=None: FakeSbert())
+    monkeypatch.setattr(ob, "get_cross_encoder", lambda _v=None: None)
+    monkeypatch.setattr(ob, "USE_ANSWER_CACHE", False)
+    ob.usar_corpus_local([
+        {"pagina": "COSANPA - Gestão de contratos", "file_id": "f1",
+         "texto": "Aditivo contratual: prazo de 30 dias para análise do fiscal. " * 5},
+    ])
+    monkeypatch.setattr(ob.session, "post",
+                        lambda url, json=None, timeout=None, stream=False: _StreamResp(["O prazo", " é 30 dias."], 0.01))
+    yield
+    ob.usar_corpus_local(None)
+
+
+def test_http_span_excludes_time_spent_by_the_consumer(backend):
+    n_traces = len(ob._TELEMETRY_RING.snapshot())
+    for _trecho in ob.responder_pergunta_stream("qual o prazo do aditivo?", history=[]):
+        time.sleep(0.2)  # renderização lenta no consumidor
+
+    trace = ob._TELEMETRY_RING.snapshot()[n_traces:][-1]
+    assert trace["origem"] == "stream"
+    assert 0.02 <= trace["spans"]["http"] < 0.15
+    assert trace["meta"]["ttft"] < 0.15